@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# Benchmarks for 8ball-tmr.  Run it from this directory:
+#   python3 benchmark.py
+#
+# Builds corpora of made-up quotes and times loading them and picking quotes out of them
+# every way there is, compared with reading the whole corpus into a list like v1.0 did.
+
+# v1.0 - Initial release.
+
+import os
+import random
+import tempfile
+import time
+
+import handler
+
+# How many times each benchmark is run.  The fastest run is the one reported.
+repeats = 5
+
+# Run a function a few times over.  Returns the fastest time, in seconds.
+def fastest(function):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return(best)
+
+# Write a corpus of made-up quotes, some of them weighted.  Returns the path to it.
+def make_corpus(directory, size):
+    random.seed(1)
+    words = [ "fire", "extinguisher", "hazmat", "suit", "science", "magic", "safe",
+        "explosions", "dexterity", "movie" ]
+    path = os.path.join(directory, "quotes-" + str(size) + ".txt")
+    with open(path, "w", encoding="utf-8") as output:
+        for i in range(size):
+            if not i % 10:
+                output.write(str(random.randint(1, 5)) + "\t")
+            output.write(" ".join(random.choices(words, k=10)).capitalize() + ".\n")
+    return(path)
+
+# Read a whole corpus into a list of strings.
+def read_list(path):
+    with open(path, encoding="utf-8") as input:
+        return([ i.rstrip("\n") for i in input ])
+
+def benchmark_corpus(path, size):
+    picks = 10000
+    stat = os.stat(path)
+    print("%d quotes:" % size)
+    print("    %-8s %10.1f ms to load" % ("list", fastest(lambda: read_list(path)) * 1000))
+    for selection in handler.selections:
+        handler.selection = selection
+        handler.corpus_file = path
+        handler.corpus = None
+        load = fastest(lambda: handler.load(path, stat))
+        handler.handle(None, None)
+        pick = fastest(lambda: [ handler.handle(None, None) for i in range(picks) ])
+        print("    %-8s %10.1f ms to load, %6.2f us a quote" % (selection, load * 1000,
+            pick * 1000000 / picks))
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    for size in [ 1000, 1000000 ]:
+        path = make_corpus(directory, size)
+        benchmark_corpus(path, size)
+        os.remove(path)
+    os.rmdir(directory)
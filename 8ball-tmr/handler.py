@@ -1,29 +1,213 @@
 # This is a simple little magic 8 ball function, inspired by The Modern Rogue
 # Discord server.
+#
+# The quotes live in a corpus file, one to a line (quotes.txt next to this
+# file, unless the corpus_file environment variable says otherwise).  Blank
+# lines and lines starting with # are skipped.  A quote can start with a
+# weight and a tab ("3<tab>That looks safe.") to come up more or less often
+# than the others, which all have a weight of 1.
+#
+# The corpus is memory mapped, and only the offsets of the quotes are kept, so
+# the quotes themselves aren't loaded until they're picked.  If the corpus
+# changes, it's loaded again on the next request; replace the file (write a
+# new one and rename it over the old one) instead of writing over it, so that
+# the old one doesn't change underneath a request that's still using it.
+#
+# How quotes are picked is up to the selection environment variable:
+#   random   - Any quote, every time (the default, and what anything else means).
+#   weighted - Quotes with bigger weights come up more often.
+#   shuffle  - Every quote comes up once before any of them come up again.
 
+# v2.0 - Moved the quotes out into a memory mapped corpus which is loaded
+#        again when it changes, and added weighted and shuffled selection.
+# v1.0 - Initial release.
+
+import bisect
+import mmap
+import os
 import random
+import re
+import string
+import threading
 
-responses = [
-    "Sounds like an injury counter reset to me.",
-    "How many fingers do you need to do magic?",
-    "Just because it's in the name of science doesn't mean it's a good idea.",
-    "You're only doing this because you saw it in a movie, aren't you?",
-    "Don't forget the fire extinguisher.",
-    "You're gonna want more than eye protection for that one.",
-    "I need the dexterity.",
-    "Why is it that whenever we hang out I find myself in a hazmat suit?",
-    "I grabbed these weeds from a local area.",
-    "Imagine these in the hands of someone who knows what they're doing!",
-    "That looks safe.",
-    "All those years of _Duck Hunt_ finally paid off!",
-    "Yarrrr, there be explosions in here...."
-    ]
+from array import array
 
-def handle(event, context):
-    response = random.choice(responses)
+corpus_file = os.environ.get("corpus_file",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "quotes.txt"))
+selection = os.environ.get("selection", "random")
+selections = [ "random", "weighted", "shuffle" ]
+
+# A weight at the start of a line.
+weight_pattern = re.compile(rb"(\d+(?:\.\d*)?)\t")
+
+# Bytes that a line can start with if it isn't just a quote.
+special_bytes = frozenset(b"0123456789#" + string.whitespace.encode("ascii"))
+
+# The corpus currently loaded.  It's replaced all at once when the file changes, so a
+# request that's already picking a quote from the old one can finish.
+corpus = None
+
+# Held while the corpus is being loaded and while the shuffle bag is being drawn from.
+lock = threading.Lock()
+
+# Load the corpus.  Returns a hash table of the file's stat() result, the memory map, and
+# an index: where every quote starts, and if selection is weighted, the running total of
+# their weights.  Raises OSError if the file can't be read or ValueError if it's empty.
+def load(path, stat):
+    with open(path, "rb") as input:
+        quotes = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+
+    starts = array("Q")
+    weights = array("d")
+    total = 0.0
+    find = quotes.find
+    size = len(quotes)
+    position = 0
+    while position < size:
+        end = find(b"\n", position)
+        if end == -1:
+            end = size
+        start = position
+        weight = 1.0
+        position = end + 1
+
+        # Most lines are just quotes.  The ones which start with anything else might be
+        # weighted, blank, or comments.
+        if quotes[start] in special_bytes:
+            match = weight_pattern.match(quotes, start, end)
+            if match:
+                weight = float(match.group(1))
+                start = match.end()
+            if start == end or quotes[start:end].isspace() or quotes[start] == ord("#") or \
+                    weight <= 0:
+                continue
+
+        starts.append(start)
+        if selection == "weighted":
+            total = total + weight
+            weights.append(total)
+
+    if not starts:
+        raise ValueError("There are no quotes in " + path + ".")
+
+    loaded = {}
+    loaded["stat"] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    loaded["quotes"] = quotes
+    loaded["starts"] = starts
+    loaded["weights"] = weights
+    # The shuffle bag: the quotes which haven't come up yet are the first "remaining" of
+    #   these, in no particular order.
+    loaded["bag"] = array("Q", range(len(starts))) if selection == "shuffle" else None
+    loaded["remaining"] = len(starts)
+    return(loaded)
+
+# Returns the corpus, after loading it again if the file has changed since the last time.
+def current_corpus():
+    global corpus
+    stat = os.stat(corpus_file)
+    if corpus is None or corpus["stat"] != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+        with lock:
+            if corpus is None or \
+                    corpus["stat"] != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                corpus = load(corpus_file, stat)
+    return(corpus)
 
+# Pick which quote to send back.  Returns its number.
+def pick(loaded):
+    if selection == "weighted":
+        weights = loaded["weights"]
+        return(min(bisect.bisect_right(weights, random.random() * weights[-1]),
+            len(weights) - 1))
+
+    if selection == "shuffle":
+        # One step of a Fisher-Yates shuffle: swap a random quote that hasn't come up yet
+        # to the end of the ones that haven't, and that's the one.  When they've all come
+        # up, start again.
+        with lock:
+            bag = loaded["bag"]
+            if not loaded["remaining"]:
+                loaded["remaining"] = len(bag)
+            remaining = loaded["remaining"] - 1
+            i = random.randint(0, remaining)
+            (bag[i], bag[remaining]) = (bag[remaining], bag[i])
+            loaded["remaining"] = remaining
+            return(bag[remaining])
+
+    return(random.randrange(len(loaded["starts"])))
+
+# Returns the text of a quote.
+def quote(loaded, number):
+    quotes = loaded["quotes"]
+    start = loaded["starts"][number]
+    end = quotes.find(b"\n", start)
+    if end == -1:
+        end = len(quotes)
+    return(quotes[start:end].decode("utf-8", "replace").rstrip())
+
+def handle(event, context):
     response_body = {}
+    try:
+        loaded = current_corpus()
+    except (OSError, ValueError) as e:
+        response_body["statusCode"] = 500
+        response_body["body"] = "The magic 8 ball is broken: " + str(e)
+        return(response_body)
+
     response_body["statusCode"] = 200
-    response_body["body"] = response
+    response_body["body"] = quote(loaded, pick(loaded))
 
     return(response_body)
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+
+    print("Unit testing mode enabled.")
+    if selection not in selections:
+        print("selection has to be one of: " + ", ".join(selections) + ".")
+        sys.exit(1)
+    print(handle(None, None))
+
+    directory = tempfile.mkdtemp()
+    corpus_file = os.path.join(directory, "quotes.txt")
+    with open(corpus_file, "w", encoding="utf-8") as output:
+        output.write("# Comments and blank lines aren't quotes.\n\nOne.\r\n2\tTwo.\n" +
+            "0\tNever.\n3 is not a weight.\nFïve.")
+    expected = [ "One.", "Two.", "3 is not a weight.", "Fïve." ]
+
+    for selection in selections:
+        corpus = None
+        picked = [ handle(None, None)["body"] for i in range(4000) ]
+        if sorted(set(picked)) != sorted(expected):
+            print("With " + selection + " selection, picked " + str(sorted(set(picked))) +
+                " instead of " + str(expected) + ".")
+            sys.exit(1)
+        if selection == "weighted" and not 1400 < picked.count("Two.") < 1800:
+            print("Two. has a weight of 2, so it should come up about 1600 times out " +
+                "of 4000, not " + str(picked.count("Two.")) + ".")
+            sys.exit(1)
+        if selection == "shuffle":
+            for i in range(0, len(picked), len(expected)):
+                if sorted(picked[i:i + len(expected)]) != sorted(expected):
+                    print("The shuffle bag repeated a quote: " +
+                        str(picked[i:i + len(expected)]))
+                    sys.exit(1)
+    print("Picked quotes every way.")
+
+    # Replace the corpus the way it's supposed to be replaced.
+    time.sleep(0.01)
+    with open(corpus_file + ".new", "w", encoding="utf-8") as output:
+        output.write("A new quote.\n")
+    os.replace(corpus_file + ".new", corpus_file)
+    if handle(None, None)["body"] != "A new quote.":
+        print("Didn't load the corpus again when it changed.")
+        sys.exit(1)
+    print("Loaded the corpus again when it changed.")
+
+    os.remove(corpus_file)
+    if handle(None, None)["statusCode"] != 500:
+        print("Didn't complain when the corpus went missing.")
+        sys.exit(1)
+    os.rmdir(directory)
+    sys.exit(0)
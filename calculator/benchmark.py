@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# Benchmarks for the calculator.  Run it from this directory:
+#   python3 benchmark.py
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# v1.1 - Added multi-expression and vectorized mode.
+# v1.0 - Initial release.  Compile cache.
+
+import json
+import random
+import time
+import types
+
+import engine
+import handler
+
+# How many times each benchmark is run.  The fastest run is the one reported.
+repeats = 5
+
+# Run every expression in a corpus through the calculator, a few times over.  Returns the
+#   fastest time per expression, in microseconds.
+def benchmark(corpus):
+    fastest = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        for expression in corpus:
+            handler.handle(expression, None)
+        elapsed = time.perf_counter() - start
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+    return(fastest * 1000000 / len(corpus))
+
+# Build a corpus of math problems of about the given number of operators apiece.  Returns
+#   a list of events.
+def corpus(size, operators):
+    problems = []
+    random.seed(1)
+    for i in range(size):
+        problem = str(random.randint(1, 1000))
+        for j in range(operators):
+            problem = problem + " " + random.choice("+-*/") + " " + str(random.randint(1, 1000))
+        problems.append(types.SimpleNamespace(body=problem.encode("utf-8")))
+    return(problems)
+
+# Time the same problems with the compile cache turned off, and with every one of them
+#   already in the cache.
+def benchmark_cache():
+    cache_size = engine.cache_size
+    for operators in [ 1, 10, 100 ]:
+        problems = corpus(1000, operators)
+        engine.cache_size = 0
+        engine.clear_cache()
+        uncached = benchmark(problems)
+        engine.cache_size = len(problems)
+        cached = benchmark(problems)
+        print("%3d operators: %8.2f us parsed, %8.2f us cached (%.1fx)" % (operators,
+            uncached, cached, uncached / cached))
+    engine.cache_size = cache_size
+    engine.clear_cache()
+
+# Time a list of problems sent one request apiece, and all in one request.
+def benchmark_multiple():
+    problems = corpus(50, 5)
+    separate = benchmark(problems)
+    together = benchmark([ types.SimpleNamespace(body=b"\n".join([ i.body
+        for i in problems ])) ])
+    print("%d problems: %8.2f us in separate requests, %8.2f us in one request (%.1fx)" %
+        (len(problems), separate * len(problems), together,
+        separate * len(problems) / together))
+
+# Time one expression over columns of numbers with NumPy, and one row at a time.
+def benchmark_columns():
+    random.seed(1)
+    for rows in [ 100, 10000 ]:
+        request = types.SimpleNamespace(body=json.dumps({
+            "expression": "price * quantity * (1 + tax) + shipping fmod 7",
+            "variables": { "price": [ random.uniform(1, 100) for i in range(rows) ],
+                "quantity": [ random.randint(1, 10) for i in range(rows) ],
+                "tax": 0.0825, "shipping": [ random.uniform(0, 20) for i in range(rows) ]
+            } }).encode("utf-8"))
+        vectorized = benchmark([ request ])
+        numpy = handler.numpy
+        handler.numpy = None
+        rowwise = benchmark([ request ])
+        handler.numpy = numpy
+        print("%5d rows: %10.2f us vectorized, %10.2f us a row at a time (%.1fx)" % (rows,
+            vectorized, rowwise, rowwise / vectorized))
+
+if __name__ == "__main__":
+    benchmark_cache()
+    benchmark_multiple()
+    benchmark_columns()
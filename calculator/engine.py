@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# Expression engine for the calculator.  Breaks a math problem up into tokens, parses them
+# by precedence climbing (so 16 + 18 / 2 is 25, not 17), and compiles the result into a
+# tree of closures which can be called to get the answer.  Compiled expressions are kept
+# in an LRU cache, so an expression which has been seen before isn't parsed again.
+#
+# Expressions can have variables in them.  They can be compiled for plain Python numbers,
+# or for NumPy arrays, in which case every variable is a column of numbers and the whole
+# column is worked out at once.
+#
+# Expressions are kept on a budget.  The tokenizer stops as soon as an expression has more
+# tokens than it's allowed, and whole numbers (which Python lets get as big as they like)
+# can't get more than max_bits long, either as they're typed in or along the way to the
+# answer.
+
+# v1.2 - Added limits on the number of tokens and the size of whole numbers.
+# v1.1 - Added variables, and compiling expressions for NumPy arrays.
+# v1.0 - Initial release.
+
+import math
+import operator
+import os
+import re
+
+from collections import OrderedDict
+
+# Vectorized expressions need NumPy.  If it isn't installed, they can't be compiled.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Binary operators and how tightly they bind.  Everything is left associative.
+binary_operators = {
+    "+": 1,
+    "-": 1,
+    "*": 2,
+    "/": 2,
+    "fmod": 2
+    }
+
+# Functions of one argument.  They can go in front of what they work on (abs -5, abs(-5))
+#   or, like the old calculator, after it (-5 abs).
+functions = [ "abs", "ceil", "fabs" ]
+
+# Longest that a whole number is allowed to get, in bits.
+max_bits = int(os.environ.get("max_bits", 4096))
+
+# Raised when an expression goes over its budget.  status is the HTTP status code to send
+#   back: 413 if there's too much of it, 422 if it's too much work.
+class BudgetExceeded(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+# Raise BudgetExceeded if a whole number is too big.  Returns the number.
+def check_bits(value):
+    if type(value) is int and value.bit_length() > max_bits:
+        raise BudgetExceeded(422, "A whole number in the answer would be more than " +
+            str(max_bits) + " bits long.")
+    return(value)
+
+# Wrap an operation so that whole numbers that come out of it are checked.
+def bounded(function):
+    def operation(*arguments):
+        value = function(*arguments)
+        if type(value) is int and value.bit_length() > max_bits:
+            check_bits(value)
+        return(value)
+    return(operation)
+
+# Turn the text of a number into an int if it's a whole number, or a float if it isn't.
+#   Every digit is worth more than three bits, so numbers with too many digits aren't
+#   even converted.
+def number(text):
+    if "." in text or "e" in text:
+        return(float(text))
+    if (len(text) - 1) * 3 > max_bits:
+        raise BudgetExceeded(422, "A whole number in the expression is more than " +
+            str(max_bits) + " bits long.")
+    return(check_bits(int(text)))
+
+# What every operator and function does to plain numbers.  The ones which can make whole
+#   numbers bigger are bounded.
+scalar_operations = {
+    "+": bounded(operator.add),
+    "-": bounded(operator.sub),
+    "*": bounded(operator.mul),
+    "/": operator.truediv,
+    "fmod": math.fmod,
+    "abs": abs,
+    "ceil": bounded(math.ceil),
+    "fabs": math.fabs,
+    "negate": operator.neg,
+    "positive": operator.pos,
+    "number": number
+    }
+
+# What they do to NumPy arrays.  Everything is a floating point number, so nothing needs
+#   to be bounded.
+array_operations = None
+if numpy is not None:
+    array_operations = dict(scalar_operations)
+    array_operations.update({
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "fmod": numpy.fmod,
+        "abs": numpy.abs,
+        "ceil": numpy.ceil,
+        "fabs": numpy.fabs,
+        "number": float
+        })
+
+# Unary operators.
+unary_operators = {
+    "-": "negate",
+    "+": "positive"
+    }
+
+# Picks the next token out of an expression.  Anything which doesn't match is a mistake.
+token_pattern = re.compile(r"""\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?) |
+    (?P<name>[a-z_][a-z0-9_]*) |
+    (?P<symbol>[-+*/()])
+    )""", re.VERBOSE)
+
+# Maximum number of compiled expressions to keep.  0 turns the cache off.
+cache_size = int(os.environ.get("compile_cache_size", 1024))
+
+# The cache itself, least recently used expressions first.
+cache = OrderedDict()
+cache_stats = { "hits": 0, "misses": 0, "evictions": 0 }
+
+# Expressions which are the same apart from spacing and capitalization are the same
+#   expression.  Returns a string.
+def normalize(text):
+    return(" ".join(text.lower().split()))
+
+# Break an expression up into tokens.  Returns a list of (kind, text, position) tuples, or
+#   raises ValueError and says where the problem is.  If there are more than max_tokens
+#   of them, raises BudgetExceeded without looking at the rest.
+def tokenize(text, max_tokens=None):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = token_pattern.match(text, position)
+        if not match:
+            position = len(text) - len(text[position:].lstrip())
+            raise ValueError("I don't understand '" + text[position:].split()[0] +
+                "' at position " + str(position + 1) + ".")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind), match.start(kind)))
+        position = match.end()
+        if max_tokens is not None and len(tokens) > max_tokens:
+            raise too_many_tokens(max_tokens)
+    return(tokens)
+
+def too_many_tokens(max_tokens):
+    return(BudgetExceeded(413, "There are more than " + str(max_tokens) + " tokens to " +
+        "work out."))
+
+# Returns the names of the variables in a list of tokens.
+def variable_names(tokens):
+    names = set()
+    for (kind, text, position) in tokens:
+        if kind == "name" and text not in functions and text not in binary_operators:
+            names.add(text)
+    return(names)
+
+# Closures that make up a compiled expression.  Every one of them takes a hash table of
+#   the values of the variables and returns a number (or an array of them).
+def constant(value):
+    return(lambda values: value)
+
+def variable(name):
+    return(lambda values: values[name])
+
+def unary(function, operand):
+    return(lambda values: function(operand(values)))
+
+# A run of binary operators (1 + 2 * 3 - 4 is 1, then + (2 * 3), then - 4) is worked out
+#   in a loop instead of as a closure per operator, so long expressions don't run into
+#   Python's recursion limit.
+def chain(first, rest):
+    def evaluate(values):
+        value = first(values)
+        for (function, operand) in rest:
+            value = function(value, operand(values))
+        return(value)
+    return(evaluate)
+
+# Returns the text of the token at a position, or None if there aren't any more.
+def peek(tokens, position):
+    if position < len(tokens):
+        return(tokens[position][1])
+    return(None)
+
+# Raise a ValueError about the token at a position.
+def unexpected(tokens, position):
+    if position >= len(tokens):
+        raise ValueError("The expression ended before I expected it to.")
+    if position and variable_names(tokens[position - 1:position]):
+        # Probably a function that I don't have.
+        position = position - 1
+    raise ValueError("I didn't expect '" + tokens[position][1] + "' at position " +
+        str(tokens[position][2] + 1) + ".")
+
+# Parse a number, a variable, or a parenthesized expression.  Returns a closure and the
+#   position of the next token.  Every parse_*() function takes the hash table of
+#   operations to compile the expression with.
+def parse_primary(tokens, position, operations):
+    if position < len(tokens) and tokens[position][0] == "number":
+        return((constant(operations["number"](tokens[position][1])), position + 1))
+    if position < len(tokens) and tokens[position][0] == "name":
+        name = tokens[position][1]
+        if name not in functions and name not in binary_operators:
+            return((variable(name), position + 1))
+    if peek(tokens, position) == "(":
+        (node, position) = parse_expression(tokens, position + 1, 1, operations)
+        if peek(tokens, position) != ")":
+            unexpected(tokens, position)
+        return((node, position + 1))
+    unexpected(tokens, position)
+
+# Parse anything in front of an operand (signs and functions), and then the operand.
+def parse_prefix(tokens, position, operations):
+    token = peek(tokens, position)
+    if token in unary_operators:
+        (node, position) = parse_prefix(tokens, position + 1, operations)
+        return((unary(operations[unary_operators[token]], node), position))
+    if token in functions:
+        (node, position) = parse_prefix(tokens, position + 1, operations)
+        return((unary(operations[token], node), position))
+    return(parse_primary(tokens, position, operations))
+
+# Parse an operand, and any functions written after it.
+def parse_operand(tokens, position, operations):
+    (node, position) = parse_prefix(tokens, position, operations)
+    while peek(tokens, position) in functions:
+        node = unary(operations[peek(tokens, position)], node)
+        position = position + 1
+    return((node, position))
+
+# Precedence climbing: parse operands joined by binary operators which bind at least as
+#   tightly as min_precedence.  Returns a closure and the position of the next token.
+def parse_expression(tokens, position, min_precedence, operations):
+    (first, position) = parse_operand(tokens, position, operations)
+    rest = []
+    while True:
+        token = peek(tokens, position)
+        if token not in binary_operators:
+            break
+        precedence = binary_operators[token]
+        if precedence < min_precedence:
+            break
+        (right, position) = parse_expression(tokens, position + 1, precedence + 1,
+            operations)
+        rest.append((operations[token], right))
+    if not rest:
+        return((first, position))
+    return((chain(first, rest), position))
+
+# Parse a whole expression.  Returns a hash table of the closure ("evaluate"), the names of
+#   the variables in it, and how many tokens and operations there are in it.  Raises
+#   ValueError if it doesn't make sense, or BudgetExceeded.
+def parse(text, operations=scalar_operations, max_tokens=None):
+    tokens = tokenize(text, max_tokens)
+    if not tokens:
+        raise ValueError("There's nothing to calculate.")
+    try:
+        (node, position) = parse_expression(tokens, 0, 1, operations)
+    except RecursionError:
+        raise ValueError("The expression is nested too deeply.")
+    except OverflowError:
+        raise ValueError("A number in the expression is too big.")
+    if position != len(tokens):
+        unexpected(tokens, position)
+
+    compiled = {}
+    compiled["evaluate"] = node
+    compiled["variables"] = frozenset(variable_names(tokens))
+    compiled["tokens"] = len(tokens)
+    compiled["operations"] = len([ i for i in tokens if i[1] in binary_operators or
+        i[1] in functions or i[1] in unary_operators ])
+    return(compiled)
+
+# Compile an expression, or get it from the cache if it's been compiled before.  If
+#   vectorized is True, it's compiled for NumPy arrays.  Returns a hash table like parse()
+#   does; "evaluate" takes a hash table of the values of the variables and returns the
+#   answer.  Raises ValueError if the expression doesn't make sense, or BudgetExceeded if
+#   it has more than max_tokens tokens.
+def compile_expression(text, vectorized=False, max_tokens=None):
+    key = (normalize(text), vectorized)
+    if key in cache:
+        cache_stats["hits"] = cache_stats["hits"] + 1
+        cache.move_to_end(key)
+        if max_tokens is not None and cache[key]["tokens"] > max_tokens:
+            raise too_many_tokens(max_tokens)
+        return(cache[key])
+
+    cache_stats["misses"] = cache_stats["misses"] + 1
+    if vectorized and array_operations is None:
+        raise ValueError("Vectorized expressions need NumPy, which isn't installed.")
+    compiled = parse(text.lower(), array_operations if vectorized else scalar_operations,
+        max_tokens)
+    if cache_size:
+        cache[key] = compiled
+        while len(cache) > cache_size:
+            cache.popitem(last=False)
+            cache_stats["evictions"] = cache_stats["evictions"] + 1
+    return(compiled)
+
+# Empty the cache and reset its statistics.
+def clear_cache():
+    cache.clear()
+    for i in cache_stats:
+        cache_stats[i] = 0
@@ -1,8 +1,46 @@
-from calculator.simple import SimpleCalculator
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# A simple calculator.  Send it a math problem and it sends back the answer.
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# v2.2 - Added a budget for every request.  Requests with too many tokens in them get
+#        a 413, and requests whose whole numbers get too big or which take too long to
+#        work out get a 422, so that one big request can't hold up everyone else's.
+#        What every request cost is sent back in X-Cost-* headers.
+# v2.1 - Added multi-expression mode.  A JSON array of expressions, or one expression
+#        per line, are all worked out in one request.  Added variables, and a
+#        vectorized mode which works one expression out over columns of numbers with
+#        NumPy, all at once.
+# v2.0 - Replaced SimpleCalculator with an expression engine (engine.py).  It knows
+#        that multiplication and division come before addition and subtraction (16 + 18
+#        / 2 is 25, not 17), understands parentheses, doesn't need spaces between
+#        everything, and keeps compiled expressions around so that the same problem sent
+#        over and over again is only parsed once.  Whole numbers stay whole numbers.
+# v1.0 - Initial release.
+
+import json
+import math
+import os
+import time
+
+try:
+    from . import engine
+except ImportError:
+    import engine
+
+# Vectorized mode needs NumPy.  If it isn't installed, the expression is worked out one row
+# at a time.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 help = """
-I am a simple calculator.  Send me math problems where the terms and symbols
-are separated by spaces, and I'll send back the answer.  For example:
+I am a simple calculator.  Send me math problems and I'll send back the answer.
+For example:
 
 2 + 2
 
@@ -10,6 +48,15 @@ are separated by spaces, and I'll send back the answer.  For example:
 
 5 fmod 3
 
+16 + 18 / 2
+
+(16 + 18) / 2
+
+abs(3 - 10)
+
+Multiplication, division, and fmod come before addition and subtraction, and
+parentheses come before everything.
+
 I support the following operations:
 
     + - * /
@@ -18,8 +65,256 @@ I support the following operations:
     ceil - ceiling
     fabs - absolute value (floating point)
 
+abs, ceil, and fabs can go before what they work on (ceil 2.5, ceil(2.5)) or
+after it (2.5 ceil).
+
+To work out a bunch of problems at once, send one per line, or a JSON array of
+them:
+
+    [ "2 + 2", "16 + 18 / 2", "1 / 0" ]
+
+and you'll get back a JSON array with an answer or an error for every one:
+
+    [ {"result": 4}, {"result": 25.0}, {"error": "..."} ]
+
+To work one problem out for a bunch of different numbers, use variables and send
+columns of numbers for them:
+
+    {
+        "expression": "price * quantity + shipping",
+        "variables": {
+            "price": [ 1.5, 2.25, 10 ],
+            "quantity": [ 4, 1, 3 ],
+            "shipping": 5
+        }
+    }
+
+Every variable is a list of numbers (all the same length), or one number to use
+for every row.  You'll get back a JSON array with an answer or an error for
+every row.  Every answer is a floating point number.
 """
 
+# Most tokens that can be in one request, all of its expressions together.
+max_tokens = int(os.environ.get("max_tokens", 10000))
+
+# Most seconds that working out one request can take.
+time_budget = float(os.environ.get("time_budget", 0.5))
+
+# How many rows of a vectorized request are worked out at a time.  The time budget is
+#   checked between chunks.
+chunk_rows = 65536
+
+# What numbers in JSON documents turn into.
+number_types = set([ int, float ])
+
+# Error for answers which JSON can't hold.
+not_finite = "The answer isn't a finite number."
+
+# Build a response which carries a JSON document.
+def json_response(document):
+    response = {}
+    response["statusCode"] = 200
+    response["body"] = json.dumps(document)
+    response["headers"] = { "Content-Type": "application/json" }
+    return(response)
+
+# Build a response which carries an error.
+def error_response(error, status=400):
+    response = {}
+    response["statusCode"] = status
+    response["body"] = error
+    return(response)
+
+# Start keeping track of what a request costs.  Returns a hash table.
+def new_cost():
+    return({ "started": time.perf_counter(), "tokens": 0, "operations": 0, "rows": 0,
+        "bits": 0 })
+
+# Compile an expression on a request's budget.  Returns what
+#   engine.compile_expression() does.  Raises ValueError or engine.BudgetExceeded.
+def compile_expression(expression, cost, vectorized=False):
+    try:
+        compiled = engine.compile_expression(expression, vectorized,
+            max_tokens - cost["tokens"])
+    except engine.BudgetExceeded as e:
+        if e.status == 413 and cost["tokens"]:
+            raise engine.BudgetExceeded(413, "There are more than " + str(max_tokens) +
+                " tokens in the request.")
+        raise
+    cost["tokens"] = cost["tokens"] + compiled["tokens"]
+    return(compiled)
+
+# Count the operations which went into working out a compiled expression some number of
+#   times, and raise engine.BudgetExceeded if the request has run out of time.
+def spend(cost, compiled, rows):
+    cost["operations"] = cost["operations"] + compiled["operations"] * rows
+    cost["rows"] = cost["rows"] + rows
+    check_time(cost)
+
+# Raise engine.BudgetExceeded if a request has run out of time.
+def check_time(cost):
+    if time.perf_counter() - cost["started"] > time_budget:
+        raise engine.BudgetExceeded(422, "Working that out took more than " +
+            str(time_budget) + " seconds.")
+
+# Add what a request cost to the headers of its response.
+def report_cost(response, cost):
+    response.setdefault("headers", {}).update({
+        "X-Cost-Tokens": "%d" % cost["tokens"],
+        "X-Cost-Operations": "%d" % cost["operations"],
+        "X-Cost-Rows": "%d" % cost["rows"],
+        "X-Cost-Bits": "%d" % cost["bits"],
+        "X-Cost-Microseconds": "%d" % ((time.perf_counter() - cost["started"]) * 1000000)
+        })
+    return(response)
+
+# Work out a compiled expression, with the given values for its variables.  Returns
+#   { "result": <answer> } or { "error": "<what went wrong>" }.
+def evaluate(compiled, values, cost):
+    missing = compiled["variables"] and compiled["variables"].difference(values)
+    if missing:
+        return({ "error": "I don't know what " + ", ".join(sorted(missing)) + " is." })
+    try:
+        answer = compiled["evaluate"](values)
+    except (ArithmeticError, ValueError) as e:
+        return({ "error": "Couldn't calculate that: " + str(e) })
+    if type(answer) is int:
+        cost["bits"] = max(cost["bits"], answer.bit_length())
+    return({ "result": answer })
+
+# Work out one expression.  Returns { "result": <answer> } or
+#   { "error": "<what went wrong>" }.  Raises engine.BudgetExceeded.
+def calculate(expression, cost):
+    if not isinstance(expression, str):
+        return({ "error": "That isn't an expression." })
+    try:
+        compiled = compile_expression(expression, cost)
+    except ValueError as e:
+        check_time(cost)
+        return({ "error": "Couldn't parse that: " + str(e) })
+    result = evaluate(compiled, {}, cost)
+    spend(cost, compiled, 1)
+    return(result)
+
+# Turn results which JSON can't hold into errors.  Returns the list of results.
+def finite_results(results):
+    for i in range(len(results)):
+        answer = results[i].get("result")
+        if isinstance(answer, float) and not math.isfinite(answer):
+            results[i] = { "error": not_finite }
+    return(results)
+
+# Work out a list of expressions.  Returns a list of results.  Raises
+#   engine.BudgetExceeded.
+def calculate_all(expressions, cost):
+    return(finite_results([ calculate(i, cost) for i in expressions ]))
+
+# Check the variables of a vectorized request.  Returns a hash table of variable names
+#   (in lower case, like the expression) to arrays (or lists, without NumPy) of floats or
+#   floats, and how many rows there are.  Raises ValueError if they're not usable.
+def check_columns(variables):
+    columns = {}
+    rows = set()
+    if not isinstance(variables, dict):
+        raise ValueError("\"variables\" has to be a JSON object.")
+    for (name, column) in variables.items():
+        values = column if isinstance(column, list) else [ column ]
+        if not set(map(type, values)).issubset(number_types):
+            raise ValueError("The values of " + name + " have to be numbers.")
+        try:
+            if numpy is not None:
+                values = numpy.array(values, dtype=float)
+            else:
+                values = [ float(i) for i in values ]
+        except OverflowError:
+            raise ValueError("A value of " + name + " is too big.")
+        # Names aren't case sensitive, so X and x are the same variable.
+        if name.lower() in columns:
+            raise ValueError("There's more than one variable called " + name.lower() + ".")
+        if isinstance(column, list):
+            rows.add(len(column))
+            columns[name.lower()] = values
+        else:
+            columns[name.lower()] = values[0]
+    if len(rows) > 1:
+        raise ValueError("Every variable has to have the same number of values.")
+    return((columns, rows.pop() if rows else 1))
+
+# Work out one expression over columns of numbers.  With NumPy, the columns are worked
+#   out chunk_rows at a time, and the budget is checked between chunks.  Returns a list of
+#   results, one per row.  Raises ValueError or engine.BudgetExceeded.
+def calculate_columns(expression, columns, rows, cost):
+    if not isinstance(expression, str):
+        raise ValueError("\"expression\" has to be a string.")
+    try:
+        compiled = compile_expression(expression, cost, vectorized=numpy is not None)
+    except ValueError as e:
+        raise ValueError("Couldn't parse that: " + str(e))
+    missing = compiled["variables"].difference(columns)
+    if missing:
+        raise ValueError("I don't know what " + ", ".join(sorted(missing)) + " is.")
+
+    # Empty columns have nothing to work out.
+    if not rows:
+        return([])
+
+    if numpy is None:
+        results = []
+        for i in range(rows):
+            values = {}
+            for (name, column) in columns.items():
+                values[name] = column[i] if isinstance(column, list) else column
+            results.append(evaluate(compiled, values, cost))
+            spend(cost, compiled, 1)
+        return(finite_results(results))
+
+    answers = []
+    for start in range(0, rows, chunk_rows):
+        arrays = {}
+        for name in compiled["variables"]:
+            arrays[name] = columns[name]
+            if numpy.ndim(arrays[name]):
+                arrays[name] = arrays[name][start:start + chunk_rows]
+        with numpy.errstate(all="ignore"):
+            chunk = numpy.asarray(compiled["evaluate"](arrays), dtype=float)
+        answers.append(numpy.broadcast_to(chunk, (min(chunk_rows, rows - start),)))
+        spend(cost, compiled, len(answers[-1]))
+    answers = numpy.concatenate(answers)
+    return([ { "result": answer } if finite else { "error": not_finite }
+        for (answer, finite) in zip(answers.tolist(), numpy.isfinite(answers).tolist()) ])
+
+# Work out whatever was sent.  Returns a response.  Raises engine.BudgetExceeded.
+def solve(expression, cost):
+
+    # A JSON array is a list of expressions, and a JSON object is an expression and
+    # columns of numbers.  Expressions can't start with either.
+    if expression.lstrip()[:1] in [ "[", "{" ]:
+        try:
+            arguments = json.loads(expression)
+        except ValueError:
+            return(error_response("Couldn't deserialize request."))
+        if isinstance(arguments, list):
+            return(json_response(calculate_all(arguments, cost)))
+        try:
+            (columns, rows) = check_columns(arguments.get("variables", {}))
+            return(json_response(calculate_columns(arguments.get("expression"), columns,
+                rows, cost)))
+        except ValueError as e:
+            return(error_response(str(e)))
+
+    # More than one line is more than one expression.
+    lines = [ i for i in expression.splitlines() if i.strip() ]
+    if len(lines) > 1:
+        return(json_response(calculate_all(lines, cost)))
+
+    result = finite_results([ calculate(expression, cost) ])[0]
+    if "error" in result:
+        return(error_response(result["error"]))
+    response = {}
+    response["statusCode"] = 200
+    response["body"] = str(result["result"])
+    return(response)
+
 def handle(event, context):
 
     # Assume that no payload in the request means the user is asking for
@@ -30,11 +325,193 @@ def handle(event, context):
         response["body"] = help
         return(response)
 
-    calc = SimpleCalculator()
-    calc.run(event.body)
+    cost = new_cost()
+    try:
+        expression = event.body
+        if isinstance(expression, bytes):
+            expression = expression.decode("utf-8")
+    except UnicodeDecodeError:
+        return(error_response("Couldn't decode the request.  Send me text."))
 
-    response = {}
-    response["statusCode"] = 200
-    response["body"] = str(calc.lcd)
-    return(response)
+    try:
+        response = solve(expression, cost)
+    except engine.BudgetExceeded as e:
+        response = error_response(str(e), e.status)
+    return(report_cost(response, cost))
+
+if __name__ == "__main__":
+    import sys
+    import types
+
+    print("Unit testing mode engaged.")
+
+    # Problems and their answers.
+    test_vectors = [
+        ("2 + 2", "4"),
+        ("23 - 17", "6"),
+        ("5 fmod 3", "2.0"),
+        ("16 + 18 / 2", "25.0"),
+        ("(16 + 18) / 2", "17.0"),
+        ("23 * 5", "115"),
+        ("2 + 3 * 4 - 6 / 3", "12.0"),
+        ("10 - 4 - 3", "3"),
+        ("2*(3+4)*5", "70"),
+        ("-3 + 5", "2"),
+        ("2 * -3", "-6"),
+        ("- -3", "3"),
+        ("abs(3 - 10)", "7"),
+        ("abs -7", "7"),
+        ("-7 abs", "7"),
+        ("2.5 ceil", "3"),
+        ("ceil 2.5 + 1", "4"),
+        ("-3.5 fabs", "3.5"),
+        ("7.5 fmod 2 * 2", "3.0"),
+        ("1.5e3 / 1e1", "150.0"),
+        (".5 + .25", "0.75"),
+        ("  12   *   12  ", "144"),
+        ("CEIL(1.2)", "2"),
+        ("99999999999999999999 * 10", "999999999999999999990"),
+        (" + ".join([ "1" ] * 5000), "5000")
+        ]
+
+    failures = 0
+    for (expression, expected) in test_vectors:
+        response = handle(types.SimpleNamespace(body=expression.encode("utf-8")), None)
+        if response["statusCode"] != 200 or response["body"] != expected:
+            print("    " + expression[:40] + " came out as " + repr(response["body"]) +
+                ", not " + expected)
+            failures = failures + 1
+    print("Checked " + str(len(test_vectors)) + " problems: " + str(failures) +
+        " failures.")
+    print()
+
+    print("Trying problems that don't make sense.")
+    for expression in [ "2 +", "(2 + 3", "2 + 3)", "2 $ 3", "2 3", "fmod 3", "1 / 0",
+            "5 fmod 0", "sqrt 2", "(" * 1000 + "1" + ")" * 1000, " ", b"\xff",
+            "1e300 * 1e300", "1e308 * 10 - 1e308 * 10" ]:
+        if isinstance(expression, str):
+            expression = expression.encode("utf-8")
+        response = handle(types.SimpleNamespace(body=expression), None)
+        print("    " + repr(expression[:20]) + ": " + str(response["statusCode"]) + " " +
+            response["body"].strip().split("\n")[0])
+        if response["statusCode"] == 200:
+            failures = failures + 1
+    print()
+
+    print("Trying the compile cache.")
+    engine.clear_cache()
+    for expression in [ "16 + 18 / 2", "16+18/2 ", "16  +  18  /  2", "16 + 18 / 3" ]:
+        handle(types.SimpleNamespace(body=expression), None)
+    print("    " + str(engine.cache_stats))
+    if engine.cache_stats["hits"] != 1 or engine.cache_stats["misses"] != 3:
+        failures = failures + 1
+    print()
+
+    print("Trying more than one problem at once.")
+    expected = [ { "result": 4 }, { "result": 25.0 }, { "error": "Couldn't calculate "
+        "that: division by zero" }, { "result": 2 }, { "error": not_finite } ]
+    for body in [ "2 + 2\n16 + 18 / 2\n\n1 / 0\nceil 1.5\n1e308 * 10\n",
+            json.dumps([ "2 + 2", "16 + 18 / 2", "1 / 0", "ceil 1.5", "1e308 * 10" ]) ]:
+        response = handle(types.SimpleNamespace(body=body.encode("utf-8")), None)
+        if json.loads(response["body"]) != expected:
+            print("    " + repr(body) + " came out as " + response["body"])
+            failures = failures + 1
+    response = handle(types.SimpleNamespace(body=b'[ "x + 1", 42, "2 +" ]'), None)
+    print("    " + response["body"])
+    print()
+
+    print("Trying variables.")
+    request = { "expression": "Price * quantity + shipping - ceil(price) fmod 2",
+        "variables": { "price": [ 1.5, 2.25, 10, -3 ], "quantity": [ 4, 1, 3, 0 ],
+        "shipping": 5 } }
+    expected = []
+    for i in range(4):
+        price = request["variables"]["price"][i]
+        quantity = request["variables"]["quantity"][i]
+        expected.append({ "result": price * quantity + 5 - math.fmod(math.ceil(price), 2) })
+    for vectorized in [ True, False ]:
+        if not vectorized:
+            (numpy, saved) = (None, numpy)
+        response = handle(types.SimpleNamespace(body=json.dumps(request)), None)
+        if json.loads(response["body"]) != expected:
+            print("    Variables came out as " + response["body"] + ", not " +
+                json.dumps(expected))
+            failures = failures + 1
+        if not vectorized:
+            numpy = saved
+
+    request = { "expression": "1 / x", "variables": { "x": [ 2, 0, 4 ] } }
+    response = handle(types.SimpleNamespace(body=json.dumps(request)), None)
+    print("    Dividing by a column with a zero in it: " + response["body"])
+    if json.loads(response["body"])[1] != { "error": not_finite }:
+        failures = failures + 1
+    for vectorized in [ True, False ]:
+        if not vectorized:
+            (numpy, saved) = (None, numpy)
+        request = { "expression": "x + 1", "variables": { "x": [] } }
+        response = handle(types.SimpleNamespace(body=json.dumps(request)), None)
+        print("    Empty columns" + ("" if vectorized else ", a row at a time") + ": " +
+            str(response["statusCode"]) + " " + response["body"])
+        if response["statusCode"] != 200 or json.loads(response["body"]) != []:
+            failures = failures + 1
+        if not vectorized:
+            numpy = saved
+    for request in [ { "expression": "x + y", "variables": { "x": [ 1 ] } },
+            { "expression": "x", "variables": { "x": [ 1, "two" ] } },
+            { "expression": "x + y", "variables": { "x": [ 1, 2 ], "y": [ 1 ] } },
+            { "expression": "x", "variables": { "x": [ 1, 2 ], "X": [ 3, 4 ] } },
+            { "expression": "x +", "variables": { "x": [ 1 ] } },
+            { "expression": 42 }, "{ not json" ]:
+        body = request if isinstance(request, str) else json.dumps(request)
+        response = handle(types.SimpleNamespace(body=body), None)
+        print("    " + body + ": " + str(response["statusCode"]) + " " + response["body"])
+        if response["statusCode"] == 200:
+            failures = failures + 1
+    print()
+
+    print("Trying the budget.")
+    tests = [ ("more tokens than allowed", " + ".join([ "1" ] * 5001), 413),
+        ("more tokens than allowed, all together", json.dumps([ " + ".join([ "1" ] * 2000) ] * 3), 413),
+        ("a really long whole number", "9" * 2000, 422),
+        ("a really big answer", " * ".join([ "99999999999999999999" ] * 300), 422),
+        ("a really big answer with ceil", "ceil(1e308) * ceil(1e308) * ceil(1e308) * ceil(1e308) * ceil(1e308)", 422),
+        ("a really big float", "1e300 * 1e300", 400),
+        ("a big whole number that fits", "9" * 1000, 200) ]
+    for (name, body, status) in tests:
+        response = handle(types.SimpleNamespace(body=body), None)
+        print("    " + name + ": " + str(response["statusCode"]) + " " +
+            response["body"][:60] + " " + str(dict((i, j) for (i, j) in
+            response["headers"].items() if i.startswith("X-Cost"))))
+        if response["statusCode"] != status:
+            failures = failures + 1
+
+    # Cached expressions still count against the token budget.
+    engine.compile_expression(" + ".join([ "2" ] * 3000))
+    response = handle(types.SimpleNamespace(body=json.dumps([ " + ".join([ "2" ] * 3000) ] * 2)), None)
+    if response["statusCode"] != 413:
+        print("    Cached expressions aren't counted: " + str(response["statusCode"]))
+        failures = failures + 1
+
+    time_budget = 0.01
+    request = { "expression": "x * 2", "variables": { "x": list(range(1000000)) } }
+    response = handle(types.SimpleNamespace(body=json.dumps(request)), None)
+    print("    A million rows in " + str(time_budget) + " seconds: " +
+        str(response["statusCode"]) + " " + response["body"][:60])
+    if response["statusCode"] != 422:
+        failures = failures + 1
+    response = handle(types.SimpleNamespace(body="\n".join([ "1 +" ] * 100000)), None)
+    print("    Lots of broken expressions in " + str(time_budget) + " seconds: " +
+        str(response["statusCode"]) + " " + response["body"][:60])
+    if response["statusCode"] != 422:
+        failures = failures + 1
+    time_budget = 0.5
+
+    request = { "expression": "x * 2 + y", "variables": { "x": list(range(5)), "y": 1 } }
+    response = handle(types.SimpleNamespace(body=json.dumps(request)), None)
+    print("    Cost of a vectorized request: " + str(dict((i, j) for (i, j) in
+        response["headers"].items() if i.startswith("X-Cost"))))
+    if response["headers"]["X-Cost-Operations"] != "10" or response["headers"]["X-Cost-Rows"] != "5":
+        failures = failures + 1
+    print()
 
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# Benchmarks for coordinate-converter.  Run it from this directory:
+#   python3 benchmark.py [--save] [--threshold <percent>] [--baseline <file>]
+#
+# Times every conversion from one type to another, one at a time and in batches, and
+# compares the times with a saved baseline (benchmark_baseline.json, written by --save).
+# Anything which got slower than the threshold is flagged, and so is any conversion which
+# doesn't match benchmark_vectors.json.  Exits with 1 if anything was flagged.
+
+# v1.2 - Added known-good vectors for converting coordinates south and west of 0° to
+#        degrees/minutes/seconds, and made the DMS corpus with handler.dd_to_dms() now that
+#        it gets those right.
+# v1.1 - Added the conversion matrix, baselines, and known-good vectors.
+# v1.0 - Initial release.  Degrees/minutes/seconds parser.
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+
+import handler
+
+# How many times each micro-benchmark is run.  The fastest run is the one reported.
+repeats = 5
+
+# Types in the conversion matrix, and the batch sizes every pair of them is timed at.  A
+#   batch size of 1 is one request per set of coordinates.
+matrix_types = [ "dms", "dd", "pluscode", "mgrs", "geohash" ]
+batch_sizes = [ 1, 100, 10000 ]
+
+# Every pair is timed over about this many sets of coordinates at each batch size, in at
+#   least min_samples requests.
+items_per_case = 5000
+min_samples = 5
+
+# Default baseline, default percentage that a conversion has to slow down by to be flagged,
+#   and the known-good conversions.
+here = os.path.dirname(os.path.abspath(__file__))
+baseline_file = os.path.join(here, "benchmark_baseline.json")
+threshold = 20.0
+vectors_file = os.path.join(here, "benchmark_vectors.json")
+
+# The degrees/minutes/seconds parser from before v3.1 of handler.py, to compare against.
+#   Takes one coordinate at a time.
+def legacy_dms_to_dd(coordinate):
+    if re.search("[neNE]", coordinate):
+        sign = 1.0
+    else:
+        sign = -1.0
+
+    coordinate = filter(len, re.split("\\D+", coordinate, maxsplit=4))
+    coordinate = list(coordinate)
+
+    degrees = int(coordinate[0])
+    minutes = 0
+    seconds = 0
+    fraction_of_a_second = 0
+    if len(coordinate) >= 2:
+        minutes = int(coordinate[1])
+    if len(coordinate) >= 3:
+        seconds = int(coordinate[2])
+    if len(coordinate) >= 4:
+        fraction_of_a_second = int(coordinate[3])
+
+    seconds = str(seconds) + "." + str(fraction_of_a_second)
+    seconds = float(seconds)
+
+    return(sign * (float(degrees) + float(minutes / 60) + float(seconds / 3600)))
+
+def legacy_decode_dms(coordinates):
+    (latitude, longitude) = coordinates.split()
+    return((legacy_dms_to_dd(latitude), legacy_dms_to_dd(longitude)))
+
+# Run a function over every item of a corpus, a few times over.  Returns the fastest time
+#   per item, in microseconds.
+def benchmark(function, corpus):
+    fastest = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        for item in corpus:
+            function(item)
+        elapsed = time.perf_counter() - start
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+    return(fastest * 1000000 / len(corpus))
+
+# Print how long two functions took over the same corpus, and how much faster the second
+#   one is.
+def report(name, old, new):
+    print(name + ": " + "%.2f" % old + " us -> " + "%.2f" % new + " us (" +
+        "%.1f" % (old / new) + "x)")
+
+# Build a corpus of coordinates in degrees/minutes/seconds, written the ways which the old
+#   parser understood (a latitude and a longitude, each without spaces, with a hemisphere
+#   after it).  Returns a list of strings.
+def dms_corpus(size):
+    corpus = []
+    random.seed(1)
+    for i in range(size):
+        latitude = "%d°%d'%d.%02d\"%s" % (random.randint(0, 89), random.randint(0, 59),
+            random.randint(0, 59), random.randint(0, 99), random.choice("NS"))
+        longitude = "%d°%d'%d.%02d\"%s" % (random.randint(0, 179), random.randint(0, 59),
+            random.randint(0, 59), random.randint(0, 99), random.choice("EW"))
+        corpus.append(latitude + " " + longitude)
+    return(corpus)
+
+def benchmark_dms_parser():
+    corpus = dms_corpus(20000)
+    report("Parsing degrees/minutes/seconds", benchmark(legacy_decode_dms, corpus),
+        benchmark(handler.decode_dms, corpus))
+
+    # The old parser turned 10.05 seconds into 10.5 seconds.
+    wrong = 0
+    for i in corpus:
+        if legacy_decode_dms(i) != handler.decode_dms(i):
+            wrong = wrong + 1
+    print("    The old parser got " + str(wrong) + " of " + str(len(corpus)) + " wrong.")
+
+# Build a corpus of coordinates of one type, within the latitudes that UTM covers.  Returns
+#   a list of strings.
+def matrix_corpus(from_type, size):
+    corpus = []
+    random.seed(2)
+    for i in range(size):
+        latitude = random.uniform(-79.5, 83.5)
+        longitude = random.uniform(-179.9, 179.9)
+        corpus.append(handler.encode_from_dd(latitude, longitude, from_type))
+    return(corpus)
+
+# Turn a corpus into request bodies of batch_size sets of coordinates apiece (or one set of
+#   coordinates apiece, if batch_size is 1).  Returns a list of strings.
+def matrix_requests(corpus, from_type, to_type, batch_size):
+    bodies = []
+    for i in range(0, len(corpus), batch_size):
+        coordinates = corpus[i:i + batch_size]
+        if batch_size == 1:
+            coordinates = coordinates[0]
+        bodies.append(json.dumps({ "coordinates": coordinates, "from": from_type,
+            "to": to_type }))
+    return(bodies)
+
+# Returns the value that the given fraction of a list of numbers are less than or equal to.
+def percentile(values, fraction):
+    values = sorted(values)
+    return(values[min(len(values) - 1, int(fraction * len(values)))])
+
+# Time every request in a list, one at a time.  Returns a hash table of sets of
+#   coordinates converted per second and the median and 99th percentile time per request,
+#   in microseconds.
+def time_requests(bodies, batch_size):
+    latencies = []
+    for body in bodies:
+        start = time.perf_counter()
+        handler.handle(body)
+        latencies.append(time.perf_counter() - start)
+    return({ "ops_per_second": batch_size / percentile(latencies, 0.5),
+        "p50": percentile(latencies, 0.5) * 1000000,
+        "p99": percentile(latencies, 0.99) * 1000000 })
+
+# Time every pair of types at every batch size, with the cache turned off.  Returns a hash
+#   table of results, keyed by "<from> -> <to> x <batch size>".
+def matrix_results():
+    results = {}
+    handler.cache_size = 0
+
+    for from_type in matrix_types:
+        for batch_size in batch_sizes:
+            samples = max(min_samples, items_per_case // batch_size)
+            corpus = matrix_corpus(from_type, samples * batch_size)
+            for to_type in matrix_types:
+                bodies = matrix_requests(corpus, from_type, to_type, batch_size)
+                handler.handle(bodies[0])
+                name = from_type + " -> " + to_type + " x " + str(batch_size)
+                results[name] = time_requests(bodies, batch_size)
+    return(results)
+
+# Print the results, compared with the baseline if there is one.  Returns the number of
+#   results which are slower than the baseline by more than the threshold.
+def report_matrix(results, baseline, threshold):
+    regressions = 0
+    print("%-32s %14s %12s %12s %9s" % ("Conversion", "per second", "p50 (us)",
+        "p99 (us)", "change"))
+    for (name, result) in results.items():
+        line = "%-32s %14.0f %12.1f %12.1f" % (name, result["ops_per_second"],
+            result["p50"], result["p99"])
+        if name in baseline:
+            change = (result["p50"] / baseline[name]["p50"] - 1) * 100
+            line = line + " %+8.1f%%" % change
+            if change > threshold:
+                line = line + "  SLOWER"
+                regressions = regressions + 1
+        print(line)
+    return(regressions)
+
+# Convert every known-good vector, one at a time and (with enough copies of each vector to
+#   go through the vectorized engine) in batches, with the cache turned off.  The vectors
+#   came from the mgrs, geohash2, and openlocationcode modules by way of the scalar
+#   codecs.  Returns the number of conversions which didn't come out right.
+def check_vectors():
+    with open(vectors_file, encoding="utf-8") as input:
+        vectors = json.load(input)
+    handler.cache_size = 0
+    failures = 0
+
+    for vector in vectors:
+        result = handler.handle(json.dumps({ "coordinates": vector["coordinates"],
+            "from": vector["from"], "to": vector["to"] }))
+        if result != vector["result"]:
+            print("    " + vector["from"] + " -> " + vector["to"] + ": " +
+                vector["coordinates"] + " came out as " + repr(result) + ", not " +
+                repr(vector["result"]))
+            failures = failures + 1
+
+    copies = -(-handler.vectorize_threshold // len(vectors)) * len(matrix_types) ** 2
+    batch = [ { "coordinates": i["coordinates"], "from": i["from"], "to": i["to"] }
+        for i in vectors ] * copies
+    for (vector, result) in zip(vectors * copies, handler.convert_batch(batch)):
+        if result.get("result") != vector["result"]:
+            print("    " + vector["from"] + " -> " + vector["to"] + " in a batch: " +
+                vector["coordinates"] + " came out as " + repr(result) + ", not " +
+                repr(vector["result"]))
+            failures = failures + 1
+
+    print("Checking " + str(len(vectors)) + " known-good conversions: " + str(failures) +
+        " failures.")
+    return(failures)
+
+def benchmark_matrix(baseline_path, save, threshold):
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as input:
+            baseline = json.load(input)["results"]
+        print("Comparing with " + baseline_path + ", flagging anything more than " +
+            str(threshold) + "% slower.")
+    results = matrix_results()
+    regressions = report_matrix(results, baseline, threshold)
+    if regressions:
+        print(str(regressions) + " conversions are slower than the baseline.")
+
+    if save:
+        with open(baseline_path, "w") as output:
+            json.dump({ "python": platform.python_version(), "machine": platform.machine(),
+                "results": results }, output, indent=2)
+        print("Saved the results to " + baseline_path + ".")
+    return(regressions)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for coordinate-converter.")
+    parser.add_argument("--save", action="store_true",
+        help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=threshold,
+        help="flag conversions which are this many percent slower than the baseline")
+    parser.add_argument("--baseline", default=baseline_file,
+        help="file to compare with (and save to)")
+    arguments = parser.parse_args()
+
+    benchmark_dms_parser()
+    failures = check_vectors()
+    if failures:
+        # Fast and wrong isn't worth timing.
+        sys.exit(1)
+    regressions = benchmark_matrix(arguments.baseline, arguments.save, arguments.threshold)
+    sys.exit(1 if regressions else 0)
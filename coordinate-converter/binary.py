@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# Binary columnar format for coordinate-converter, for big batches of coordinates where
+# parsing and generating JSON would cost more than the conversions themselves.  This file
+# is also the reference client: it only needs NumPy, so it can be copied into anything
+# which talks to coordinate-converter, and if it's run from the command line it reads
+# coordinates from stdin, sends them off, and prints the results.
+#
+# Requests and responses look the same.  Everything is little-endian.
+#
+#   offset  size  what
+#   0       4     magic number, b"CCB1"
+#   4       1     length of the "from" type's name (F)
+#   5       1     length of the "to" type's name (T)
+#   6       2     reserved, 0
+#   8       4     number of coordinates (N), unsigned
+#   12      4     width of each string in a string block (W), unsigned, 0 for floats
+#   16      F+T   the "from" and "to" types' names in ASCII, padded with NULs to a
+#                 multiple of 8 bytes
+#   ...           the coordinates
+#
+# The coordinates are either N pairs of float64s (latitude, longitude) in decimal degrees
+# if W is 0, or a block of N strings, each of which is UTF-8 padded out to W bytes with
+# NULs.  Coordinates which couldn't be converted come back as a pair of NaNs or an empty
+# string.  Responses carry the same types as the request they're answering.
+
+# v1.0 - Initial release.
+
+import numpy
+import struct
+import sys
+import urllib.request
+
+magic = b"CCB1"
+header = struct.Struct("<4sBBHII")
+
+# Content type to send binary requests with.
+content_type = "application/x-coordinate-converter"
+
+# Returns True if a request body is in the binary format.
+def is_binary(body):
+    return(isinstance(body, (bytes, bytearray, memoryview)) and bytes(body[:4]) == magic)
+
+# Number of NULs needed to pad the given number of bytes out to a multiple of 8.
+def padding(length):
+    return(-length % 8)
+
+# Packs a request or a response.  coordinates is either an array of latitude and longitude
+#   pairs (shape (N, 2)) or an array of strings encoded as bytes (dtype "S<width>").
+#   Returns bytes.
+def pack(from_type, to_type, coordinates):
+    names = (from_type + to_type).encode("ascii")
+    names = names + b"\0" * padding(len(names))
+
+    if coordinates.dtype.kind == "S":
+        width = max(coordinates.dtype.itemsize, 1)
+        coordinates = coordinates.astype("S" + str(width))
+    else:
+        width = 0
+        coordinates = numpy.ascontiguousarray(coordinates, dtype="<f8")
+
+    return(header.pack(magic, len(from_type), len(to_type), 0, len(coordinates), width) +
+        names + coordinates.tobytes())
+
+# Unpacks a request or a response.  The coordinates are NumPy arrays laid over the body
+#   itself, not copies of it.  Returns a tuple of the "from" type, the "to" type, and
+#   either an array of latitude and longitude pairs (shape (N, 2)) or an array of strings
+#   encoded as bytes (dtype "S<width>").  Raises ValueError if the body is malformed.
+def unpack(body):
+    view = memoryview(body)
+    if len(view) < header.size:
+        raise ValueError("Body is too short to have a header.")
+    (number, from_length, to_length, reserved, count, width) = header.unpack_from(view)
+    if number != magic:
+        raise ValueError("Body doesn't start with " + repr(magic) + ".")
+
+    offset = header.size + from_length + to_length
+    if len(view) < offset:
+        raise ValueError("Body is too short to have the types in it.")
+    names = bytes(view[header.size:offset]).decode("ascii", "replace")
+    offset = offset + padding(from_length + to_length)
+
+    if width:
+        dtype = numpy.dtype("S" + str(width))
+        items = count
+    else:
+        dtype = numpy.dtype("<f8")
+        items = count * 2
+    if len(view) - offset < items * dtype.itemsize:
+        raise ValueError("Body is too short to have " + str(count) + " coordinates in it.")
+    coordinates = numpy.frombuffer(view, dtype=dtype, count=items, offset=offset)
+    if not width:
+        coordinates = coordinates.reshape(count, 2)
+
+    return((names[:from_length], names[from_length:], coordinates))
+
+# Splits an array of latitude and longitude pairs into columns (which are still laid over
+#   the original array).  Pairs with a NaN in them are marked as not valid.  Returns
+#   arrays of latitudes, longitudes, and whether or not each pair is valid.
+def columns(coordinates):
+    latitudes = coordinates[:, 0]
+    longitudes = coordinates[:, 1]
+    return((latitudes, longitudes, numpy.isfinite(latitudes) & numpy.isfinite(longitudes)))
+
+# Decodes a block of strings.  Returns a list of strings.
+def strings(coordinates):
+    return([ i.decode("utf-8", "replace") for i in coordinates.tolist() ])
+
+# Builds an array of latitude and longitude pairs, with NaNs wherever they aren't valid.
+#   Returns an array of shape (N, 2).
+def pairs(latitudes, longitudes, valid):
+    coordinates = numpy.column_stack((latitudes, longitudes)).astype("<f8")
+    coordinates[~numpy.asarray(valid, dtype=bool)] = numpy.nan
+    return(coordinates)
+
+# Builds a block of strings, with empty strings wherever there's a None.  Returns an array
+#   of strings encoded as bytes.
+def string_block(values):
+    return(numpy.array([ (i or "").encode("utf-8") for i in values ], dtype=bytes))
+
+# Reference client: pack a request.  coordinates is a list of (latitude, longitude) pairs
+#   if from_type is "dd", otherwise a list of strings.  Returns bytes.
+def encode_request(from_type, to_type, coordinates):
+    if from_type == "dd":
+        return(pack(from_type, to_type, numpy.array(coordinates, dtype="<f8").reshape(-1, 2)))
+    return(pack(from_type, to_type, string_block(coordinates)))
+
+# Reference client: unpack a response.  Returns a list of (latitude, longitude) pairs or a
+#   list of strings, with None wherever coordinates couldn't be converted.
+def decode_response(body):
+    if not is_binary(body):
+        raise ValueError(bytes(body[:200]).decode("utf-8", "replace"))
+    (from_type, to_type, coordinates) = unpack(body)
+    if coordinates.ndim == 2:
+        return([ None if numpy.isnan(i).any() else tuple(i) for i in coordinates.tolist() ])
+    return([ i.decode("utf-8") or None for i in coordinates.tolist() ])
+
+# Reference client: send coordinates to coordinate-converter.  Returns the same thing as
+#   decode_response().
+def convert(url, from_type, to_type, coordinates):
+    request = urllib.request.Request(url, data=encode_request(from_type, to_type,
+        coordinates), headers={ "Content-Type": content_type })
+    with urllib.request.urlopen(request) as response:
+        return(decode_response(response.read()))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: " + sys.argv[0] + " <url> <from> <to> < coordinates")
+        print("Reads one set of coordinates per line from stdin.  Decimal degrees are")
+        print("written as a latitude and a longitude separated by whitespace.")
+        sys.exit(1)
+    (url, from_type, to_type) = sys.argv[1:]
+
+    coordinates = []
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        if from_type == "dd":
+            coordinates.append([ float(i) for i in line.split() ])
+        else:
+            coordinates.append(line.strip())
+
+    for i in convert(url, from_type, to_type, coordinates):
+        if i is None:
+            print("")
+        elif isinstance(i, tuple):
+            print(str(i[0]) + " " + str(i[1]))
+        else:
+            print(i)
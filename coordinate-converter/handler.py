@@ -4,6 +4,41 @@
 
 # by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
 
+# v3.3 - Fixed dd_to_dms(), which split negative coordinates apart wrong (-33.8688 came out
+#        as 34° 7' 52.32" S), and dd_pair_to_dms(), which could put a hemisphere in the
+#        middle of the seconds.  Tiny numbers of seconds are written out in full instead
+#        of as 5.8e-11, which couldn't be read back in.
+# v3.2 - Added a geohash-prefix spatial index (spatial.py).  Points are uploaded once under
+#        a name, and can then be searched by bounding box, radius, geohash cell, or
+#        nearness without looking at every point.  Indexes can be added to and taken
+#        away from, and saved to memory-mapped files.
+# v3.1 - Rewrote the degrees/minutes/seconds parser.  It goes over the coordinates once,
+#        understands the usual ways of writing them (°/d, '/", spaces, signs, hemispheres
+#        before or after), gets fractions of a second right (10.05" isn't 10.5" any more),
+#        and says where the problem is if it can't make sense of something.
+# v3.0 - Added a binary columnar format (binary.py) for big batches of coordinates, which
+#        skips JSON altogether.
+# v2.9 - Added a process pool.  Really big batches are split into chunks which are
+#        converted on every CPU at once.
+# v2.8 - Added streaming conversions of CSV files and GeoJSON FeatureCollections
+#        (streaming.py).  What to convert is described in the query string.
+# v2.7 - Added fan-out conversions.  "to" can be "all" or a list of types, in which case the
+#        coordinates are decoded once and encoded as every type asked for.
+# v2.6 - Added an LRU cache of conversions, so that the same coordinates converted over
+#        and over again (home, the office, sensor sites) are only converted once.  Cache
+#        hits, misses, and evictions can be had by sending { "stats": true }.
+# v2.5 - Added a vectorized MGRS path.  vectorized.py projects whole arrays of
+#        coordinates through UTM instead of calling into the mgrs module once per point.
+#        The mgrs module is still used for the poles (UPS) and anything else the
+#        vectorized code can't handle, and there's only one copy of it now.
+# v2.4 - Added a vectorized conversion engine (vectorized.py) which uses NumPy to convert
+#        big batches a whole array at a time.
+# v2.3 - Replaced the big if-cascade with a registry of codecs.  Every type registers a
+#        decoder to decimal degrees and an encoder from them, and conversions are a pair
+#        of dictionary lookups.  Decimal degrees are passed around as floats, not strings.
+# v2.2 - Added batch conversions.  A JSON array (or newline-delimited JSON) of requests,
+#        or one request with a list of coordinates, gets converted in one call.  Each
+#        item is decoded to decimal degrees once and then encoded to the target type.
 # v2.1 - Added geohash (https://en.wikipedia.org/wiki/Geohash) support.
 #      - Refactored to optimize the conversion process.  Pretty much everything is done by
 #        converting decimal coordinates into something else, so I moved that up front and
@@ -12,14 +47,51 @@
 # v2.0 - Refactored so it's significantly neater and easier to maintain.
 # v1.0 - Initial release.
 
+import concurrent.futures
 import geohash2
 import json
 import mgrs
+import os
 import re
 import sys
+import urllib.parse
 
+from collections import OrderedDict
 from openlocationcode import openlocationcode
 
+# The vectorized engine needs NumPy.  If it isn't installed, batches are converted one
+# item at a time.
+try:
+    from . import vectorized
+except ImportError:
+    try:
+        import vectorized
+    except ImportError:
+        vectorized = None
+
+# So does the binary format.
+try:
+    from . import binary
+except ImportError:
+    try:
+        import binary
+    except ImportError:
+        binary = None
+
+# So does the spatial index.
+try:
+    from . import spatial
+except ImportError:
+    try:
+        import spatial
+    except ImportError:
+        spatial = None
+
+try:
+    from . import streaming
+except ImportError:
+    import streaming
+
 help = """
 This is a microservice which turns one set of map coordinates into another.
 
@@ -33,6 +105,8 @@ Takes as its input a JSON document of the form:
 Supported coordinate types:
 * degrees/minutes/seconds (dms)
 ** 48°53'10.18"N 2°20'35.09"E
+** N 48 53 10.18, E 2 20 35.09
+** -48d53'10.18'' 2d20'35.09''
 * decimal degrees (dd)
 ** -48.8866111111 -2.34330555556
 * open location code (openlocationcode, pluscode)
@@ -42,10 +116,109 @@ Supported coordinate types:
 * geohash
 ** 5zq3fsmwv50t
 
+To convert a batch of coordinates in one request, send a JSON array of documents like the
+one above (or one document per line), or one document with a list of coordinates:
+    {
+        "coordinates": [ "<coordinates>", "<more coordinates>", ... ],
+        "from": "<type of the coordinates to convert>",
+        "to": "<type to convert the coordinates to>"
+    }
+Batches return a JSON array, in the same order as the input, of documents of the form
+{ "result": "<converted coordinates>" } or { "error": "<what went wrong>" }.
+
+To get the same coordinates as more than one type, set "to" to a list of types, or to "all"
+for every supported type.  The coordinates are decoded once, and the result is a JSON
+document of the form { "<type>": "<converted coordinates>", ... }.  A type which the
+coordinates couldn't be converted to (MGRS for a latitude past 90 degrees, for example) is
+null; there's no error message for it, because the coordinates themselves were fine.
+
+To convert a CSV file or a GeoJSON FeatureCollection, send it as-is and describe what to
+do with it in the query string:
+    ?format=csv&from=<type>&to=<type>&column=<column with the coordinates>
+    ?format=csv&from=dd&to=<type>&latitude=<column>&longitude=<column>
+    ?format=geojson&to=<type>
+    ?format=geojson&from=<type>&to=<type>&property=<property with the coordinates>
+"to" can be a comma-separated list of types.  CSV files need a header row, and get a
+column added for every type converted to and an "error" column.  GeoJSON features use
+their Point geometry unless "property" is given, and get a property added for every type
+converted to, or an "error" property.
+
+For big batches of coordinates, there's also a binary format which skips JSON.  See
+binary.py for the details and a client.
+
+Send { "stats": true } to get the conversion cache's statistics.
+
+To search a set of points, upload them to a named spatial index first:
+    {
+        "index": "<name of the index>",
+        "operation": "add",
+        "from": "<type of the coordinates, dd if not given>",
+        "points": [ { "id": "<id>", "coordinates": "<coordinates>" }, ... ]
+    }
+Adding a point with an ID that's already in the index moves it.  Other operations are:
+* "remove", with "ids": [ "<id>", ... ]
+* "info" and "drop"
+* "bbox", with "bbox": [ <south>, <west>, <north>, <east> ] in decimal degrees
+* "radius", with "center": "<coordinates>" and "radius": <meters>
+* "nearest", with "center": "<coordinates>", "k": <number of points, 1 if not given>,
+  and optionally "radius": <meters>
+* "geohash", with "geohash": "<geohash cell>"
+Searches return { "results": [ { "id": "<id>", "coordinates": "<coordinates>" }, ... ] },
+nearest first for "radius" and "nearest" (which also return each point's "distance" in
+meters).  "from" is the type of "center" and "to" is the type to return the points as,
+both dd if not given.
+
 If you supply the wrong kind of coordinates for the type given, you will get bad results.
 """
 required_keys = [ "coordinates", "from", "to" ]
-supported_coordinates = [ "dms", "dd", "openlocationcode", "pluscode", "mgrs", "geohash" ]
+supported_coordinates = []  # Filled in by register_codec() below.
+
+# Batches with at least this many items going from the same type to the same type are
+# converted with the vectorized engine.  Below that it isn't worth building the arrays.
+vectorize_threshold = 64
+
+# Maximum number of conversions to keep in the cache.  0 turns the cache off.
+cache_size = int(os.environ.get("cache_size", 1024))
+
+# If set, decimal degrees are rounded to this many places before they're converted (and
+#   cached), so GPS fixes which are nearly the same share a cache entry.  5 places is
+#   about a meter.
+cache_quantization = os.environ.get("cache_quantization")
+if cache_quantization:
+    cache_quantization = int(cache_quantization)
+else:
+    cache_quantization = None
+
+# The cache itself, least recently used conversions first.
+cache = OrderedDict()
+cache_stats = { "hits": 0, "misses": 0, "evictions": 0 }
+
+# Batches with at least this many items going from the same type to the same type(s) are
+#   split into chunks and converted by a pool of worker processes.  Below that, starting
+#   the workers and shipping the coordinates to them costs more than it saves.
+pool_threshold = int(os.environ.get("pool_threshold", 20000))
+
+# Number of worker processes in the pool.  Defaults to the number of CPUs.  1 (or less)
+#   turns the pool off.
+pool_workers = int(os.environ.get("pool_workers", os.cpu_count() or 1))
+
+# The pool itself, which is started the first time it's needed.
+pool = None
+
+# Spatial indexes which have been built or loaded, by name.
+indexes = {}
+
+# If set, spatial indexes are saved in this directory (as <name>.npy) every time they
+#   change, and are loaded from it (memory-mapped) the first time they're used.  The
+#   classic watchdog starts a new process for every request, so without this an index
+#   doesn't outlive the request which built it.
+index_directory = os.environ.get("index_directory")
+
+# Index names end up in file names, so they're kept simple.
+index_name = re.compile("[A-Za-z0-9_-]+")
+
+# One copy of the mgrs module's converter, shared by every conversion.
+mgrs_converter = mgrs.MGRS()
 
 # Try to deserialize content from the client.  Return the hash table
 # containing the deserialized JSON if it exists.
@@ -57,6 +230,19 @@ def deserialize_content(content):
         return None
     return arguments
 
+# Try to deserialize newline-delimited JSON from the client, one document per line.  Return
+# a list of the deserialized documents if every line is valid JSON.
+def deserialize_ndjson(content):
+    documents = []
+    try:
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            documents.append(json.loads(line))
+    except:
+        return None
+    return documents
+
 # Ensure that all of the keys required are in the hash table.
 def ensure_all_keys(arguments):
     all_keys_found = True
@@ -68,51 +254,206 @@ def ensure_all_keys(arguments):
     else:
         return True
 
-# Converts degrees/minutes/seconds to decimal degrees.  Takes one set of d/m/s at a time
-#   (i.e., latitude only, longitude only).
-def dms_to_dd(coordinate):
+# Tokens in coordinates written in degrees/minutes/seconds: numbers, the marks for degrees,
+#   minutes, and seconds, hemispheres, signs, and separators.  Whitespace is skipped.
+dms_token = re.compile("""\\s*(?:
+    (?P<number>[0-9]+(?:\\.[0-9]*)?|\\.[0-9]+)
+    |(?P<degrees>[°º˚]|deg|d)
+    |(?P<seconds>''|["″”])
+    |(?P<minutes>['′’])
+    |(?P<hemisphere>[NSEWnsew])
+    |(?P<sign>[-+−])
+    |(?P<separator>[,;/])
+    )\\s*""", re.VERBOSE)
+dms_units = { "degrees": 0, "minutes": 1, "seconds": 2 }
+
+# The way almost everybody writes degrees/minutes/seconds (48°53'10.18"N 2°20'35.09"E, with
+#   or without spaces or signs) in one pattern, so that it can be picked apart in one go.
+#   Anything else goes through dms_tokens().
+dms_number = "([0-9]+(?:\\.[0-9]*)?|\\.[0-9]+)\\s*"
+dms_coordinate_pattern = ("([-+−])?\\s*" + dms_number + "(?:[°º˚]|deg|d)\\s*" +
+    "(?:" + dms_number + "['′’](?!')\\s*)?" +
+    "(?:" + dms_number + "(?:''|[\"″”])\\s*)?" +
+    "([NSEWnsew])?")
+dms_pair_pattern = re.compile("\\s*" + dms_coordinate_pattern + "\\s*[,;/]?\\s*" +
+    dms_coordinate_pattern + "\\s*")
+
+# Breaks a set of coordinates in degrees/minutes/seconds up into tokens, in one pass.
+#   Returns a list of tuples (kind of token, text, position).  Raises ValueError if
+#   something in there isn't part of a coordinate.
+def dms_tokens(coordinates):
+    tokens = []
+    position = 0
+
+    while position < len(coordinates):
+        token = dms_token.match(coordinates, position)
+        if not token or token.end() == position:
+            raise ValueError("Unexpected " + repr(coordinates[position]) +
+                " at position " + str(position))
+        if token.lastgroup:
+            tokens.append((token.lastgroup, token.group(token.lastgroup),
+                token.start(token.lastgroup)))
+        position = token.end()
+    return(tokens)
+
+# Picks one coordinate (latitude or longitude) out of a list of tokens, starting at the
+#   given token.  The coordinate is an optional sign or hemisphere, then up to
+#   numeric_fields numbers (degrees, minutes, and seconds, in that order, with or without
+#   marks), then an optional hemisphere.  Returns a
+#   tuple of the hemisphere (or None), the sign (1.0 or -1.0), degrees, minutes, seconds,
+#   and the token after the coordinate.  Raises ValueError if it can't be picked apart.
+def dms_coordinate(tokens, index, numeric_fields, length):
+    hemisphere = None
     sign = None
-    degrees = 0
-    minutes = 0
-    seconds = 0
-    fraction_of_a_second = 0
-    dd = None
+    fields = [ 0.0, 0.0, 0.0 ]
+    field = 0
+
+    if index < len(tokens) and tokens[index][0] == "sign":
+        sign = tokens[index][1]
+        index = index + 1
+    elif index < len(tokens) and tokens[index][0] == "hemisphere":
+        hemisphere = tokens[index][1].upper()
+        index = index + 1
+
+    while index < len(tokens) and tokens[index][0] == "number" and numeric_fields:
+        (kind, number, position) = tokens[index]
+        marked = index + 1 < len(tokens) and tokens[index + 1][0] in dms_units
+        unit = field
+        if marked:
+            unit = dms_units[tokens[index + 1][0]]
+
+        # Degrees after minutes (or anything after seconds) means this number is where
+        #   the next coordinate starts.
+        if unit < field or unit > 2:
+            break
+        if field == 0 and unit != 0:
+            raise ValueError("Expected degrees at position " + str(position))
+        fields[unit] = float(number)
+        if unit and fields[unit] >= 60:
+            raise ValueError("Minutes and seconds have to be less than 60 at position " +
+                str(position))
+        field = unit + 1
+        numeric_fields = numeric_fields - 1
+        index = index + 1
+        if marked:
+            index = index + 1
+
+    if not field:
+        if index < len(tokens):
+            raise ValueError("Expected degrees at position " + str(tokens[index][2]))
+        raise ValueError("Expected degrees at position " + str(length))
+
+    if not hemisphere and index < len(tokens) and tokens[index][0] == "hemisphere":
+        hemisphere = tokens[index][1].upper()
+        index = index + 1
 
     # North and east are positive, south and west are negative.
-    if re.search("[neNE]", coordinate):
-        sign = 1.0
-    else:
-        sign = -1.0
-
-    # Chop the coordinates up into a list of numerical values by dropping everything that
-    # isn't a numerical value.  We do a double conversion because of how Python 3 implements
-    # filter() now.  It'll look something like this: [48, 53, 10, 18]
-    coordinate = filter(len, re.split("\D+", coordinate, maxsplit=4))
-    coordinate = list(coordinate)
-
-    # Degrees.
-    degrees = int(coordinate[0])
-
-    # Minutes.
-    if len(coordinate) >= 2:
-        minutes = int(coordinate[1])
-
-    # Seconds.
-    if len(coordinate) >= 3:
-        seconds = int(coordinate[2])
-
-    # Fractions of a second.
-    if len(coordinate) >= 4:
-        fraction_of_a_second = int(coordinate[3])
-
-    # Collapse the two into fractional seconds.
-    seconds = str(seconds) + "." + str(fraction_of_a_second)
-    seconds = float(seconds)
+    negative = sign in [ "-", "−" ]
+    if hemisphere and negative and hemisphere in "NE":
+        raise ValueError("Sign and hemisphere disagree at position " +
+            str(tokens[index - 1][2]))
+    if hemisphere and hemisphere in "SW":
+        negative = True
+
+    return((hemisphere, -1.0 if negative else 1.0, fields[0], fields[1], fields[2], index))
+
+# Picks a pair of coordinates in degrees/minutes/seconds apart with dms_pair_pattern.
+#   Returns the same thing as dms_pair_fields(), or None if the coordinates aren't written
+#   the usual way or there's something wrong with them (so that dms_pair_fields() can go
+#   through them more carefully and say what).
+def dms_pattern_fields(coordinates):
+    match = dms_pair_pattern.fullmatch(coordinates)
+    if not match:
+        return(None)
+
+    pair = []
+    hemispheres = []
+    groups = match.groups()
+    for (sign, degrees, minutes, seconds, hemisphere) in (groups[0:5], groups[5:10]):
+        negative = sign is not None and sign != "+"
+        if hemisphere:
+            hemisphere = hemisphere.upper()
+            if hemisphere in "NE":
+                if negative:
+                    return(None)
+            else:
+                negative = True
+        minutes = float(minutes) if minutes else 0.0
+        seconds = float(seconds) if seconds else 0.0
+        if minutes >= 60 or seconds >= 60:
+            return(None)
+        pair.append((-1.0 if negative else 1.0, float(degrees), minutes, seconds))
+        hemispheres.append(hemisphere)
+
+    if (hemispheres[0] and hemispheres[0] in "EW") or (hemispheres[1] and hemispheres[1] in "NS"):
+        (pair[0], pair[1], hemispheres[0], hemispheres[1]) = (pair[1], pair[0],
+            hemispheres[1], hemispheres[0])
+        if (hemispheres[0] and hemispheres[0] in "EW") or (hemispheres[1] and
+                hemispheres[1] in "NS"):
+            return(None)
+    return((pair[0], pair[1]))
+
+# Picks a pair of coordinates in degrees/minutes/seconds apart, in one pass over the
+#   string.  Takes a latitude and a longitude, in that order unless their hemispheres say
+#   otherwise.  Understands ° (or d) for degrees, ' for minutes, " (or '') for seconds,
+#   signs, hemispheres before or after each coordinate, and leaving any of those out.
+#   Returns a tuple of the latitude's fields and the longitude's fields, each of which is a
+#   tuple of the sign (1.0 or -1.0), degrees, minutes, and seconds (including fractions of
+#   a second).  Raises ValueError (which says where the problem is) if the coordinates
+#   can't be picked apart.
+def dms_pair_fields(coordinates):
+    fields = dms_pattern_fields(coordinates)
+    if fields:
+        return(fields)
+    tokens = dms_tokens(coordinates)
+
+    # Without any marks or hemispheres to go by, the numbers are split down the middle.  If
+    # there's an odd number of them, there's no telling which coordinate the middle one
+    # goes with.
+    numeric_fields = 3
+    kinds = set([ i[0] for i in tokens ])
+    if not kinds & set([ "degrees", "minutes", "seconds", "hemisphere", "separator" ]):
+        numbers = [ i for i in tokens if i[0] == "number" ]
+        if len(numbers) % 2:
+            raise ValueError("Can't tell which coordinate the number at position " +
+                str(numbers[len(numbers) // 2][2]) + " goes with")
+        numeric_fields = len(numbers) // 2
+
+    first = dms_coordinate(tokens, 0, numeric_fields, len(coordinates))
+    index = first[5]
+    if index < len(tokens) and tokens[index][0] == "separator":
+        index = index + 1
+    second = dms_coordinate(tokens, index, 3, len(coordinates))
+    if second[5] < len(tokens):
+        raise ValueError("Unexpected " + repr(tokens[second[5]][1]) + " at position " +
+            str(tokens[second[5]][2]))
+
+    if (first[0] and first[0] in "EW") or (second[0] and second[0] in "NS"):
+        (first, second) = (second, first)
+    if (first[0] and first[0] in "EW") or (second[0] and second[0] in "NS"):
+        raise ValueError("Two latitudes or two longitudes at position " +
+            str(tokens[index][2]))
+
+    return((first[1:5], second[1:5]))
+
+# Converts degrees/minutes/seconds to decimal degrees.  Takes the fields of one coordinate
+#   as returned by dms_pair_fields().
+def dms_to_dd(fields):
+    (sign, degrees, minutes, seconds) = fields
 
     # Turn it into a decimal degree coordinate.
-    dd = sign * (float(degrees) + float(minutes / 60) + float(seconds / 3600))
-
-    return(dd)
+    return(sign * (degrees + (minutes / 60) + (seconds / 3600)))
+
+# Write out a number of seconds.  Python writes tiny numbers like 5.8e-11, which nothing
+#   (this function included) reads as seconds, so those are written out in full.  Returns a
+#   string.
+def dms_seconds(seconds):
+    text = str(seconds)
+    if "e" in text:
+        text = ("%.20f" % seconds).rstrip("0")
+        if text.endswith("."):
+            text = text + "0"
+    return(text)
 
 # Converts decimal degrees to degrees/minutes/seconds.  Takes one coordinate at a time.
 def dd_to_dms(coordinate):
@@ -122,291 +463,766 @@ def dd_to_dms(coordinate):
     sign = ""
     dms = ""
 
-    # Split apart the decimal value.
-    coordinate = float(coordinate)
-    (minutes, seconds) = divmod((coordinate * 3600), 60)
-    (degrees, minutes) = divmod(minutes, 60)
-
     # Save the sign so we can figure out north/south/east/west afterward.
-    if degrees < 0.0:
-        degrees = degrees * -1
+    coordinate = float(coordinate)
+    if coordinate < 0.0:
         sign = "-"
     else:
         sign = "+"
 
+    # Split apart the decimal value.  divmod() rounds down, toward negative infinity, so a
+    # negative coordinate has to be made positive first or every field comes out wrong.
+    (minutes, seconds) = divmod((abs(coordinate) * 3600), 60)
+    (degrees, minutes) = divmod(minutes, 60)
+
     # Assemble the coordinate string.
-    dms = str(degrees) + "° " + str(minutes) + "' " + str(seconds) + "\" " + sign
+    dms = str(degrees) + "° " + str(minutes) + "' " + dms_seconds(seconds) + "\" " + sign
 
     return(dms)
 
-# Converts a set of decimal degree coordinates into a pluscode.  Takes as its argument
-#   a string containing both the latitude and longitude as strings.
-def dd_to_pluscode(coordinates):
-    latitude = 0.0
-    longitude = 0.0
+# Converts a pair of decimal degree coordinates into a pluscode.  Returns a string.
+def dd_to_pluscode(latitude, longitude):
     pluscode = ""
 
-    # Extract the latitude and longitude.
-    (latitude, longitude) = coordinates.split()
-    latitude = float(latitude)
-    longitude = float(longitude)
-
-    # Do the thing.
     pluscode = openlocationcode.encode(latitude, longitude)
 
     return(pluscode)
 
 # Converts an open location code into decimal degree coordinates.  Takes as its argument a
-#   string containing a pluscode.  Returns latitude and longitude.
+#   string containing a pluscode.  Returns a tuple of floats (latitude, longitude).
 def pluscode_to_dd(pluscode):
     codearea = None
-    latitude = 0.0
-    longitude = 00
 
     codearea = openlocationcode.decode(pluscode)
-    latitude = codearea.latitudeCenter
-    longitude = codearea.longitudeCenter
 
-    return(str(latitude) + " " + str(longitude))
+    return((codearea.latitudeCenter, codearea.longitudeCenter))
 
 # Convert dd to mgrs.  Returns a string with the gridref.
 def dd_to_mgrs(latitude, longitude):
     gridref = None
 
-    converter = mgrs.MGRS()
-    gridref = converter.toMGRS(latitude, longitude)
+    gridref = mgrs_converter.toMGRS(latitude, longitude)
 
     return(gridref)
 
-# Convert mgrs to dd.  Returns a string with the latitude and longitude.
+# Convert mgrs to dd.  Returns a tuple of floats (latitude, longitude).
 def mgrs_to_dd(gridref):
-    coordinates = None
-
-    converter = mgrs.MGRS()
-    gridref = str.encode(gridref)
-    coordinates = converter.toLatLon(gridref)
-    coordinates = str(coordinates[0]) + " " + str(coordinates[1]) 
-
-    return(coordinates)
+    return(mgrs_converter.toLatLon(gridref))
 
 # Convert dd to geohash.  Returns a string containing the geohash.
 def dd_to_geohash(latitude, longitude):
     geohash = None
 
-    geohash = geohash2.encode(float(latitude), float(longitude))
+    geohash = geohash2.encode(latitude, longitude)
 
     return geohash
 
-# Convert geohash to dd.  Returns a string containing the geohash.
+# Convert geohash to dd.  geohash2 trims the coordinates to the digits that the geohash
+#   actually carries, so they're parsed from what it returns.  Returns a tuple of floats
+#   (latitude, longitude).
 def geohash_to_dd(geohash):
-    coordinates = None
-
-    coordinates = geohash2.decode(geohash)
-    coordinates = " ".join(coordinates)
-
-    return coordinates
-
-# Entry point to the function.
-def handle(req):
-    coordinates = {}
-    latitude = None
-    longitude = None
-    pluscode = None
-    gridref = None
-    geohash = None
+    try:
+        (latitude, longitude) = geohash2.decode(geohash)
+    except KeyError as e:
+        raise ValueError(str(e) + " isn't a geohash character.")
+
+    return((float(latitude), float(longitude)))
+
+# Converts a pair of decimal degree coordinates into degrees/minutes/seconds with the
+#   hemispheres filled in.  Returns a string.
+def dd_pair_to_dms(latitude, longitude):
+    # The sign is the last character.  Tiny numbers of seconds can have signs of their own
+    # (3.6e-06), so nothing else gets replaced.
+    latitude = dd_to_dms(latitude)
+    if latitude.endswith("+"):
+        latitude = latitude[:-1] + "N"
+    else:
+        latitude = latitude[:-1] + "S"
 
-    # If no input, return online help.
-    if not req:
-        return(help)
+    longitude = dd_to_dms(longitude)
+    if longitude.endswith("+"):
+        longitude = longitude[:-1] + "E"
+    else:
+        longitude = longitude[:-1] + "W"
 
-    # Deserialize the JSON document from the user.
-    coordinates = deserialize_content(req)
-    if not coordinates:
-        return("Could not deserialize JSON.")
+    return(latitude + " " + longitude)
 
-    # Make sure we have everything we need.
-    if not ensure_all_keys(coordinates):
-        return("Required key missing in JSON.")
+# Decoders and encoders for the two formats which are written as a pair of coordinates
+#   separated by whitespace.
+def decode_dms(coordinates):
+    (latitude, longitude) = dms_pair_fields(coordinates)
+    return((dms_to_dd(latitude), dms_to_dd(longitude)))
 
-    # Make sure the types of the supplied coordinates is supported.
-    if coordinates["from"] not in supported_coordinates:
-        return("I don't support that input coordinate type.")
-    if coordinates["to"] not in supported_coordinates:
-        return("I don't support that output coordinate type.")
+def decode_dd(coordinates):
+    (latitude, longitude) = coordinates.split()
+    return((float(latitude), float(longitude)))
 
-    # Case: dms to something
-    if (coordinates["from"] == "dms"):
+def encode_dd(latitude, longitude):
+    return(str(latitude) + " " + str(longitude))
 
-        # First convert to dd.
-        (latitude, longitude) = coordinates["coordinates"].split()
-        latitude = str(dms_to_dd(latitude))
-        longitude = str(dms_to_dd(longitude))
+# Registry of coordinate codecs.  Every conversion goes through decimal degrees: the
+#   decoder for the input type turns the coordinates into a tuple of floats (latitude,
+#   longitude), and the encoder for the output type turns that tuple into whatever the
+#   client asked for.  To support a new type of coordinates, register a codec for it.
+codecs = {}
+canonical_names = {}
+
+def register_codec(names, decoder, encoder):
+    for name in names:
+        codecs[name] = (decoder, encoder)
+        canonical_names[name] = names[0]
+        if name not in supported_coordinates:
+            supported_coordinates.append(name)
+
+register_codec([ "dms" ], decode_dms, dd_pair_to_dms)
+register_codec([ "dd" ], decode_dd, encode_dd)
+register_codec([ "openlocationcode", "pluscode" ], pluscode_to_dd, dd_to_pluscode)
+register_codec([ "mgrs" ], mgrs_to_dd, dd_to_mgrs)
+register_codec([ "geohash" ], geohash_to_dd, dd_to_geohash)
+
+# What the codecs raise when they're handed coordinates which they can't make sense of.
+#   The mgrs module has its own exception; everything else raises ValueError.
+codec_errors = (ValueError, mgrs.core.MGRSError)
+
+# Decode a set of coordinates of the given type into decimal degrees.  Returns a tuple of
+#   floats (latitude, longitude).
+def decode_to_dd(coordinates, coordinate_type):
+    return(codecs[coordinate_type][0](coordinates))
+
+# Encode a pair of decimal degree coordinates as the given type.  Returns a string.
+def encode_from_dd(latitude, longitude, coordinate_type):
+    return(codecs[coordinate_type][1](latitude, longitude))
+
+# Convert a set of coordinates from one type to another.  Returns a string.
+def convert(coordinates, from_type, to_type):
+    (latitude, longitude) = decode_to_dd(coordinates, from_type)
+    return(encode_from_dd(latitude, longitude, to_type))
+
+# Put a set of coordinates into a normal form, so that requests which are going to give the
+#   same result share a cache entry.  Decimal degrees are normalized by their value (and
+#   rounded if cache_quantization is set), degrees/minutes/seconds by their whitespace.
+#   Everything else is used as-is.  Returns the normalized coordinates.
+def normalize_coordinates(coordinates, coordinate_type):
+    if coordinate_type == "dd":
+        try:
+            (latitude, longitude) = decode_dd(coordinates)
+        except:
+            return(coordinates)
+        if cache_quantization is not None:
+            latitude = round(latitude, cache_quantization)
+            longitude = round(longitude, cache_quantization)
+        return(encode_dd(latitude, longitude))
+    if coordinate_type == "dms":
+        return(" ".join(coordinates.split()))
+    return(coordinates)
 
-        # Case: output is dd.
-        if (coordinates["to"] == "dd"):
-            return(latitude + " " + longitude)
+# Build the cache key for a conversion.  Returns a tuple of the normalized coordinates and
+#   the canonical names of the types.
+def cache_key(coordinates, from_type, to_type):
+    return(cache_keys(coordinates, from_type, [ to_type ])[0])
+
+# Build the cache keys for converting a set of coordinates into several types, normalizing
+#   the coordinates only once.  Returns a list of keys, one per type.
+def cache_keys(coordinates, from_type, to_types):
+    normalized = normalize_coordinates(coordinates, from_type)
+    return([ (normalized, canonical_names[from_type], canonical_names[i]) for i in to_types ])
+
+# Look a conversion up in the cache.  Returns the converted coordinates, or None if they
+#   aren't in there.
+def cache_get(key):
+    if not cache_size:
+        return(None)
+    if key not in cache:
+        cache_stats["misses"] = cache_stats["misses"] + 1
+        return(None)
+    cache_stats["hits"] = cache_stats["hits"] + 1
+    cache.move_to_end(key)
+    return(cache[key])
+
+# Put a conversion into the cache, throwing out the least recently used ones if it's full.
+def cache_put(key, result):
+    if not cache_size:
+        return
+    cache[key] = result
+    cache.move_to_end(key)
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+        cache_stats["evictions"] = cache_stats["evictions"] + 1
+
+# Empty the cache and reset its statistics.
+def clear_cache():
+    cache.clear()
+    for i in cache_stats:
+        cache_stats[i] = 0
+
+# Statistics about the cache.  Returns a hash table.
+def cache_statistics():
+    statistics = dict(cache_stats)
+    statistics["entries"] = len(cache)
+    statistics["size"] = cache_size
+    statistics["quantization"] = cache_quantization
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    if lookups:
+        statistics["hit_rate"] = cache_stats["hits"] / lookups
+    else:
+        statistics["hit_rate"] = 0.0
+    return(statistics)
+
+# Convert a set of coordinates from one type to another, going through the cache.  Returns
+#   a string.
+def cached_convert(coordinates, from_type, to_type):
+    key = cache_key(coordinates, from_type, to_type)
+    result = cache_get(key)
+    if result is None:
+        result = convert(key[0], from_type, to_type)
+        cache_put(key, result)
+    return(result)
+
+# Work out which types a request wants its coordinates converted to.  "to" can be one type,
+#   "all" for every supported type, or a list of types.  Returns a list of types, or None
+#   if any of them aren't supported.
+def output_types(to_type):
+    if to_type == "all":
+        return(list(dict.fromkeys(canonical_names.values())))
+    if isinstance(to_type, str):
+        to_type = [ to_type ]
+    if not isinstance(to_type, list) or not to_type:
+        return(None)
+    for i in to_type:
+        if not isinstance(i, str) or i not in supported_coordinates:
+            return(None)
+    return(to_type)
+
+# Returns True if a request wants its coordinates converted to more than one type.
+def fan_out(to_type):
+    return(to_type == "all" or isinstance(to_type, list))
+
+# Put together the converted coordinates for a request.  A request for one type gets a
+#   string, a fan-out request gets a hash table of types and converted coordinates.
+def assemble(to_type, to_types, converted):
+    if fan_out(to_type):
+        return(dict(zip(to_types, converted)))
+    return(converted[0])
+
+# Convert a set of coordinates into several types, decoding them only once.  Types which
+#   couldn't be encoded are None (null in JSON), without saying why.  Returns a hash table of types and converted coordinates.
+def convert_all(coordinates, from_type, to_types):
+    results = {}
+    keys = {}
+    missing = []
+
+    for (i, key) in zip(to_types, cache_keys(coordinates, from_type, to_types)):
+        keys[i] = key
+        results[i] = cache_get(key)
+        if results[i] is None:
+            missing.append(i)
+    if not missing:
+        return(results)
+
+    (latitude, longitude) = decode_to_dd(keys[missing[0]][0], from_type)
+    for i in missing:
+        try:
+            results[i] = encode_from_dd(latitude, longitude, i)
+            cache_put(keys[i], results[i])
+        except:
+            results[i] = None
+    return(results)
+
+# Vectorized codecs, for the coordinate types which have them.  Decoders take a list of
+#   coordinates and return arrays of latitudes, longitudes, and whether or not each set of
+#   coordinates could be decoded.  Encoders take arrays of latitudes and longitudes and
+#   return a list of strings.  Types which aren't in here fall back to their scalar codecs.
+vector_codecs = {}
+
+def register_vector_codec(names, decoder, encoder):
+    for name in names:
+        vector_codecs[name] = (decoder, encoder)
+
+def decode_dms_array(coordinates):
+    return(vectorized.decode_dms(coordinates, dms_pair_fields))
+
+# The vectorized MGRS code hands anything it can't do itself to the mgrs module.
+def decode_mgrs_array(coordinates):
+    return(vectorized.mgrs_decode(coordinates, mgrs_to_dd))
+
+def encode_mgrs_array(latitudes, longitudes):
+    return(vectorized.mgrs_encode(latitudes, longitudes, dd_to_mgrs))
+
+if vectorized:
+    register_vector_codec([ "dms" ], decode_dms_array, vectorized.dd_pair_to_dms)
+    register_vector_codec([ "mgrs" ], decode_mgrs_array, encode_mgrs_array)
+    register_vector_codec([ "geohash" ], vectorized.geohash_decode, vectorized.geohash_encode)
+
+# Make sure that one item of a batch can be converted.  Returns a hash table containing an
+#   error message if it can't, None if it can.
+def validate_item(item):
+    if not isinstance(item, dict):
+        return({ "error": "Item is not a JSON document." })
+    if not ensure_all_keys(item):
+        return({ "error": "Required key missing in JSON." })
+    return(validate_types(item))
+
+# Make sure that the "from" and "to" types of a request or an item are supported.  Returns
+#   a hash table containing an error message if they aren't, None if they are.
+def validate_types(arguments):
+    if arguments["from"] not in supported_coordinates:
+        return({ "error": "I don't support that input coordinate type." })
+    if output_types(arguments["to"]) is None:
+        return({ "error": "I don't support that output coordinate type." })
+    return(None)
+
+# Convert one item of a batch.  Returns a hash table containing either the converted
+#   coordinates or an error message, so that one bad item doesn't spoil the batch.
+def convert_item(item):
+    error = validate_item(item)
+    if error:
+        return(error)
 
-        # Case: output is openlocationcode/pluscode.
-        if (coordinates["to"] == "openlocationcode") or (coordinates["to"] == "pluscode"):
-            pluscode = dd_to_pluscode(latitude + " " + longitude)
-            return(pluscode)
+    try:
+        if fan_out(item["to"]):
+            return({ "result": convert_all(str(item["coordinates"]), item["from"],
+                output_types(item["to"])) })
+        return({ "result": cached_convert(str(item["coordinates"]), item["from"],
+            item["to"]) })
+    except:
+        return({ "error": "Could not convert coordinates." })
+
+# Decode a list of coordinates which are all of the same type with the vectorized engine.
+#   Returns arrays of latitudes, longitudes, and whether or not each set of coordinates
+#   could be decoded.
+def decode_vectorized(coordinates, from_type):
+    if from_type in vector_codecs:
+        return(vector_codecs[from_type][0](coordinates))
+    return(vectorized.decode_with(codecs[from_type][0], coordinates))
+
+# Encode arrays of latitudes and longitudes as one type with the vectorized engine.
+#   Returns a list of strings, with None wherever the coordinates weren't valid or
+#   couldn't be encoded.
+def encode_vectorized(latitudes, longitudes, valid, to_type):
+    if to_type in vector_codecs:
+        encoded = vector_codecs[to_type][1](latitudes, longitudes)
+        return([ i if ok else None for (i, ok) in zip(encoded, valid.tolist()) ])
+    return(vectorized.encode_with(codecs[to_type][1], latitudes, longitudes, valid))
+
+# Decode and encode a list of coordinates which are all of the same type one at a time.
+#   Returns a list of whether or not each set of coordinates could be decoded, and for
+#   each type a list of strings, with None wherever they couldn't be encoded.
+def convert_scalar(coordinates, from_type, to_types):
+    valid = []
+    encoded = [ [] for i in to_types ]
+
+    for i in coordinates:
+        try:
+            (latitude, longitude) = decode_to_dd(i, from_type)
+            valid.append(True)
+        except:
+            valid.append(False)
+        for (j, to_type) in enumerate(to_types):
+            result = None
+            if valid[-1]:
+                try:
+                    result = encode_from_dd(latitude, longitude, to_type)
+                except:
+                    pass
+            encoded[j].append(result)
+    return((valid, encoded))
+
+# Decode and encode a list of coordinates which are all of the same type, with the
+#   vectorized engine if there are enough of them.  Returns a list of whether or not each
+#   set of coordinates could be decoded, and for each type a list of strings, with None
+#   wherever they couldn't be encoded.
+def convert_group(coordinates, from_type, to_types):
+    if vectorized and len(coordinates) >= vectorize_threshold:
+        (latitudes, longitudes, valid) = decode_vectorized(coordinates, from_type)
+        encoded = [ encode_vectorized(latitudes, longitudes, valid, i) for i in to_types ]
+        return((valid.tolist(), encoded))
+    return(convert_scalar(coordinates, from_type, to_types))
+
+# Runs in each worker process when it starts.  Converts one set of coordinates to and from
+#   every type so that the mgrs, geohash2, and openlocationcode modules (and the C library
+#   underneath mgrs) are loaded and warmed up before any real work shows up.
+def start_worker():
+    for i in codecs:
+        try:
+            decode_to_dd(encode_from_dd(42.6, -5.6, i), i)
+        except:
+            pass
+
+# Start the pool of worker processes if it isn't already running.  Returns the pool, or
+#   None if it's turned off or couldn't be started.
+def start_pool():
+    global pool
+
+    if pool_workers <= 1:
+        return(None)
+    if not pool:
+        try:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=pool_workers,
+                initializer=start_worker)
+        except:
+            return(None)
+    return(pool)
+
+# Convert a list of coordinates which are all of the same type with the pool of worker
+#   processes.  The coordinates are split into a few chunks per worker, and the chunks are
+#   put back together in order.  If the pool can't be used, the coordinates are converted
+#   in this process instead.  Returns the same thing as convert_group().
+def convert_parallel(coordinates, from_type, to_types):
+    global pool
+
+    workers = start_pool()
+    if not workers:
+        return(convert_group(coordinates, from_type, to_types))
+
+    size = -(-len(coordinates) // (pool_workers * 4))
+    chunks = [ coordinates[i:i + size] for i in range(0, len(coordinates), size) ]
+    valid = []
+    encoded = [ [] for i in to_types ]
+    try:
+        for (chunk_valid, chunk_encoded) in workers.map(convert_group, chunks,
+                [ from_type ] * len(chunks), [ to_types ] * len(chunks)):
+            valid.extend(chunk_valid)
+            for (i, j) in zip(encoded, chunk_encoded):
+                i.extend(j)
+    except concurrent.futures.process.BrokenProcessPool:
+        pool = None
+        return(convert_group(coordinates, from_type, to_types))
+    return((valid, encoded))
+
+# Convert a batch of items.  Items which are in the cache are answered from it.  The rest
+#   are grouped by their "from" and "to" types and decoded once per item.  Big enough
+#   groups go through the vectorized engine, and really big ones are spread across the
+#   pool of worker processes.  If the cache is off, the coordinates go straight to the
+#   converter without being normalized (unless they have to be quantized) or having cache
+#   keys built for them.  If every item shares the same "from" and "to", which have
+#   already been checked, shared_types is the list of types to convert them to, and the
+#   items aren't checked one by one.  Returns a list of results in the same order as the
+#   items.
+def convert_batch(items, shared_types=None):
+    results = [ None ] * len(items)
+    keys = [ None ] * len(items)
+    sources = [ None ] * len(items)
+    groups = {}
+    to_types = shared_types
+
+    for i in range(len(items)):
+        if shared_types is None:
+            results[i] = validate_item(items[i])
+            if results[i]:
+                continue
+            to_types = output_types(items[i]["to"])
+        sources[i] = str(items[i]["coordinates"])
+        if cache_size:
+            keys[i] = cache_keys(sources[i], items[i]["from"], to_types)
+            cached = [ cache_get(j) for j in keys[i] ]
+            if None not in cached:
+                results[i] = { "result": assemble(items[i]["to"], to_types, cached) }
+                continue
+            sources[i] = keys[i][0][0]
+        elif cache_quantization is not None:
+            sources[i] = normalize_coordinates(sources[i], items[i]["from"])
+        groups.setdefault((items[i]["from"], tuple(to_types)), []).append(i)
+
+    for ((from_type, to_types), indices) in groups.items():
+        coordinates = [ sources[i] for i in indices ]
+        if len(indices) >= pool_threshold:
+            (valid, encoded) = convert_parallel(coordinates, from_type, to_types)
+        else:
+            (valid, encoded) = convert_group(coordinates, from_type, to_types)
+
+        for (j, i) in enumerate(indices):
+            converted = [ k[j] for k in encoded ]
+            if keys[i]:
+                for (key, result) in zip(keys[i], converted):
+                    if result is not None:
+                        cache_put(key, result)
+            if not valid[j] or (not fan_out(items[i]["to"]) and converted[0] is None):
+                results[i] = { "error": "Could not convert coordinates." }
+            else:
+                results[i] = { "result": assemble(items[i]["to"], list(to_types), converted) }
+
+    return(results)
+
+# Convert a single request carrying a list of coordinates which all share the same "from"
+#   and "to".  The types are checked once for the whole list instead of once per set of
+#   coordinates.  Returns a list of results in the same order as the coordinates.
+def convert_shared_batch(arguments):
+    error = validate_types(arguments)
+    if error:
+        return([ dict(error) for i in arguments["coordinates"] ])
+
+    items = []
+    for coordinates in arguments["coordinates"]:
+        items.append({ "coordinates": coordinates, "from": arguments["from"],
+            "to": arguments["to"] })
+    return(convert_batch(items, output_types(arguments["to"])))
+
+# Work out whether or not the request is a CSV file or a GeoJSON FeatureCollection to
+#   convert.  Those are described by the query string, which the watchdog puts into the
+#   Http_Query environment variable.  Returns a hash table of options, or None.
+def stream_options(query):
+    options = urllib.parse.parse_qs(query or "")
+    if "format" not in options:
+        return(None)
+    return({ key: values[0] for (key, values) in options.items() })
+
+# Stream a CSV file or a GeoJSON FeatureCollection through the converter.  Returns a
+#   generator of pieces of the converted document, or a string containing an error message
+#   if the options don't make sense.
+def convert_stream(source, options):
+    from_type = options.get("from")
+    to_type = options.get("to", "")
+    if "," in to_type:
+        to_type = to_type.split(",")
+    to_types = output_types(to_type)
+
+    if options["format"] == "csv":
+        if "latitude" in options and "longitude" in options:
+            columns = [ options["latitude"], options["longitude"] ]
+            from_type = options.get("from", "dd")
+        elif "column" in options:
+            columns = [ options["column"] ]
+        else:
+            return("Missing column (or latitude and longitude) in query string.")
+    elif options["format"] == "geojson":
+        if "property" not in options:
+            from_type = "dd"
+    else:
+        return("I don't support that stream format.")
 
-        # Case: output is mgrs.
-        if (coordinates["to"] == "mgrs"):
-            gridref = dd_to_mgrs(latitude, longitude)
-            return(gridref)
+    if from_type not in supported_coordinates:
+        return("I don't support that input coordinate type.")
+    if to_types is None:
+        return("I don't support that output coordinate type.")
 
-        # Case: output is geohash.
-        if (coordinates["to"] == "geohash"):
-            geohash = dd_to_geohash(latitude, longitude)
-            return(geohash)
+    if options["format"] == "csv":
+        return(streaming.convert_csv(source, columns, from_type, to_type, to_types,
+            convert_batch))
+    return(streaming.convert_geojson(source, options.get("property"), from_type, to_type,
+        to_types, convert_batch))
 
-    # Case: dd to something
-    if (coordinates["from"] == "dd"):
+# Convert a batch of coordinates in the binary format (see binary.py).  Decimal degrees
+#   come in and go out as pairs of floats, everything else as a block of strings.  Returns
+#   the converted batch in the binary format, or a string containing an error message.
+def convert_binary(body):
+    try:
+        (from_type, to_type, coordinates) = binary.unpack(body)
+    except ValueError as e:
+        return("Malformed binary request: " + str(e))
+    if from_type not in supported_coordinates:
+        return("I don't support that input coordinate type.")
+    if to_type not in supported_coordinates:
+        return("I don't support that output coordinate type.")
 
-        # Case: output is dms.
-        if (coordinates["to"] == "dms"):
-            (latitude, longitude) = coordinates["coordinates"].split()
+    if coordinates.ndim == 2:
+        if canonical_names[from_type] != "dd":
+            return("Only decimal degrees can be sent as floats.")
+        (latitudes, longitudes, valid) = binary.columns(coordinates)
+    else:
+        (latitudes, longitudes, valid) = decode_vectorized(binary.strings(coordinates),
+            from_type)
+
+    if canonical_names[to_type] == "dd":
+        return(binary.pack(from_type, to_type, binary.pairs(latitudes, longitudes, valid)))
+    encoded = encode_vectorized(latitudes, longitudes, valid, to_type)
+    return(binary.pack(from_type, to_type, binary.string_block(encoded)))
+
+# Where a spatial index is saved.
+def index_path(name):
+    return(os.path.join(index_directory, name + ".npy"))
+
+# Look a spatial index up by name, loading it from index_directory if it isn't in memory.
+#   Returns the index, or None if there isn't one by that name.
+def get_index(name):
+    if name not in indexes and index_directory and os.path.exists(index_path(name)):
+        indexes[name] = spatial.load(index_path(name))
+    return(indexes.get(name))
+
+# Replace a spatial index, saving it if index_directory is set.
+def put_index(name, points):
+    if index_directory:
+        spatial.save(points, index_path(name))
+    indexes[name] = points
+
+# Add points to a spatial index, creating it if it doesn't exist.  Points which can't be
+#   decoded are left out.  Returns a hash table describing what happened.
+def index_add(name, points, from_type):
+    ids = []
+    coordinates = []
+    errors = []
+
+    for point in points:
+        if not isinstance(point, dict) or "id" not in point or "coordinates" not in point:
+            errors.append({ "point": point, "error": "Points need an id and coordinates." })
+            continue
+        ids.append(str(point["id"]))
+        coordinates.append(str(point["coordinates"]))
+
+    (latitudes, longitudes, valid) = decode_vectorized(coordinates, from_type)
+    for (i, ok) in zip(ids, valid.tolist()):
+        if not ok:
+            errors.append({ "id": i, "error": "Could not convert coordinates." })
+
+    index = get_index(name)
+    if index is None:
+        index = spatial.empty()
+    index = spatial.insert(index, [ i for (i, ok) in zip(ids, valid.tolist()) if ok ],
+        latitudes[valid], longitudes[valid])
+    put_index(name, index)
+    return({ "index": name, "points": len(index), "added": int(valid.sum()),
+        "errors": errors })
+
+# Turn the points found by a search into a hash table of results, converting them to the
+#   type asked for.
+def index_results(name, index, indices, distances, to_type, scanned):
+    (latitudes, longitudes, valid) = spatial.columns(index, indices)
+    encoded = encode_vectorized(latitudes, longitudes, valid, to_type)
+    results = []
+    for (i, j) in enumerate(index["id"][indices].tolist()):
+        results.append({ "id": j, "coordinates": encoded[i] })
+        if distances is not None:
+            results[-1]["distance"] = float(distances[i])
+    return({ "index": name, "scanned": scanned, "results": results })
+
+# Carry out an operation on a spatial index.  Returns a string: a JSON document, or an
+#   error message.
+def index_request(arguments):
+    name = arguments["index"]
+    operation = arguments.get("operation", "info")
+    from_type = arguments.get("from", "dd")
+    to_type = arguments.get("to", "dd")
+
+    if not spatial:
+        return("The spatial index needs NumPy.")
+    if not isinstance(name, str) or not index_name.fullmatch(name):
+        return("Index names can only have letters, numbers, - and _ in them.")
+    if from_type not in supported_coordinates:
+        return("I don't support that input coordinate type.")
+    if to_type not in supported_coordinates:
+        return("I don't support that output coordinate type.")
 
-            latitude = dd_to_dms(latitude)
-            if "+" in latitude:
-                latitude = re.sub("\+", "N", latitude)
-            else:
-                latitude = re.sub("\-", "S", latitude)
+    if operation == "add":
+        if not isinstance(arguments.get("points"), list):
+            return("Missing list of points.")
+        return(json.dumps(index_add(name, arguments["points"], from_type)))
+
+    index = get_index(name)
+    if index is None:
+        return("I don't know about that index.")
+
+    if operation == "info":
+        return(json.dumps({ "index": name, "points": len(index),
+            "saved": bool(index_directory) }))
+    if operation == "drop":
+        del indexes[name]
+        if index_directory:
+            os.remove(index_path(name))
+        return(json.dumps({ "index": name, "dropped": len(index) }))
+    if operation == "remove":
+        if not isinstance(arguments.get("ids"), list):
+            return("Missing list of ids.")
+        put_index(name, spatial.remove(index, arguments["ids"]))
+        return(json.dumps({ "index": name, "points": len(indexes[name]),
+            "removed": len(index) - len(indexes[name]) }))
 
-            longitude = dd_to_dms(longitude)
-            if "+" in longitude:
-                longitude = re.sub("\+", "E", longitude)
-            else:
-                longitude = re.sub("\-", "W", longitude)
-
-            return(latitude + " " + longitude)
-
-        # Case: output is openlocationcode/pluscode.
-        if (coordinates["to"] == "openlocationcode") or (coordinates["to"] == "pluscode"):
-            pluscode = dd_to_pluscode(coordinates["coordinates"])
-            return(pluscode)
-
-        # Case: output is mgrs.
-        if (coordinates["to"] == "mgrs"):
-            (latitude, longitude) = coordinates["coordinates"].split()
-            gridref = dd_to_mgrs(latitude, longitude)
-            return(gridref)
-
-        # Case: output is geohash.
-        if (coordinates["to"] == "geohash"):
-            (latitude, longitude) = coordinates["coordinates"].split()
-            geohash = dd_to_geohash(latitude, longitude)
-            return(geohash)
-
-    # Case: openlocationcode/pluscode to something.
-    if (coordinates["from"] == "openlocationcode") or (coordinates["from"] == "pluscode"):
-
-        # First convert to dd.
-        (latitude, longitude) = pluscode_to_dd(coordinates["coordinates"]).split()
-
-        # Case: output is dd.
-        if coordinates["to"] == "dd":
-            return(latitude + " " + longitude)
-
-        # Case: output is dms.
-        if coordinates["to"] == "dms":
-            latitude = dd_to_dms(latitude)
-            if "+" in latitude:
-                latitude = re.sub("\+", "N", latitude)
+    try:
+        if operation == "bbox":
+            (south, west, north, east) = [ float(i) for i in arguments["bbox"] ]
+            (indices, scanned) = spatial.bbox_query(index, south, west, north, east)
+            return(json.dumps(index_results(name, index, indices, None, to_type, scanned)))
+        if operation == "geohash":
+            (indices, scanned) = spatial.prefix_query(index, str(arguments["geohash"]))
+            return(json.dumps(index_results(name, index, indices, None, to_type, scanned)))
+        if operation in [ "radius", "nearest" ]:
+            (latitude, longitude) = decode_to_dd(str(arguments["center"]), from_type)
+            radius = arguments.get("radius")
+            if radius is not None:
+                radius = float(radius)
+            if operation == "radius":
+                if radius is None:
+                    return("Missing radius.")
+                (indices, distances, scanned) = spatial.radius_query(index, latitude,
+                    longitude, radius)
             else:
-                latitude = re.sub("\-", "S", latitude)
+                (indices, distances, scanned) = spatial.nearest(index, latitude, longitude,
+                    int(arguments.get("k", 1)), radius)
+            return(json.dumps(index_results(name, index, indices, distances, to_type,
+                scanned)))
+    except ValueError as e:
+        return("Could not search the index: " + str(e))
+    except:
+        return("Could not search the index.")
+    return("I don't support that index operation.")
 
-            longitude = dd_to_dms(longitude)
-            if "+" in longitude:
-                longitude = re.sub("\+", "E", longitude)
-            else:
-                longitude = re.sub("\-", "W", longitude)
-            return(latitude + " " + longitude)
-
-        # Case: output is mgrs.
-        if coordinates["to"] == "mgrs":
-            gridref = dd_to_mgrs(latitude, longitude)
-            return(gridref)
-
-        # Case: output is geohash.
-        if coordinates["to"] == "geohash":
-            geohash = dd_to_geohash(latitude, longitude)
-            return(geohash)
-
-    # Case: mgrs to something.
-    if (coordinates["from"] == "mgrs"):
-
-        # First convert to dd.
-        (latitude, longitude) = mgrs_to_dd(coordinates["coordinates"]).split()
-
-        # Case: output is dd.
-        if coordinates["to"] == "dd":
-            return(latitude + " " + longitude)
-
-        # Case: output is dms.
-        if coordinates["to"] == "dms":
-            latitude = dd_to_dms(latitude)
-            if "+" in latitude:
-                latitude = re.sub("\+", "N", latitude)
-            else:
-                latitude = re.sub("\-", "S", latitude)
+# Entry point to the function.
+def handle(req):
+    coordinates = {}
 
-            longitude = dd_to_dms(longitude)
-            if "+" in longitude:
-                longitude = re.sub("\+", "E", longitude)
-            else:
-                longitude = re.sub("\-", "W", longitude)
+    # If no input, return online help.
+    if not req:
+        return(help)
 
-            return(latitude + " " + longitude)
+    # Case: a batch in the binary format.
+    if binary and binary.is_binary(req):
+        return(convert_binary(req))
 
-        # Case: output is openlocationcode/pluscode.
-        if (coordinates["to"] == "openlocationcode") or (coordinates["to"] == "pluscode"):
-            pluscode = dd_to_pluscode(latitude + " " + longitude)
-            return(pluscode)
+    # Some templates hand the request over as bytes.
+    if isinstance(req, (bytes, bytearray)):
+        req = req.decode("utf-8", "replace")
 
-        # Case: output is geohash.
-        if coordinates["to"] == "geohash":
-            geohash = dd_to_geohash(latitude, longitude)
-            return(geohash)
+    # Case: a CSV file or GeoJSON FeatureCollection to stream through.
+    options = stream_options(os.environ.get("Http_Query"))
+    if options:
+        stream = convert_stream(req, options)
+        if isinstance(stream, str):
+            return(stream)
+        return("".join(stream))
 
-    # Case: geohash to something.
-    if (coordinates["from"] == "geohash"):
+    # Deserialize the JSON document from the user.
+    coordinates = deserialize_content(req)
+    if coordinates is None:
+        coordinates = deserialize_ndjson(req)
+    if not coordinates:
+        return("Could not deserialize JSON.")
 
-        # First convert to dd.
-        (latitude, longitude) = geohash_to_dd(coordinates["coordinates"]).split()
+    # Case: a request for the cache's statistics.
+    if isinstance(coordinates, dict) and coordinates.get("stats"):
+        return(json.dumps(cache_statistics()))
 
-        # Case: output is dd.
-        if coordinates["to"] == "dd":
-            return(latitude + " " + longitude)
+    # Case: something to do with a spatial index.
+    if isinstance(coordinates, dict) and "index" in coordinates:
+        return(index_request(coordinates))
 
-        # Case: output is dms.
-        if coordinates["to"] == "dms":
-            latitude = dd_to_dms(latitude)
-            if "+" in latitude:
-                latitude = re.sub("\+", "N", latitude)
-            else:
-                latitude = re.sub("\-", "S", latitude)
+    # Case: a batch of requests.
+    if isinstance(coordinates, list):
+        return(json.dumps(convert_batch(coordinates)))
 
-            longitude = dd_to_dms(longitude)
-            if "+" in longitude:
-                longitude = re.sub("\+", "E", longitude)
-            else:
-                longitude = re.sub("\-", "W", longitude)
+    # Make sure we have everything we need.
+    if not ensure_all_keys(coordinates):
+        return("Required key missing in JSON.")
 
-            return(latitude + " " + longitude)
+    # Case: a batch of coordinates which share the same types.
+    if isinstance(coordinates["coordinates"], list):
+        return(json.dumps(convert_shared_batch(coordinates)))
 
-        # Case: output is openlocationcode/pluscode.
-        if (coordinates["to"] == "openlocationcode") or (coordinates["to"] == "pluscode"):
-            pluscode = dd_to_pluscode(latitude + " " + longitude)
-            return(pluscode)
+    # Make sure the types of the supplied coordinates is supported.
+    if coordinates["from"] not in supported_coordinates:
+        return("I don't support that input coordinate type.")
+    if output_types(coordinates["to"]) is None:
+        return("I don't support that output coordinate type.")
 
-        # Case: output is mgrs.
-        if coordinates["to"] == "mgrs":
-            gridref = dd_to_mgrs(latitude, longitude)
-            return(gridref)
+    # The codecs only take strings (the mgrs module crashes outright on anything else), the
+    # same as in a batch.
+    try:
+        # Case: the coordinates as more than one type.
+        if fan_out(coordinates["to"]):
+            return(json.dumps(convert_all(str(coordinates["coordinates"]),
+                coordinates["from"], output_types(coordinates["to"]))))
 
-    return(help)
+        return(cached_convert(str(coordinates["coordinates"]), coordinates["from"],
+            coordinates["to"]))
+    except codec_errors as e:
+        return("Could not convert coordinates: " + str(e))
 
 if __name__ == "__main__":
     print("Unit testing mode.")
@@ -426,6 +1242,19 @@ if __name__ == "__main__":
     else:
         print("All keys not found.  Oops.")
 
+    # Coordinates that can't be decoded get an error message, one type or many.
+    print("Testing undecodable coordinates...")
+    for request in [ { "coordinates": "garbage", "from": "mgrs", "to": "all" },
+            { "coordinates": "xx", "from": "pluscode", "to": [ "dd", "mgrs" ] },
+            { "coordinates": "garbage", "from": "mgrs", "to": "dd" },
+            { "coordinates": "!!", "from": "geohash", "to": "dd" },
+            { "coordinates": 42, "from": "mgrs", "to": "dd" } ]:
+        result = handle(json.dumps(request))
+        if result.startswith("Could not convert coordinates: "):
+            print("    " + result)
+        else:
+            print("    " + json.dumps(request) + " came back as " + result + ".  Oops.")
+
     print("Testing valid input coordinate type...", end=" ")
     test["from"] = "dms"
     if not handle(json.dumps(test)):
@@ -459,6 +1288,35 @@ if __name__ == "__main__":
         print("'barf' not supported.  Good.")
 
     # DMS conversions.
+    print("Checking that the different ways of writing DMS come out the same...", end=" ")
+    expected = decode_dms("48°53'10.18\"N 2°20'35.09\"W")
+    mismatches = 0
+    for i in [ "48° 53' 10.18\" N, 2° 20' 35.09\" W", "N48°53'10.18\" W2°20'35.09\"",
+            "48d53'10.18'' -2d20'35.09''", "48 53 10.18 -2 20 35.09", "N 48 53 10.18 W 2 20 35.09",
+            "2°20'35.09\"W 48°53'10.18\"N", "48°53.1696666666667'N 2°20'35.09\"W" ]:
+        if [ round(j, 9) for j in decode_dms(i) ] != [ round(j, 9) for j in expected ]:
+            mismatches = mismatches + 1
+    if decode_dms("10°0'10.05\"N 0°0'0.5\"E") != (10 + 10.05 / 3600, 0.5 / 3600):
+        mismatches = mismatches + 1
+    if not mismatches:
+        print("They do.")
+    else:
+        print(str(mismatches) + " mismatches.  Oops.")
+
+    print("Converting bad DMS to DD...", end=" ")
+    test["coordinates"] = "48°53'10.18\"N 2°20'X35.09\"W"
+    test["from"] = "dms"
+    test["to"] = "dd"
+    print(handle(json.dumps(test)))
+
+    print("Converting an odd number of unmarked DMS numbers to DD...", end=" ")
+    test["coordinates"] = "1 2 3"
+    result = handle(json.dumps(test))
+    if result.startswith("Could not convert coordinates: "):
+        print(result)
+    else:
+        print("Came back as " + result + ".  Oops.")
+
     # Test dms to dd.
     print("Converting DMS to DD...", end=" ")
     test["coordinates"] = "48°53'10.18\"N 2°20'35.09\"E"
@@ -488,6 +1346,13 @@ if __name__ == "__main__":
     test["to"] = "dms"
     print(handle(json.dumps(test)))
 
+    # Test dd to dd.
+    print("Converting DD to DD...", end=" ")
+    test["coordinates"] = "-48.8866111111   -2.34330555556"
+    test["from"] = "dd"
+    test["to"] = "dd"
+    print(handle(json.dumps(test)))
+
     # Test dd to openlocation code.
     print("Converting DD to pluscode...", end=" ")
     test["coordinates"] = "-48.8866111111 -2.34330555556"
@@ -602,6 +1467,467 @@ if __name__ == "__main__":
     test["to"] = "mgrs"
     print(handle(json.dumps(test)))
 
+    # Fan-out conversions.
+    print("Converting DD to all types...", end=" ")
+    test["coordinates"] = "-48.8866111111 -2.34330555556"
+    test["from"] = "dd"
+    test["to"] = "all"
+    print(handle(json.dumps(test)))
+
+    print("Converting MGRS to DD and geohash...", end=" ")
+    test["coordinates"] = "15TWG0000049776"
+    test["from"] = "mgrs"
+    test["to"] = [ "dd", "geohash" ]
+    print(handle(json.dumps(test)))
+
+    print("Converting MGRS to DD and barf...", end=" ")
+    test["to"] = [ "dd", "barf" ]
+    print(handle(json.dumps(test)))
+
+    print("Checking that fan-out conversions match single conversions...", end=" ")
+    test["to"] = "all"
+    fanned_out = json.loads(handle(json.dumps(test)))
+    mismatches = 0
+    for i in fanned_out:
+        test["to"] = i
+        if fanned_out[i] != handle(json.dumps(test)):
+            mismatches = mismatches + 1
+    if sorted(fanned_out) != sorted(set(canonical_names.values())):
+        mismatches = mismatches + 1
+    if not mismatches:
+        print("They match.")
+    else:
+        print(str(mismatches) + " mismatches.  Oops.")
+
+    # Batch conversions.
+    print("Converting a batch of requests...", end=" ")
+    batch = []
+    batch.append({ "coordinates": "48°53'10.18\"N 2°20'35.09\"E", "from": "dms", "to": "dd" })
+    batch.append({ "coordinates": "8FVC9G8F+6X", "from": "pluscode", "to": "mgrs" })
+    batch.append({ "coordinates": "ezs42e44yx96", "from": "geohash", "to": "barf" })
+    batch.append({ "coordinates": "15TWG0000049776", "from": "mgrs" })
+    batch.append({ "coordinates": "ezs42e44yx96", "from": "geohash", "to": [ "dd", "dms" ] })
+    print(handle(json.dumps(batch)))
+
+    print("Converting a batch of newline-delimited requests...", end=" ")
+    print(handle("\n".join([ json.dumps(i) for i in batch ])))
+
+    print("Converting a list of coordinates...", end=" ")
+    test["coordinates"] = [ "-48.8866111111 -2.34330555556", "42.6 -5.6", "barf" ]
+    test["from"] = "dd"
+    test["to"] = "dms"
+    print(handle(json.dumps(test)))
+
+    # Turn the cache off so that everything below is actually converted.
+    cache_size = 0
+
+    print("Checking that batches match single conversions...", end=" ")
+    mismatches = 0
+    for i in [ "dd", "pluscode", "mgrs", "geohash" ]:
+        test["coordinates"] = "48°53'10.18\"N 2°20'35.09\"E"
+        test["from"] = "dms"
+        test["to"] = i
+        single = handle(json.dumps(test))
+        test["coordinates"] = [ test["coordinates"] ]
+        if json.loads(handle(json.dumps(test)))[0]["result"] != single:
+            mismatches = mismatches + 1
+    if not mismatches:
+        print("They match.")
+    else:
+        print(str(mismatches) + " mismatches.  Oops.")
+
+    print("Checking lists of coordinates which share their types...", end=" ")
+    mismatches = 0
+    for i in [ "mgrs", [ "dd", "geohash" ], "barf" ]:
+        test["coordinates"] = [ "4QFJ1234567890", "barf", 42 ]
+        test["from"] = "mgrs"
+        test["to"] = i
+        batch = [ { "coordinates": j, "from": "mgrs", "to": i } for j in test["coordinates"] ]
+        if json.loads(handle(json.dumps(test))) != [ convert_item(j) for j in batch ]:
+            mismatches = mismatches + 1
+    if not mismatches:
+        print("They match single conversions.")
+    else:
+        print(str(mismatches) + " mismatches.  Oops.")
+
+    print("Checking that batches still quantize with the cache off...", end=" ")
+    cache_quantization = 2
+    clear_cache()
+    batch = [ { "coordinates": "42.60123 -5.60123", "from": "dd", "to": [ "dd", "mgrs" ] } ]
+    single = [ convert_item(i) for i in batch ]
+    if convert_batch(batch) != single or single[0]["result"]["dd"] != "42.6 -5.6":
+        print("They don't.  Oops.")
+    elif cache_stats["misses"] or len(cache):
+        print("The cache was used.  Oops.")
+    else:
+        print("They do.")
+    cache_quantization = None
+
+    print("Checking that vectorized batches match single conversions...", end=" ")
+    if not vectorized:
+        print("NumPy isn't installed, skipping.")
+    else:
+        mismatches = 0
+        for i in [ "dms", "dd", "pluscode", "mgrs", "geohash" ]:
+            for j in [ "dms", "dd", "pluscode", "mgrs", "geohash", "all", [ "dd", "mgrs" ] ]:
+                batch = []
+                for k in range(vectorize_threshold):
+                    latitude = -89.0 + (k * 178.0 / vectorize_threshold) + 0.123456789
+                    longitude = -179.0 + (k * 358.0 / vectorize_threshold) + 0.987654321
+                    batch.append({ "coordinates": encode_from_dd(latitude, longitude, i),
+                        "from": i, "to": j })
+                batch.append({ "coordinates": "barf", "from": i, "to": j })
+                single = [ convert_item(k) for k in batch ]
+                if convert_batch(batch) != single:
+                    mismatches = mismatches + 1
+        if not mismatches:
+            print("They match.")
+        else:
+            print(str(mismatches) + " mismatches.  Oops.")
+
+    print("Checking that vectorized DMS takes NaNs and infinities quietly...", end=" ")
+    if not vectorized:
+        print("NumPy isn't installed, skipping.")
+    else:
+        import warnings
+        batch = [ { "coordinates": i, "from": "dd", "to": "dms" }
+            for i in [ "nan 5", "inf -5", "-inf nan", "42.6 -5.6" ] * vectorize_threshold ]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            converted = convert_batch(batch)
+        if caught:
+            print("NumPy warned: " + str(caught[0].message) + ".  Oops.")
+        elif converted != [ convert_item(i) for i in batch ]:
+            print("They don't match single conversions.  Oops.")
+        else:
+            print("It does.")
+
+    print("Checking vectorized MGRS against the mgrs module...", end=" ")
+    if not vectorized:
+        print("NumPy isn't installed, skipping.")
+    else:
+        latitudes = []
+        longitudes = []
+        for i in range(-90 * 4, 90 * 4):
+            for j in range(-180, 181):
+                latitudes.append(i / 4.0 + 0.0001)
+                longitudes.append(j + 0.0001)
+        gridrefs = encode_mgrs_array(latitudes, longitudes)
+        mismatches = 0
+        for i in range(len(gridrefs)):
+            if gridrefs[i] != dd_to_mgrs(latitudes[i], longitudes[i]):
+                mismatches = mismatches + 1
+        (decoded_latitudes, decoded_longitudes, valid) = decode_mgrs_array(gridrefs)
+        for i in range(len(gridrefs)):
+            if (decoded_latitudes[i], decoded_longitudes[i]) != mgrs_to_dd(gridrefs[i]):
+                mismatches = mismatches + 1
+        if not mismatches:
+            print("They match.")
+        else:
+            print(str(mismatches) + " mismatches.  Oops.")
+
+    print("Checking that batches converted by the process pool match...", end=" ")
+    pool_threshold = 100
+    pool_workers = 2
+    batch = []
+    for i in range(1000):
+        latitude = -79.0 + (i * 162.0 / 1000) + 0.123456789
+        longitude = -179.0 + (i * 358.0 / 1000) + 0.987654321
+        batch.append({ "coordinates": dd_to_mgrs(latitude, longitude), "from": "mgrs",
+            "to": [ "dd", "pluscode", "geohash" ] })
+    batch[500]["coordinates"] = "barf"
+    single = [ convert_item(i) for i in batch ]
+    if convert_batch(batch) == single:
+        print("They match.")
+    else:
+        print("They don't.  Oops.")
+    pool_threshold = 20000
+
+    print("Checking that binary batches match single conversions...", end=" ")
+    if not binary:
+        print("NumPy isn't installed, skipping.")
+    else:
+        points = []
+        for i in range(200):
+            points.append([ -79.0 + (i * 162.0 / 200) + 0.123456789,
+                -179.0 + (i * 358.0 / 200) + 0.987654321 ])
+        points[100] = [ float("nan"), 0.0 ]
+        mismatches = 0
+        for i in [ "dms", "dd", "pluscode", "mgrs", "geohash" ]:
+            response = binary.decode_response(handle(binary.encode_request("dd", i, points)))
+            expected = [ None if j[0] != j[0] else encode_from_dd(j[0], j[1], i)
+                for j in points ]
+            if i == "dd":
+                expected = [ None if j[0] != j[0] else tuple(j) for j in points ]
+            if response != expected:
+                mismatches = mismatches + 1
+            if i == "dd":
+                continue
+            response = binary.decode_response(handle(binary.encode_request(i, "dd",
+                [ j or "barf" for j in expected ])))
+            for (j, k) in zip(expected, response):
+                if (j is None and k is not None) or (j and k != decode_to_dd(j, i)):
+                    mismatches = mismatches + 1
+        if not mismatches:
+            print("They match.")
+        else:
+            print(str(mismatches) + " mismatches.  Oops.")
+
+        print("Checking that binary requests aren't copied...", end=" ")
+        request = bytearray(binary.encode_request("dd", "mgrs", points))
+        coordinates = binary.unpack(request)[2]
+        request[binary.header.size + 8:binary.header.size + 16] = binary.pairs([ 1.5 ],
+            [ 2.5 ], [ True ]).tobytes()[:8]
+        if coordinates[0, 0] == 1.5:
+            print("They aren't.")
+        else:
+            print("They are.  Oops.")
+
+        print("Sending a malformed binary request...", end=" ")
+        print(handle(binary.encode_request("dd", "mgrs", points)[:100]))
+
+    # Streaming conversions.  Small chunks and batches make sure that rows and features
+    #   which straddle them come out right.
+    streaming.chunk_size = 7
+    streaming.batch_size = 3
+
+    print("Streaming a CSV file...")
+    os.environ["Http_Query"] = "format=csv&from=mgrs&to=dd,geohash&column=gridref"
+    document = "name,gridref\r\nsite 1,15TWG0000049776\r\nsite 2,barf\r\n\"site\n3\",4QFJ12345678\r\n"
+    document = document + "\r\nshort\r\nsite 5,4QFJ12345678,extra\r\nsite 6,30TTN8670219673"
+    print(handle(document))
+
+    print("Checking that streamed rows match single conversions...", end=" ")
+    os.environ["Http_Query"] = "format=csv&to=mgrs&latitude=lat&longitude=lon"
+    document = "lat,lon\n"
+    expected = []
+    for i in range(20):
+        document = document + str(i * 4.1 - 40) + "," + str(i * 8.3 - 80) + "\n"
+        expected.append(dd_to_mgrs(i * 4.1 - 40, i * 8.3 - 80))
+    rows = handle(document).splitlines()[1:]
+    if [ i.split(",")[2] for i in rows ] == expected:
+        print("They match.")
+    else:
+        print("They don't.  Oops.")
+
+    print("Streaming a GeoJSON FeatureCollection...")
+    os.environ["Http_Query"] = "format=geojson&to=mgrs"
+    collection = { "type": "FeatureCollection", "features": [] }
+    collection["features"].append({ "type": "Feature", "properties": { "name": "one" },
+        "geometry": { "type": "Point", "coordinates": [ -93.0, 42.0 ] } })
+    collection["features"].append({ "type": "Feature", "properties": None,
+        "geometry": { "type": "LineString", "coordinates": [ [ 0, 0 ], [ 1, 1 ] ] } })
+    collection["features"].append("barf")
+    collection["features"].append({ "type": "Feature", "properties": { "name": "four" },
+        "geometry": { "type": "Point", "coordinates": [ 2.343, 48.886 ] } })
+    collection["features"].append({ "type": "Feature",
+        "properties": { "name": "five", "error": "Left over from somewhere else." },
+        "geometry": { "type": "Point", "coordinates": [ 10.0, 20.0 ] } })
+    collection["features"].append({ "type": "Feature", "properties": { "name": "six" },
+        "geometry": { "type": "Point", "coordinates": [ 30.0, 40.0 ] } })
+    collection["bbox"] = [ -93.0, 0, 2.343, 48.886 ]
+    document = json.dumps(collection, indent=2)
+    converted = handle(document)
+    print(converted)
+
+    print("Checking that the converted FeatureCollection is valid JSON...", end=" ")
+    converted = json.loads(converted)
+    if len(converted["features"]) == 6 and "error" not in converted:
+        print("It is.")
+    else:
+        print("It isn't.  Oops.")
+
+    # A feature that already had an "error" property still gets converted, and doesn't
+    # throw off the features after it.
+    print("Checking that every feature got its own coordinates...", end=" ")
+    properties = [ i["properties"] for i in converted["features"] ]
+    if properties[4] == { "name": "five", "mgrs": dd_to_mgrs(20.0, 10.0) } and \
+            properties[5] == { "name": "six", "mgrs": dd_to_mgrs(40.0, 30.0) }:
+        print("They did.")
+    else:
+        print("They didn't.  Oops.")
+
+    print("Streaming a truncated GeoJSON FeatureCollection...", end=" ")
+    print(json.loads(handle(document[:document.index("four")]))["error"])
+
+    print("Streaming with a bad query string...", end=" ")
+    os.environ["Http_Query"] = "format=csv&from=dd&to=mgrs"
+    print(handle("lat,lon\n1,2\n"))
+    del os.environ["Http_Query"]
+
+    # Spatial indexes.  Every search is checked against looking at every point.
+    print("Checking that spatial index searches match searching every point...", end=" ")
+    if not spatial:
+        print("NumPy isn't installed, skipping.")
+    else:
+        import tempfile
+
+        points = {}
+        for i in range(5000):
+            points["p" + str(i)] = (((i * 0.6180339887) % 1.0) * 180.0 - 90.0,
+                ((i * 0.7548776662) % 1.0) * 360.0 - 180.0)
+        points.update({ "north": (89.99, 10.0), "south": (-89.995, -170.0),
+            "east": (10.0, 179.999), "west": (10.0, -179.999), "zero": (0.0, 0.0) })
+
+        # Search an index every way there is, and count the searches which don't come out
+        #   the same as looking at every point.  Also count the points looked at.
+        def search_index(name, points):
+            ids = list(points)
+            latitudes = [ points[i][0] for i in ids ]
+            longitudes = [ points[i][1] for i in ids ]
+            mismatches = 0
+            scanned = 0
+
+            for (south, west, north, east) in [ (40.0, -80.0, 45.0, -70.0),
+                    (5.0, 170.0, 15.0, -170.0), (89.0, -180.0, 90.0, 180.0),
+                    (-10.0, -10.0, 10.0, 10.0), (-0.001, -0.001, 0.001, 0.001) ]:
+                result = json.loads(handle(json.dumps({ "index": name, "operation": "bbox",
+                    "bbox": [ south, west, north, east ] })))
+                expected = set([ i for i in ids if south <= points[i][0] <= north and
+                    ((west <= points[i][1] <= east) if west <= east else
+                    (points[i][1] >= west or points[i][1] <= east)) ])
+                if set([ i["id"] for i in result["results"] ]) != expected:
+                    mismatches = mismatches + 1
+                scanned = scanned + result["scanned"]
+
+            for (latitude, longitude, radius) in [ (42.0, -73.0, 500000.0),
+                    (10.0, 179.9, 100000.0), (89.5, 0.0, 200000.0), (0.0, 0.0, 1.0),
+                    (-30.0, 150.0, 20000000.0) ]:
+                center = encode_from_dd(latitude, longitude, "mgrs")
+                result = json.loads(handle(json.dumps({ "index": name,
+                    "operation": "radius", "center": center, "from": "mgrs",
+                    "radius": radius })))
+                (latitude, longitude) = mgrs_to_dd(center)
+                found = spatial.distances(latitude, longitude, latitudes, longitudes)
+                expected = set([ i for (i, j) in zip(ids, found.tolist()) if j <= radius ])
+                if set([ i["id"] for i in result["results"] ]) != expected:
+                    mismatches = mismatches + 1
+                scanned = scanned + result["scanned"]
+
+                for k in [ 1, 10 ]:
+                    result = json.loads(handle(json.dumps({ "index": name,
+                        "operation": "nearest", "center": center, "from": "mgrs",
+                        "k": k })))
+                    expected = [ ids[i] for i in found.argsort(kind="stable")[:k] ]
+                    if [ i["id"] for i in result["results"] ] != expected:
+                        mismatches = mismatches + 1
+                    scanned = scanned + result["scanned"]
+
+            for prefix in [ "d", "dr", "drt", "s0000", "zzzz", "" ]:
+                result = json.loads(handle(json.dumps({ "index": name,
+                    "operation": "geohash", "geohash": prefix })))
+                expected = set([ i for i in ids if dd_to_geohash(points[i][0],
+                    points[i][1]).startswith(prefix) ])
+                if set([ i["id"] for i in result["results"] ]) != expected:
+                    mismatches = mismatches + 1
+            return((mismatches, scanned))
+
+        index_directory = tempfile.mkdtemp()
+        request = { "index": "test", "operation": "add", "from": "geohash", "points": [] }
+        for (i, (latitude, longitude)) in points.items():
+            request["points"].append({ "id": i, "coordinates": dd_to_geohash(latitude,
+                longitude) })
+            points[i] = geohash_to_dd(request["points"][-1]["coordinates"])
+        request["points"].append({ "id": "bad", "coordinates": "barf" })
+        handle(json.dumps(request))
+        (mismatches, scanned) = search_index("test", points)
+
+        # Move some points, add some, take some away.
+        request = { "index": "test", "operation": "add", "points": [] }
+        for i in range(0, 5000, 7):
+            points["p" + str(i)] = (points["p" + str(i)][1] / 2.0, points["p" + str(i)][0])
+            points["q" + str(i)] = (points["p" + str(i)][0] + 0.5, 179.9999999)
+        for i in points:
+            if i.startswith("q") or i in [ "p" + str(j) for j in range(0, 5000, 7) ]:
+                request["points"].append({ "id": i, "coordinates": encode_dd(*points[i]) })
+        handle(json.dumps(request))
+        removed = [ "p" + str(i) for i in range(1, 5000, 3) ] + [ "north" ]
+        handle(json.dumps({ "index": "test", "operation": "remove", "ids": removed }))
+        for i in removed:
+            del points[i]
+        (updated_mismatches, updated_scanned) = search_index("test", points)
+        mismatches = mismatches + updated_mismatches
+
+        # Forget the index, so that it's loaded from disk.
+        indexes.clear()
+        (loaded_mismatches, loaded_scanned) = search_index("test", points)
+        mismatches = mismatches + loaded_mismatches
+        if len(indexes["test"]) != len(points) or not hasattr(indexes["test"], "filename"):
+            mismatches = mismatches + 1
+        handle(json.dumps({ "index": "test", "operation": "drop" }))
+        os.rmdir(index_directory)
+        index_directory = None
+
+        if not mismatches:
+            print("They match.")
+        else:
+            print(str(mismatches) + " mismatches.  Oops.")
+        print("    Searches looked at " + str(loaded_scanned) + " points instead of " +
+            str(len(points) * 20) + ".")
+
+    print("Searching a spatial index...", end=" ")
+    handle(json.dumps({ "index": "sites", "operation": "add", "points": [
+        { "id": "home", "coordinates": "42.6 -5.6" },
+        { "id": "office", "coordinates": "42.61 -5.58" },
+        { "id": "far away", "coordinates": "-48.8866111111 -2.34330555556" } ] }))
+    print(handle(json.dumps({ "index": "sites", "operation": "nearest", "center": "42.6 -5.59",
+        "k": 2, "to": "mgrs" })))
+
+    print("Searching a spatial index which doesn't exist...", end=" ")
+    print(handle(json.dumps({ "index": "barf", "operation": "bbox", "bbox": [ 0, 0, 1, 1 ] })))
+
+    cache_size = 16
+    clear_cache()
+
+    print("Checking that repeated conversions come from the cache...", end=" ")
+    test["coordinates"] = "15TWG0000049776"
+    test["from"] = "mgrs"
+    test["to"] = "dd"
+    single = handle(json.dumps(test))
+    test["to"] = "dms"
+    handle(json.dumps(test))
+    test["coordinates"] = [ "15TWG0000049776", "8FVC9G8F+6X" ]
+    test["to"] = "dd"
+    batch = json.loads(handle(json.dumps(test)))
+    if batch[0]["result"] == single and cache_stats["hits"] == 1 and cache_stats["misses"] == 3:
+        print("They do.")
+    else:
+        print("They don't.  Oops.  " + json.dumps(cache_statistics()))
+
+    print("Checking that aliases and whitespace share cache entries...", end=" ")
+    clear_cache()
+    handle(json.dumps({ "coordinates": "42.6 -5.6", "from": "dd", "to": "pluscode" }))
+    handle(json.dumps({ "coordinates": " 42.60  -5.600 ", "from": "dd",
+        "to": "openlocationcode" }))
+    if cache_stats["hits"] == 1 and len(cache) == 1:
+        print("They do.")
+    else:
+        print("They don't.  Oops.  " + json.dumps(cache_statistics()))
+
+    print("Checking that nearly identical fixes share a cache entry when quantized...", end=" ")
+    clear_cache()
+    cache_quantization = 4
+    handle(json.dumps({ "coordinates": "42.600001 -5.600001", "from": "dd", "to": "mgrs" }))
+    handle(json.dumps({ "coordinates": "42.600002 -5.600002", "from": "dd", "to": "mgrs" }))
+    cache_quantization = None
+    if cache_stats["hits"] == 1 and len(cache) == 1:
+        print("They do.")
+    else:
+        print("They don't.  Oops.  " + json.dumps(cache_statistics()))
+
+    print("Checking that the cache evicts the least recently used entries...", end=" ")
+    clear_cache()
+    for i in range(cache_size + 4):
+        handle(json.dumps({ "coordinates": str(i) + " 0", "from": "dd", "to": "geohash" }))
+    handle(json.dumps({ "coordinates": "0 0", "from": "dd", "to": "geohash" }))
+    if len(cache) == cache_size and cache_stats["evictions"] == 5 and not cache_stats["hits"]:
+        print("It does.")
+    else:
+        print("It doesn't.  Oops.  " + json.dumps(cache_statistics()))
+
+    print("Getting the cache's statistics...", end=" ")
+    print(handle(json.dumps({ "stats": True })))
+
     print("End of unit tests.")
     sys.exit(0)
 
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# Geohash-prefix spatial index for coordinate-converter.  A set of points is kept in one
+# NumPy record array, sorted by the integer form of each point's geohash (the longitude and
+# latitude bits interleaved, longitude first, exactly like geohash2 does it).  Every
+# geohash cell is then one contiguous run of that array, so bounding box, radius, and
+# nearest point queries only have to binary search a handful of cells and look at the
+# points in them, instead of looking at every point.
+#
+# Indexes can be written to disk with numpy.save() and read back with numpy.load() as
+# memory-mapped files, so a big index doesn't have to be read in (or even fit in memory)
+# before it can be queried.
+
+# v1.0 - Initial release.
+
+import math
+import numpy
+import os
+
+try:
+    from . import vectorized
+except ImportError:
+    import vectorized
+
+# Number of bits of longitude and latitude in each key.  26 bits apiece is about 60
+#   centimeters at the equator, and the first 50 bits of a key are a 10 character geohash.
+axis_bits = 26
+key_bits = axis_bits * 2
+
+# Most geohash cells a query is broken up into.  More cells fit the query more tightly, but
+#   each one is a binary search.
+max_cells = 32
+
+# Mean radius of the Earth, in meters.
+earth_radius = 6371008.8
+
+# Widens the boxes around radius queries a little, so that points which are right on the
+#   edge of the circle aren't lost to rounding.  In degrees.
+margin = 1e-7
+
+# Returns the record type of an index whose IDs are up to width characters long.
+def record_type(width):
+    return(numpy.dtype([ ("key", "<u8"), ("latitude", "<f8"), ("longitude", "<f8"),
+        ("id", "<U" + str(max(width, 1))) ]))
+
+# Returns an empty index.
+def empty():
+    return(numpy.zeros(0, dtype=record_type(1)))
+
+# Spread the bits of an array of integers out so that there's a zero between each of them.
+def spread(codes):
+    codes = numpy.asarray(codes, dtype=numpy.uint64)
+    for (shift, mask) in [ (16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+            (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333), (1, 0x5555555555555555) ]:
+        codes = (codes | (codes << numpy.uint64(shift))) & numpy.uint64(mask)
+    return(codes)
+
+# Interleave longitude and latitude bits (longitude first) into keys.  Returns an array of
+#   integers.
+def interleave(longitude_codes, latitude_codes):
+    return((spread(longitude_codes) << numpy.uint64(1)) | spread(latitude_codes))
+
+# Turn arrays of latitudes and longitudes into the bits of their geohashes.  Returns arrays
+#   of longitude and latitude bits.
+def codes(latitudes, longitudes):
+    longitude_codes = vectorized.bisect(numpy.asarray(longitudes, dtype=numpy.float64),
+        -180.0, 180.0, axis_bits)
+    latitude_codes = vectorized.bisect(numpy.asarray(latitudes, dtype=numpy.float64),
+        -90.0, 90.0, axis_bits)
+    return((longitude_codes, latitude_codes))
+
+# Turn arrays of latitudes and longitudes into keys.  Returns an array of integers.
+def keys(latitudes, longitudes):
+    return(interleave(*codes(latitudes, longitudes)))
+
+# Build the records for a set of points, sorted by key.  Returns a record array.
+def records(ids, latitudes, longitudes):
+    ids = [ str(i) for i in ids ]
+    points = numpy.zeros(len(ids), dtype=record_type(max([ len(i) for i in ids ] or [ 1 ])))
+    points["latitude"] = latitudes
+    points["longitude"] = longitudes
+    points["key"] = keys(points["latitude"], points["longitude"])
+    points["id"] = ids
+    return(points[numpy.argsort(points["key"], kind="stable")])
+
+# Take points out of an index by ID.  Returns a new index.
+def remove(points, ids):
+    if not len(points) or not len(ids):
+        return(points)
+    return(points[~numpy.isin(points["id"], [ str(i) for i in ids ])])
+
+# Add points to an index.  Points which have the same ID as one that's already in there
+#   replace it, and if the same ID shows up more than once the last one wins.  The new
+#   points are sorted and merged in where they belong rather than sorting the whole index
+#   over again.  Returns a new index.
+def insert(points, ids, latitudes, longitudes):
+    latest = {}
+    for (i, j) in enumerate(ids):
+        latest[str(j)] = i
+    order = sorted(latest.values())
+    ids = [ str(ids[i]) for i in order ]
+    new = records(ids, numpy.asarray(latitudes, dtype=numpy.float64)[order],
+        numpy.asarray(longitudes, dtype=numpy.float64)[order])
+
+    points = remove(points, ids)
+    width = max(points.dtype["id"].itemsize, new.dtype["id"].itemsize) // 4
+    points = numpy.asarray(points).astype(record_type(width))
+    new = new.astype(record_type(width))
+    positions = numpy.searchsorted(points["key"], new["key"], side="right")
+    return(numpy.insert(points, positions, new))
+
+# Write an index to a file.  The file is written next to where it's going and then moved
+#   into place, so that anything which has the old one mapped keeps working.
+def save(points, path):
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as output:
+        numpy.save(output, numpy.asarray(points), allow_pickle=False)
+    os.replace(temporary, path)
+
+# Read an index from a file, memory-mapped.  Returns a (read-only) record array.
+def load(path):
+    return(numpy.load(path, mmap_mode="r", allow_pickle=False))
+
+# Split a bounding box which crosses the antimeridian into two which don't.  Returns a list
+#   of (south, west, north, east) tuples.
+def boxes(south, west, north, east):
+    if east - west >= 360.0:
+        return([ (south, -180.0, north, 180.0) ])
+    if west < -180.0:
+        west = west + 360.0
+    if east > 180.0:
+        east = east - 360.0
+    if west > east:
+        return([ (south, west, north, 180.0), (south, -180.0, north, east) ])
+    return([ (south, west, north, east) ])
+
+# Find the geohash cells which cover a bounding box (which doesn't cross the antimeridian),
+#   as finely as possible without using more than max_cells of them.  Returns a list of
+#   (lowest key, one past the highest key) tuples.
+def cells(south, west, north, east):
+    (longitude_codes, latitude_codes) = codes([ south, north ], [ west, east ])
+    (west, east) = [ int(i) for i in longitude_codes ]
+    (south, north) = [ int(i) for i in latitude_codes ]
+
+    # Keep adding bits until there would be too many cells.
+    level = 0
+    for bits in range(1, key_bits + 1):
+        longitude_shift = axis_bits - (bits + 1) // 2
+        latitude_shift = axis_bits - bits // 2
+        count = (((east >> longitude_shift) - (west >> longitude_shift) + 1) *
+            ((north >> latitude_shift) - (south >> latitude_shift) + 1))
+        if count > max_cells:
+            break
+        level = bits
+
+    longitude_shift = axis_bits - (level + 1) // 2
+    latitude_shift = axis_bits - level // 2
+    longitude_cells = numpy.arange(west >> longitude_shift, (east >> longitude_shift) + 1,
+        dtype=numpy.uint64) << numpy.uint64(longitude_shift)
+    latitude_cells = numpy.arange(south >> latitude_shift, (north >> latitude_shift) + 1,
+        dtype=numpy.uint64) << numpy.uint64(latitude_shift)
+    (longitude_cells, latitude_cells) = numpy.meshgrid(longitude_cells, latitude_cells)
+    lows = numpy.sort(interleave(longitude_cells.ravel(), latitude_cells.ravel())).tolist()
+    size = 1 << (key_bits - level)
+    return([ (i, i + size) for i in lows ])
+
+# Merge key ranges which touch.  Returns a sorted list of (lowest key, one past the highest
+#   key) tuples.
+def merge(ranges):
+    merged = []
+    for (low, high) in sorted(ranges):
+        if merged and low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return(merged)
+
+# Find the points in a set of key ranges.  Returns an array of their indices in the index.
+def scan(points, ranges):
+    if not ranges:
+        return(numpy.zeros(0, dtype=numpy.intp))
+    lows = numpy.array([ i[0] for i in ranges ], dtype=numpy.uint64)
+    highs = numpy.array([ min(i[1], 1 << key_bits) for i in ranges ], dtype=numpy.uint64)
+    index_keys = points["key"]
+    starts = numpy.searchsorted(index_keys, lows, side="left")
+    ends = numpy.searchsorted(index_keys, highs, side="left")
+    return(numpy.concatenate([ numpy.arange(i, j) for (i, j) in zip(starts.tolist(),
+        ends.tolist()) ] + [ numpy.zeros(0, dtype=numpy.intp) ]))
+
+# Find the points which might be in a bounding box: everything in the geohash cells which
+#   cover it.  Returns an array of their indices in the index.
+def candidates(points, south, west, north, east):
+    south = max(south, -90.0)
+    north = min(north, 90.0)
+    if south > north:
+        return(numpy.zeros(0, dtype=numpy.intp))
+    ranges = []
+    for box in boxes(south, west, north, east):
+        ranges.extend(cells(*box))
+    return(scan(points, merge(ranges)))
+
+# Find the points in a bounding box.  If west is east of east, the box crosses the
+#   antimeridian.  Returns an array of their indices in the index (in key order) and how
+#   many points had to be looked at.
+def bbox_query(points, south, west, north, east):
+    indices = candidates(points, south, west, north, east)
+    latitudes = points["latitude"][indices]
+    longitudes = points["longitude"][indices]
+    inside = (latitudes >= south) & (latitudes <= north)
+    if west <= east:
+        inside = inside & (longitudes >= west) & (longitudes <= east)
+    else:
+        inside = inside & ((longitudes >= west) | (longitudes <= east))
+    return((indices[inside], len(indices)))
+
+# Find the points in a geohash cell.  Returns an array of their indices in the index (in
+#   key order) and how many points had to be looked at.  Raises ValueError if it isn't a
+#   geohash.
+def prefix_query(points, geohash):
+    geohash = geohash.lower()
+    if len(geohash) * 5 > key_bits:
+        raise ValueError("Geohashes can't be longer than " + str(key_bits // 5) +
+            " characters.")
+    code = 0
+    for character in geohash:
+        if character not in vectorized.geohash_alphabet:
+            raise ValueError(repr(character) + " isn't part of a geohash.")
+        code = (code << 5) | vectorized.geohash_alphabet.index(character)
+    shift = key_bits - len(geohash) * 5
+    indices = scan(points, [ (code << shift, (code + 1) << shift) ])
+    return((indices, len(indices)))
+
+# Great circle distances from one point to an array of points, in meters.
+def distances(latitude, longitude, latitudes, longitudes):
+    latitude = math.radians(latitude)
+    latitudes = numpy.radians(latitudes)
+    longitudes = numpy.radians(numpy.asarray(longitudes, dtype=numpy.float64) - longitude)
+    a = (numpy.sin((latitudes - latitude) / 2) ** 2 + math.cos(latitude) *
+        numpy.cos(latitudes) * numpy.sin(longitudes / 2) ** 2)
+    return(2 * earth_radius * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0))))
+
+# Find the points within a number of meters of a point.  Returns an array of their indices
+#   in the index and an array of their distances, nearest first, and how many points had to
+#   be looked at.
+def radius_query(points, latitude, longitude, radius):
+    angle = radius / earth_radius
+
+    # Work out the bounding box of the circle.
+    if angle >= math.pi:
+        indices = numpy.arange(len(points))
+    else:
+        south = latitude - math.degrees(angle) - margin
+        north = latitude + math.degrees(angle) + margin
+        if south <= -90.0 or north >= 90.0:
+            indices = candidates(points, south, -180.0, north, 180.0)
+        else:
+            width = math.degrees(math.asin(math.sin(angle) /
+                math.cos(math.radians(latitude)))) + margin
+            indices = candidates(points, south, longitude - width, north, longitude + width)
+
+    found = distances(latitude, longitude, points["latitude"][indices],
+        points["longitude"][indices])
+    inside = found <= radius
+    order = numpy.argsort(found[inside], kind="stable")
+    return((indices[inside][order], found[inside][order], len(indices)))
+
+# Find the k points nearest to a point, optionally no further away than a number of meters.
+#   Starts with a circle which would hold about k points if they were spread evenly over
+#   the Earth and doubles it until there are enough points in it.  Returns the same thing
+#   as radius_query().
+def nearest(points, latitude, longitude, k, radius=None):
+    limit = math.pi * earth_radius
+    if radius is not None:
+        limit = min(radius, limit)
+    k = min(k, len(points))
+    if k <= 0:
+        return((numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0), 0))
+
+    scanned = 0
+    search = min(2 * earth_radius * math.sqrt(k / len(points)), limit)
+    while True:
+        (indices, found, looked_at) = radius_query(points, latitude, longitude, search)
+        scanned = scanned + looked_at
+        if len(indices) >= k or search >= limit:
+            return((indices[:k], found[:k], scanned))
+        search = min(search * 2, limit)
+
+# Pull the latitudes and longitudes of some of the points in an index out, for encoding.
+#   Returns arrays of latitudes, longitudes, and whether or not each one is valid (which
+#   they all are).
+def columns(points, indices):
+    return((points["latitude"][indices], points["longitude"][indices],
+        numpy.ones(len(indices), dtype=bool)))
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# Streaming conversions for coordinate-converter.  Takes a CSV file or a GeoJSON
+# FeatureCollection, picks the coordinates out of every row or feature, converts them a
+# batch at a time, and hands the converted rows or features back as soon as they're done.
+# Everything in here is a generator, so no more than one chunk of the input and one batch
+# of rows or features is held in memory at a time, no matter how big the input is.
+
+# v1.0 - Initial release.
+
+import csv
+import io
+import json
+import re
+
+# Size of the chunks that the input is read in, in characters.
+chunk_size = 65536
+
+# Number of rows or features which are converted at the same time.
+batch_size = 1024
+
+# Used to pull JSON values out of the input one at a time.
+decoder = json.JSONDecoder()
+whitespace = re.compile("[ \t\n\r]*")
+
+# Break the input up into chunks.  The input can be a string or a file-like object.
+def read_chunks(source):
+    if isinstance(source, str):
+        for i in range(0, len(source), chunk_size):
+            yield(source[i:i + chunk_size])
+        return
+
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield(chunk)
+
+# Break a stream of chunks up into lines, keeping the line endings.
+def read_lines(chunks):
+    remainder = ""
+
+    for chunk in chunks:
+        lines = (remainder + chunk).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield(line + "\n")
+    if remainder:
+        yield(remainder)
+
+# Group a stream of things into lists of batch_size things.
+def read_batches(things):
+    batch = []
+
+    for thing in things:
+        batch.append(thing)
+        if len(batch) == batch_size:
+            yield(batch)
+            batch = []
+    if batch:
+        yield(batch)
+
+# Pull rows out of a CSV file.  Rows which the csv module can't make sense of don't stop
+#   the stream.  Yields tuples of (row, None), or (None, error message) for bad rows.
+#   Blank lines are skipped.
+def read_rows(lines):
+    rows = csv.reader(lines)
+
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield((None, "Malformed row: " + str(e)))
+            continue
+        if row:
+            yield((row, None))
+
+# Turn one row into a line of CSV.  Returns a string.
+def csv_line(row):
+    line = io.StringIO()
+    csv.writer(line, lineterminator="\n").writerow(row)
+    return(line.getvalue())
+
+# Pick the converted coordinates apart into one value per type.  Returns a list.
+def result_values(result, to_types):
+    if isinstance(result, dict):
+        return([ result.get(i) for i in to_types ])
+    return([ result ])
+
+# Convert the coordinates in a CSV file.  The first row has to be a header.  The
+#   coordinates are either in one column (columns has one name in it) or in a latitude
+#   and a longitude column (columns has two names in it).  convert() takes a list of
+#   requests and returns a list of results, like convert_batch() in handler.py.  Yields
+#   lines of CSV: every row of the input with a column added for each type converted to,
+#   and an "error" column which is empty unless something went wrong with that row.  Rows
+#   with fewer columns than the header are padded out to match it.
+def convert_csv(source, columns, from_type, to_type, to_types, convert):
+    rows = read_rows(read_lines(read_chunks(source)))
+
+    # Find the columns that the coordinates are in.
+    (header, error) = next(rows, ([], None))
+    if error or not header:
+        yield(csv_line([ "error" ]))
+        yield(csv_line([ error or "Missing header row." ]))
+        return
+    for column in columns:
+        if column not in header:
+            yield(csv_line([ "error" ]))
+            yield(csv_line([ "Column " + column + " isn't in the header row." ]))
+            return
+    indices = [ header.index(i) for i in columns ]
+    yield(csv_line(header + list(to_types) + [ "error" ]))
+
+    for batch in read_batches(rows):
+        items = []
+        for (i, (row, error)) in enumerate(batch):
+            if error:
+                continue
+
+            # Line the row up with the header, so that the new columns line up, too.
+            if len(row) > len(header):
+                batch[i] = (row[:len(header)], "Row has more columns than the header row.")
+                continue
+            row = row + [ "" ] * (len(header) - len(row))
+            batch[i] = (row, None)
+
+            coordinates = " ".join([ row[j] for j in indices ])
+            if not coordinates.strip():
+                batch[i] = (row, "Row doesn't have any coordinates in it.")
+                continue
+            items.append({ "coordinates": coordinates, "from": from_type, "to": to_type })
+
+        results = iter(convert(items))
+        for (row, error) in batch:
+            if row is None:
+                row = [ "" ] * len(header)
+            if error:
+                yield(csv_line(row + [ "" ] * len(to_types) + [ error ]))
+                continue
+            result = next(results)
+            if "error" in result:
+                yield(csv_line(row + [ "" ] * len(to_types) + [ result["error"] ]))
+                continue
+            values = result_values(result["result"], to_types)
+            yield(csv_line(row + [ "" if i is None else i for i in values ] + [ "" ]))
+
+# Pull the features out of a GeoJSON FeatureCollection one at a time, without ever
+#   holding the whole document in memory.  Any other members of the FeatureCollection
+#   are skipped.  Yields features.  Raises ValueError if the document is malformed.
+def read_features(chunks):
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    finished = False
+
+    # Throw away what's been parsed and read the next chunk.  Returns False at the end of
+    #   the input.
+    def fill():
+        nonlocal buffer, position, finished
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            return(False)
+        buffer = buffer[position:] + chunk
+        position = 0
+        return(True)
+
+    # Skip over whitespace.  Returns the next character, or "" at the end of the input.
+    def peek():
+        nonlocal position
+        while True:
+            position = whitespace.match(buffer, position).end()
+            if position < len(buffer):
+                return(buffer[position])
+            if not fill():
+                return("")
+
+    # Make sure that the next character is the one expected and step over it.
+    def expect(characters):
+        nonlocal position
+        character = peek()
+        if not character or character not in characters:
+            raise ValueError("Expected one of " + repr(characters) + " at " +
+                repr(buffer[position:position + 20]))
+        position = position + 1
+        return(character)
+
+    # Parse the next JSON value.  A value which runs right up to the end of the buffer
+    #   might have been cut off, so more of the input is read before it's believed.
+    def value():
+        nonlocal position
+        peek()
+        while True:
+            try:
+                (parsed, end) = decoder.raw_decode(buffer, position)
+                if end < len(buffer) or finished:
+                    position = end
+                    return(parsed)
+            except json.JSONDecodeError as e:
+                if finished:
+                    raise ValueError(str(e))
+            fill()
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = value()
+        expect(":")
+        if key != "features":
+            value()
+        else:
+            expect("[")
+            if peek() == "]":
+                expect("]")
+            else:
+                while True:
+                    yield(value())
+                    if expect(",]") == "]":
+                        break
+        if expect(",}") == "}":
+            return
+
+# Work out which coordinates a GeoJSON feature is at, either from one of its properties
+#   or from its geometry (which has to be a Point).  Returns a string, or None if the
+#   feature doesn't have any coordinates.
+def feature_coordinates(feature, coordinate_property):
+    try:
+        if coordinate_property:
+            return(str(feature["properties"][coordinate_property]))
+        if feature["geometry"]["type"] != "Point":
+            return(None)
+        (longitude, latitude) = feature["geometry"]["coordinates"][:2]
+        return(str(float(latitude)) + " " + str(float(longitude)))
+    except:
+        return(None)
+
+# Convert the coordinates of every feature in a GeoJSON FeatureCollection.  The coordinates
+#   come from coordinate_property if it's set, otherwise from each feature's geometry (in
+#   which case they're decimal degrees).  convert() takes a list of requests and returns a
+#   list of results, like convert_batch() in handler.py.  Yields pieces of a
+#   FeatureCollection in which every feature has a property added for each type converted
+#   to, or an "error" property if something went wrong with that feature.  If the input is
+#   so badly broken that it can't be read any further, the FeatureCollection ends early
+#   with an "error" member.
+def convert_geojson(source, coordinate_property, from_type, to_type, to_types, convert):
+    features = read_features(read_chunks(source))
+    separator = ""
+    error = None
+
+    yield('{"type": "FeatureCollection", "features": [')
+    while True:
+        batch = []
+        try:
+            for feature in features:
+                batch.append(feature)
+                if len(batch) == batch_size:
+                    break
+        except ValueError as e:
+            error = "Malformed GeoJSON: " + str(e)
+        if not batch:
+            break
+
+        items = []
+        coordinates = []
+        for feature in batch:
+            if isinstance(feature, dict):
+                coordinates.append(feature_coordinates(feature, coordinate_property))
+            else:
+                coordinates.append(None)
+            if coordinates[-1] is not None:
+                items.append({ "coordinates": coordinates[-1], "from": from_type,
+                    "to": to_type })
+
+        results = iter(convert(items))
+        for (feature, i) in zip(batch, coordinates):
+            if not isinstance(feature, dict):
+                feature = { "type": "Feature", "geometry": None, "properties": {} }
+                feature["properties"]["error"] = "Feature is not a JSON document."
+            else:
+                if not isinstance(feature.get("properties"), dict):
+                    feature["properties"] = {}
+
+                # Every feature with coordinates was sent to be converted, so every one of
+                # them takes the next result, and any "error" property it came with is
+                # replaced.
+                if i is None:
+                    feature["properties"]["error"] = "Feature doesn't have any coordinates."
+                else:
+                    feature["properties"].pop("error", None)
+                    result = next(results)
+                    if "error" in result:
+                        feature["properties"]["error"] = result["error"]
+                    else:
+                        values = result_values(result["result"], to_types)
+                        feature["properties"].update(zip(to_types, values))
+            yield(separator + "\n" + json.dumps(feature))
+            separator = ","
+        if error:
+            break
+
+    if error:
+        yield('\n], "error": ' + json.dumps(error) + '}\n')
+    else:
+        yield("\n]}\n")
@@ -0,0 +1,719 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# Vectorized conversion engine for coordinate-converter.  Everything in here works on
+# whole arrays of coordinates at once with NumPy instead of one point per Python-level
+# call, which is what makes big batches cheap.  The arithmetic is done in the same order
+# as the scalar functions in handler.py (and the geohash2 and mgrs modules) so that the results
+# are identical to the last bit.
+
+# v1.1 - Added UTM and MGRS.
+# v1.0 - Initial release.
+
+import itertools
+import math
+import numpy
+import re
+
+# Geohash alphabet.  Note that this isn't the RFC 4648 base32 alphabet.
+geohash_alphabet = "0123456789bcdefghjkmnpqrstuvwxyz"
+geohash_characters = numpy.frombuffer(geohash_alphabet.encode("ascii"), dtype=numpy.uint8)
+
+# Lookup table which turns an ASCII character into its geohash value, or -1 if it isn't
+#   part of the alphabet.
+geohash_values = numpy.full(256, -1, dtype=numpy.int16)
+geohash_values[geohash_characters] = numpy.arange(len(geohash_alphabet))
+
+# Run a scalar decoder over a list of coordinates.  Used for coordinate types which don't
+#   have a vectorized decoder.  Returns arrays of latitudes, longitudes, and whether or
+#   not each set of coordinates could be decoded.
+def decode_with(decoder, coordinates):
+    latitudes = numpy.zeros(len(coordinates))
+    longitudes = numpy.zeros(len(coordinates))
+    valid = numpy.ones(len(coordinates), dtype=bool)
+
+    for i in range(len(coordinates)):
+        try:
+            (latitudes[i], longitudes[i]) = decoder(coordinates[i])
+        except:
+            valid[i] = False
+
+    return((latitudes, longitudes, valid))
+
+# Run a scalar encoder over arrays of latitudes and longitudes.  Used for coordinate
+#   types which don't have a vectorized encoder.  Returns a list of strings, with None
+#   wherever the coordinates weren't valid or couldn't be encoded.
+def encode_with(encoder, latitudes, longitudes, valid):
+    encoded = []
+
+    for (latitude, longitude, ok) in zip(latitudes.tolist(), longitudes.tolist(),
+            valid.tolist()):
+        if not ok:
+            encoded.append(None)
+            continue
+        try:
+            encoded.append(encoder(latitude, longitude))
+        except:
+            encoded.append(None)
+
+    return(encoded)
+
+# Decodes a list of coordinates in degrees/minutes/seconds.  Each set of coordinates is
+#   picked apart into the sign, degrees, minutes, and seconds of its latitude and its
+#   longitude by the fields() function passed in, and then the arithmetic is done on all of
+#   them at once.  Returns arrays of latitudes, longitudes, and whether or not each set of
+#   coordinates could be decoded.
+def decode_dms(coordinates, fields):
+    parsed = numpy.zeros((len(coordinates) * 2, 4))
+    valid = numpy.ones(len(coordinates), dtype=bool)
+
+    for i in range(len(coordinates)):
+        try:
+            (parsed[i * 2], parsed[(i * 2) + 1]) = fields(coordinates[i])
+        except:
+            valid[i] = False
+
+    decoded = dms_to_dd(parsed[:, 0], parsed[:, 1], parsed[:, 2], parsed[:, 3])
+    return((decoded[0::2], decoded[1::2], valid))
+
+# Converts arrays of degrees/minutes/seconds into decimal degrees.  Takes four arrays of
+#   the same length: the sign of each coordinate (1.0 or -1.0), degrees, minutes, and
+#   seconds (including fractions of a second).  Returns an array of floats.
+def dms_to_dd(signs, degrees, minutes, seconds):
+    signs = numpy.asarray(signs, dtype=numpy.float64)
+    degrees = numpy.asarray(degrees, dtype=numpy.float64)
+    minutes = numpy.asarray(minutes, dtype=numpy.float64)
+    seconds = numpy.asarray(seconds, dtype=numpy.float64)
+
+    return(signs * (degrees + (minutes / 60) + (seconds / 3600)))
+
+# Converts an array of decimal degrees into arrays of degrees, minutes, and seconds, and
+#   which of them are negative, the same way dd_to_dms() in handler.py does.  NaNs and
+#   infinities come out as NaNs, like they do there, without NumPy warning about them on
+#   stderr (which the classic watchdog would put into the response).  Returns a tuple of
+#   four arrays.
+def dd_to_dms(coordinates):
+    coordinates = numpy.asarray(coordinates, dtype=numpy.float64)
+
+    with numpy.errstate(invalid="ignore"):
+        (minutes, seconds) = numpy.divmod(numpy.abs(coordinates) * 3600, 60)
+        (degrees, minutes) = numpy.divmod(minutes, 60)
+
+    return((degrees, minutes, seconds, coordinates < 0.0))
+
+# Assemble one coordinate in degrees/minutes/seconds as a string, with the right
+#   hemisphere.  Matches dd_pair_to_dms() in handler.py.
+def format_dms(degrees, minutes, seconds, negative, positive_hemisphere,
+        negative_hemisphere):
+    hemisphere = negative_hemisphere if negative else positive_hemisphere
+    seconds = str(seconds)
+    if "e" in seconds:
+        seconds = ("%.20f" % float(seconds)).rstrip("0")
+        if seconds.endswith("."):
+            seconds = seconds + "0"
+    return(str(degrees) + "° " + str(minutes) + "' " + seconds + "\" " + hemisphere)
+
+# Converts arrays of latitudes and longitudes into degrees/minutes/seconds with the
+#   hemispheres filled in.  Returns a list of strings.
+def dd_pair_to_dms(latitudes, longitudes):
+    encoded = []
+
+    latitudes = dd_to_dms(latitudes)
+    longitudes = dd_to_dms(longitudes)
+
+    # The arithmetic is done, now it's just string assembly.
+    latitudes = zip(*[ i.tolist() for i in latitudes ])
+    longitudes = zip(*[ i.tolist() for i in longitudes ])
+    for (latitude, longitude) in zip(latitudes, longitudes):
+        encoded.append(format_dms(*latitude, "N", "S") + " " +
+            format_dms(*longitude, "E", "W"))
+
+    return(encoded)
+
+# Binary search each value in an array down to the given number of bits, halving the
+#   interval each time exactly like geohash2 does.  Returns an array of integers holding
+#   the bits, most significant bit first.
+def bisect(values, low, high, bits):
+    code = numpy.zeros(len(values), dtype=numpy.uint64)
+    low = numpy.full(len(values), low, dtype=numpy.float64)
+    high = numpy.full(len(values), high, dtype=numpy.float64)
+
+    for i in range(bits):
+        middle = (low + high) / 2
+        bit = values > middle
+        code = (code << numpy.uint64(1)) | bit.astype(numpy.uint64)
+        low = numpy.where(bit, middle, low)
+        high = numpy.where(bit, high, middle)
+
+    return(code)
+
+# Encodes arrays of latitudes and longitudes into geohashes.  The longitude and latitude
+#   bits are interleaved (longitude first) and then packed five bits per character.
+#   Returns a list of strings.
+def geohash_encode(latitudes, longitudes, precision=12):
+    latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+    longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+
+    # Everything has to fit into a 64 bit integer.
+    if precision > 25:
+        raise ValueError("Geohash precision must be 25 characters or less.")
+
+    total_bits = precision * 5
+    longitude_bits = (total_bits + 1) // 2
+    latitude_bits = total_bits // 2
+    longitude_code = bisect(longitudes, -180.0, 180.0, longitude_bits)
+    latitude_code = bisect(latitudes, -90.0, 90.0, latitude_bits)
+
+    # Interleave the bits into characters.
+    characters = numpy.zeros((len(latitudes), precision), dtype=numpy.uint8)
+    for i in range(total_bits):
+        if i % 2 == 0:
+            shift = numpy.uint64(longitude_bits - 1 - (i // 2))
+            bit = (longitude_code >> shift) & numpy.uint64(1)
+        else:
+            shift = numpy.uint64(latitude_bits - 1 - (i // 2))
+            bit = (latitude_code >> shift) & numpy.uint64(1)
+        characters[:, i // 5] |= (bit << numpy.uint64(4 - (i % 5))).astype(numpy.uint8)
+
+    # Turn the character values into text in one go.
+    characters = geohash_characters[characters]
+    characters = characters.view("S" + str(precision)).ravel()
+    return([ i.decode("ascii") for i in characters.tolist() ])
+
+# Trim a decoded coordinate to the number of decimal places that a geohash actually
+#   carries, the same way geohash2.decode() does.
+def trim(coordinates, error):
+    places = max(1, int(round(-math.log10(error)))) - 1
+    return(numpy.array([ float("%.*f" % (places, i)) for i in coordinates.tolist() ]))
+
+# Decodes a list of geohashes into decimal degrees.  Geohashes of the same length are
+#   decoded together.  Returns arrays of latitudes, longitudes, and whether or not each
+#   geohash could be decoded.
+def geohash_decode(geohashes):
+    latitudes = numpy.zeros(len(geohashes))
+    longitudes = numpy.zeros(len(geohashes))
+    valid = numpy.zeros(len(geohashes), dtype=bool)
+    lengths = {}
+
+    # Sort the geohashes by length.
+    for i in range(len(geohashes)):
+        if not geohashes[i].isascii():
+            continue
+        lengths.setdefault(len(geohashes[i]), []).append(i)
+
+    for (length, indices) in lengths.items():
+        # An empty geohash is the middle of the map.
+        if not length:
+            valid[indices] = True
+            continue
+
+        text = "".join([ geohashes[i] for i in indices ]).encode("ascii")
+        values = geohash_values[numpy.frombuffer(text, dtype=numpy.uint8)]
+        values = values.reshape(len(indices), length)
+        ok = (values >= 0).all(axis=1)
+
+        latitude_low = numpy.full(len(indices), -90.0)
+        latitude_high = numpy.full(len(indices), 90.0)
+        longitude_low = numpy.full(len(indices), -180.0)
+        longitude_high = numpy.full(len(indices), 180.0)
+        latitude_error = 90.0
+        longitude_error = 180.0
+        is_even = True
+
+        for column in range(length):
+            for mask in [ 16, 8, 4, 2, 1 ]:
+                bit = (values[:, column] & mask) != 0
+                if is_even:
+                    longitude_error = longitude_error / 2
+                    middle = (longitude_low + longitude_high) / 2
+                    longitude_low = numpy.where(bit, middle, longitude_low)
+                    longitude_high = numpy.where(bit, longitude_high, middle)
+                else:
+                    latitude_error = latitude_error / 2
+                    middle = (latitude_low + latitude_high) / 2
+                    latitude_low = numpy.where(bit, middle, latitude_low)
+                    latitude_high = numpy.where(bit, latitude_high, middle)
+                is_even = not is_even
+
+        indices = numpy.array(indices)
+        latitudes[indices] = trim((latitude_low + latitude_high) / 2, latitude_error)
+        longitudes[indices] = trim((longitude_low + longitude_high) / 2, longitude_error)
+        valid[indices] = ok
+
+    return((latitudes, longitudes, valid))
+
+# Transverse Mercator, UTM, and MGRS.  This is a port of the GEOTRANS code that the mgrs
+#   module wraps (tranmerc.c, utm.c, and mgrs.c), rewritten to project whole arrays at
+#   once.  It only covers the UTM part of the world (80 degrees south to 84 degrees
+#   north); anything it can't handle (the poles, which use UPS, and a few edge cases) is
+#   handed to a scalar fallback function, which is the C library.
+
+# WGS 84 ellipsoid, and the constants GEOTRANS derives from it.
+pi = 3.14159265358979323
+degrees_to_radians = 0.017453292519943295
+radians_to_degrees = 57.29577951308232087
+semi_major_axis = 6378137.0
+flattening = 1 / 298.257223563
+eccentricity_squared = 2 * flattening - flattening * flattening
+second_eccentricity_squared = (1 / (1 - eccentricity_squared)) - 1
+semi_minor_axis = semi_major_axis * (1 - flattening)
+tn = (semi_major_axis - semi_minor_axis) / (semi_major_axis + semi_minor_axis)
+tn2 = tn * tn
+tn3 = tn2 * tn
+tn4 = tn3 * tn
+tn5 = tn4 * tn
+meridian_ap = semi_major_axis * (1.0 - tn + 5.0 * (tn2 - tn3) / 4.0
+    + 81.0 * (tn4 - tn5) / 64.0)
+meridian_bp = 3.0 * semi_major_axis * (tn - tn2 + 7.0 * (tn3 - tn4)
+    / 8.0 + 55.0 * tn5 / 64.0) / 2.0
+meridian_cp = 15.0 * semi_major_axis * (tn2 - tn3 + 3.0 * (tn4 - tn5) / 4.0) / 16.0
+meridian_dp = 35.0 * semi_major_axis * (tn3 - tn4 + 11.0 * tn5 / 16.0) / 48.0
+meridian_ep = 315.0 * semi_major_axis * (tn4 - tn5) / 512.0
+
+# UTM projection parameters.
+scale_factor = 0.9996
+false_easting = 500000.0
+minimum_utm_latitude = (-80 * pi) / 180.0
+maximum_utm_latitude = (84 * pi) / 180.0
+maximum_delta_longitude = (pi * 90) / 180.0
+
+# MGRS latitude bands: letter, minimum northing, and northing offset.  Indexed by band
+#   number, starting at 80 degrees south.
+latitude_band_letters = numpy.array([ 2, 3, 4, 5, 6, 7, 9, 10, 11, 12, 13, 15, 16, 17, 18,
+    19, 20, 21, 22, 23 ])
+latitude_band_minimum_northings = numpy.array([ 1100000.0, 2000000.0, 2800000.0,
+    3700000.0, 4600000.0, 5500000.0, 6400000.0, 7300000.0, 8200000.0, 9100000.0, 0.0,
+    800000.0, 1700000.0, 2600000.0, 3500000.0, 4400000.0, 5300000.0, 6200000.0, 7000000.0,
+    7900000.0 ])
+latitude_band_northing_offsets = numpy.array([ 0.0, 2000000.0, 2000000.0, 2000000.0,
+    4000000.0, 4000000.0, 6000000.0, 6000000.0, 8000000.0, 8000000.0, 0.0, 0.0, 0.0,
+    2000000.0, 2000000.0, 4000000.0, 4000000.0, 6000000.0, 6000000.0, 6000000.0 ])
+
+# Lookup table which turns a letter (A = 0) into its latitude band number, or -1 if it
+#   isn't a latitude band.
+latitude_bands = numpy.full(26, -1)
+latitude_bands[latitude_band_letters] = numpy.arange(len(latitude_band_letters))
+
+# Picks an MGRS grid reference apart the way GEOTRANS does: leading blanks, zone,
+#   letters, and digits.  Anything after the digits is ignored.
+mgrs_pattern = re.compile("^ *([0-9]*)([A-Za-z]*)([0-9]*)")
+
+letter_i = 8
+letter_j = 9
+letter_n = 13
+letter_o = 14
+letter_v = 21
+letter_x = 23
+
+# GEOTRANS raises things to powers with the C library's pow(), which neither NumPy's
+#   power() nor a plain multiplication always agree with in the last bit, so this goes
+#   through math.pow() (which is the same pow()).
+def power(values, exponent):
+    if numpy.ndim(values) == 0:
+        return(math.pow(values, exponent))
+    values = numpy.asarray(values, dtype=numpy.float64)
+    return(numpy.fromiter(map(math.pow, values.ravel().tolist(), itertools.repeat(exponent)),
+        dtype=numpy.float64, count=values.size).reshape(values.shape))
+
+# True meridional distance, radius of curvature in the prime vertical, and radius of
+#   curvature in the meridian, at the given latitudes.
+def meridional_distance(latitudes):
+    return(meridian_ap * latitudes - meridian_bp * numpy.sin(2.0 * latitudes)
+        + meridian_cp * numpy.sin(4.0 * latitudes) - meridian_dp * numpy.sin(6.0 * latitudes)
+        + meridian_ep * numpy.sin(8.0 * latitudes))
+
+def prime_vertical_radius(latitudes):
+    return(semi_major_axis / numpy.sqrt(1.0 - eccentricity_squared *
+        power(numpy.sin(latitudes), 2)))
+
+def meridian_radius(latitudes):
+    denominator = numpy.sqrt(1.0 - eccentricity_squared *
+        power(numpy.sin(latitudes), 2))
+    return(semi_major_axis * (1.0 - eccentricity_squared) / power(denominator, 3))
+
+# Projects arrays of latitudes and longitudes (in radians) onto transverse Mercator grids
+#   with the given central meridians and false northings.  Returns arrays of eastings,
+#   northings, and whether or not each point was within range of its central meridian.
+def transverse_mercator_forward(latitudes, longitudes, central_meridians, false_northings):
+    longitudes = numpy.where(longitudes > pi, longitudes - (2 * pi), longitudes)
+
+    # Points more than 90 degrees from the central meridian can't be projected.
+    ok = (latitudes >= -((pi * 89.99) / 180.0)) & (latitudes <= ((pi * 89.99) / 180.0))
+    outside = (longitudes < (central_meridians - maximum_delta_longitude)) | \
+        (longitudes > (central_meridians + maximum_delta_longitude))
+    wrapped_longitudes = numpy.where(longitudes < 0, longitudes + 2 * pi, longitudes)
+    wrapped_meridians = numpy.where(central_meridians < 0, central_meridians + 2 * pi,
+        central_meridians)
+    ok = ok & ~(outside & ((wrapped_longitudes < (wrapped_meridians - maximum_delta_longitude))
+        | (wrapped_longitudes > (wrapped_meridians + maximum_delta_longitude))))
+
+    dlam = longitudes - central_meridians
+    dlam = numpy.where(dlam > pi, dlam - (2 * pi), dlam)
+    dlam = numpy.where(dlam < -pi, dlam + (2 * pi), dlam)
+    dlam = numpy.where(numpy.fabs(dlam) < 2.e-10, 0.0, dlam)
+
+    s = numpy.sin(latitudes)
+    c = numpy.cos(latitudes)
+    c2 = c * c
+    c3 = c2 * c
+    c5 = c3 * c2
+    c7 = c5 * c2
+    t = numpy.tan(latitudes)
+    tan2 = t * t
+    tan3 = tan2 * t
+    tan4 = tan3 * t
+    tan5 = tan4 * t
+    tan6 = tan5 * t
+    eta = second_eccentricity_squared * c2
+    eta2 = eta * eta
+    eta3 = eta2 * eta
+    eta4 = eta3 * eta
+    sn = prime_vertical_radius(latitudes)
+    tmd = meridional_distance(latitudes)
+    tmdo = meridional_distance(numpy.float64(0.0))
+    k = scale_factor
+
+    # Northing.
+    t1 = (tmd - tmdo) * k
+    t2 = sn * s * c * k / 2.0
+    t3 = sn * s * c3 * k * (5.0 - tan2 + 9.0 * eta + 4.0 * eta2) / 24.0
+    t4 = sn * s * c5 * k * (61.0 - 58.0 * tan2 + tan4 + 270.0 * eta - 330.0 * tan2 * eta
+        + 445.0 * eta2 + 324.0 * eta3 - 680.0 * tan2 * eta2 + 88.0 * eta4
+        - 600.0 * tan2 * eta3 - 192.0 * tan2 * eta4) / 720.0
+    t5 = sn * s * c7 * k * (1385.0 - 3111.0 * tan2 + 543.0 * tan4 - tan6) / 40320.0
+    northings = false_northings + t1 + power(dlam, 2.0) * t2 \
+        + power(dlam, 4.0) * t3 + power(dlam, 6.0) * t4 \
+        + power(dlam, 8.0) * t5
+
+    # Easting.
+    t6 = sn * c * k
+    t7 = sn * c3 * k * (1.0 - tan2 + eta) / 6.0
+    t8 = sn * c5 * k * (5.0 - 18.0 * tan2 + tan4 + 14.0 * eta - 58.0 * tan2 * eta
+        + 13.0 * eta2 + 4.0 * eta3 - 64.0 * tan2 * eta2 - 24.0 * tan2 * eta3) / 120.0
+    t9 = sn * c7 * k * (61.0 - 479.0 * tan2 + 179.0 * tan4 - tan6) / 5040.0
+    eastings = false_easting + dlam * t6 + power(dlam, 3.0) * t7 \
+        + power(dlam, 5.0) * t8 + power(dlam, 7.0) * t9
+
+    return((eastings, northings, ok))
+
+# Unprojects arrays of eastings and northings on transverse Mercator grids with the given
+#   central meridians and false northings.  Returns arrays of latitudes and longitudes
+#   (in radians), and whether or not each point unprojected to somewhere on Earth.
+def transverse_mercator_inverse(eastings, northings, central_meridians, false_northings):
+    k = scale_factor
+
+    tmdo = meridional_distance(numpy.float64(0.0))
+    tmd = tmdo + (northings - false_northings) / k
+
+    # Iterate to the footpoint latitude.
+    sr = meridian_radius(numpy.float64(0.0))
+    ftphi = tmd / sr
+    for i in range(5):
+        t10 = meridional_distance(ftphi)
+        sr = meridian_radius(ftphi)
+        ftphi = ftphi + (tmd - t10) / sr
+
+    sr = meridian_radius(ftphi)
+    sn = prime_vertical_radius(ftphi)
+    c = numpy.cos(ftphi)
+    t = numpy.tan(ftphi)
+    tan2 = t * t
+    tan4 = tan2 * tan2
+    eta = second_eccentricity_squared * power(c, 2)
+    eta2 = eta * eta
+    eta3 = eta2 * eta
+    eta4 = eta3 * eta
+    de = eastings - false_easting
+    de = numpy.where(numpy.fabs(de) < 0.0001, 0.0, de)
+
+    # Powers which are used more than once.
+    sn3 = power(sn, 3)
+    sn5 = power(sn, 5)
+    sn7 = power(sn, 7)
+    tan6 = power(t, 6)
+
+    # Latitude.
+    t10 = t / (2.0 * sr * sn * power(k, 2))
+    t11 = t * (5.0 + 3.0 * tan2 + eta - 4.0 * power(eta, 2)
+        - 9.0 * tan2 * eta) / (24.0 * sr * sn3 * power(k, 4))
+    t12 = t * (61.0 + 90.0 * tan2 + 46.0 * eta + 45.0 * tan4 - 252.0 * tan2 * eta
+        - 3.0 * eta2 + 100.0 * eta3 - 66.0 * tan2 * eta2 - 90.0 * tan4 * eta
+        + 88.0 * eta4 + 225.0 * tan4 * eta2 + 84.0 * tan2 * eta3 - 192.0 * tan2 * eta4) \
+        / (720.0 * sr * sn5 * power(k, 6))
+    t13 = t * (1385.0 + 3633.0 * tan2 + 4095.0 * tan4 + 1575.0 * tan6) \
+        / (40320.0 * sr * sn7 * power(k, 8))
+    latitudes = ftphi - power(de, 2) * t10 + power(de, 4) * t11 \
+        - power(de, 6) * t12 + power(de, 8) * t13
+
+    # Longitude.
+    t14 = 1.0 / (sn * c * k)
+    t15 = (1.0 + 2.0 * tan2 + eta) / (6.0 * sn3 * c * power(k, 3))
+    t16 = (5.0 + 6.0 * eta + 28.0 * tan2 - 3.0 * eta2 + 8.0 * tan2 * eta + 24.0 * tan4
+        - 4.0 * eta3 + 4.0 * tan2 * eta2 + 24.0 * tan2 * eta3) \
+        / (120.0 * sn5 * c * power(k, 5))
+    t17 = (61.0 + 662.0 * tan2 + 1320.0 * tan4 + 720.0 * tan6) \
+        / (5040.0 * sn7 * c * power(k, 7))
+    dlam = de * t14 - power(de, 3) * t15 + power(de, 5) * t16 \
+        - power(de, 7) * t17
+    longitudes = central_meridians + dlam
+
+    ok = numpy.fabs(latitudes) <= (90.0 * pi / 180.0)
+    longitudes = numpy.where(longitudes > pi, longitudes - (2 * pi), longitudes)
+    longitudes = numpy.where(longitudes < -pi, longitudes + (2 * pi), longitudes)
+    ok = ok & (numpy.fabs(longitudes) <= pi)
+
+    return((latitudes, longitudes, ok))
+
+# Works out the UTM zone of each point, including the special cases for Norway and
+#   Svalbard.  Takes latitudes and longitudes in radians.  Returns an array of zones.
+def utm_zones(latitudes, longitudes):
+    longitudes = numpy.where(longitudes < 0, longitudes + ((2 * pi) + 1.0e-10), longitudes)
+    latitude_degrees = numpy.trunc(latitudes * 180.0 / pi)
+    longitude_degrees = numpy.trunc(longitudes * 180.0 / pi)
+
+    zones = numpy.where(longitudes < pi, numpy.trunc(31 + ((longitudes * 180.0 / pi) / 6.0)),
+        numpy.trunc(((longitudes * 180.0 / pi) / 6.0) - 29)).astype(numpy.int64)
+    zones = numpy.where(zones > 60, 1, zones)
+
+    norway = (latitude_degrees > 55) & (latitude_degrees < 64)
+    zones = numpy.where(norway & (longitude_degrees > -1) & (longitude_degrees < 3), 31, zones)
+    zones = numpy.where(norway & (longitude_degrees > 2) & (longitude_degrees < 12), 32, zones)
+    svalbard = latitude_degrees > 71
+    zones = numpy.where(svalbard & (longitude_degrees > -1) & (longitude_degrees < 9), 31,
+        zones)
+    zones = numpy.where(svalbard & (longitude_degrees > 8) & (longitude_degrees < 21), 33,
+        zones)
+    zones = numpy.where(svalbard & (longitude_degrees > 20) & (longitude_degrees < 33), 35,
+        zones)
+    zones = numpy.where(svalbard & (longitude_degrees > 32) & (longitude_degrees < 42), 37,
+        zones)
+
+    return(zones)
+
+# Central meridian of each UTM zone, in radians.  Zones west of Greenwich come out past
+#   180 degrees and get wrapped around.
+def central_meridians(zones):
+    meridians = numpy.where(zones >= 31, (6 * zones - 183) * pi / 180.0,
+        (6 * zones + 177) * pi / 180.0)
+    return(numpy.where(meridians > pi, meridians - (2 * pi), meridians))
+
+# First letter of the second letter's range, and the false northing of the letter A, for
+#   each UTM zone.
+def grid_values(zones):
+    set_numbers = zones % 6
+    set_numbers = numpy.where(set_numbers == 0, 6, set_numbers)
+    low_letters = numpy.choose(set_numbers % 3, [ 18, 0, 9 ])
+    pattern_offsets = numpy.where(set_numbers % 2 == 0, 500000.0, 0.0)
+    return((low_letters, pattern_offsets))
+
+# Projects arrays of latitudes and longitudes (in degrees) into MGRS grid references with
+#   one meter precision.  Points which the vectorized code can't handle are passed to
+#   fallback(latitude, longitude).  Returns a list of strings, with None wherever a point
+#   couldn't be converted.
+def mgrs_encode(latitudes, longitudes, fallback):
+    original_latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+    original_longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+    latitudes = original_latitudes * pi / 180.0
+    longitudes = original_longitudes * pi / 180.0
+
+    ok = numpy.isfinite(latitudes) & numpy.isfinite(longitudes)
+    ok = ok & (latitudes >= minimum_utm_latitude) & (latitudes <= maximum_utm_latitude)
+    ok = ok & (longitudes >= -pi) & (longitudes <= (2 * pi))
+    latitudes = numpy.where(ok, latitudes, 0.0)
+    longitudes = numpy.where(ok, longitudes, 0.0)
+
+    # Project into UTM.  Points just south of the equator are treated as being on it.
+    utm_latitudes = numpy.where((latitudes > -1.0e-9) & (latitudes < 0), 0.0, latitudes)
+    utm_longitudes = numpy.where(longitudes < 0, longitudes + ((2 * pi) + 1.0e-10),
+        longitudes)
+    zones = utm_zones(utm_latitudes, longitudes)
+    false_northings = numpy.where(utm_latitudes < 0, 10000000.0, 0.0)
+    (eastings, northings, projected) = transverse_mercator_forward(utm_latitudes,
+        utm_longitudes, central_meridians(zones), false_northings)
+    ok = ok & projected
+    ok = ok & (eastings >= 100000) & (eastings <= 900000)
+    ok = ok & (northings >= 0) & (northings <= 10000000)
+
+    # GEOTRANS reprojects points that round onto the eastern edge of zone 31V into zone
+    # 32.  Leave those to the fallback.
+    ok = ok & ~((zones == 31) & (latitudes >= 56.0 * degrees_to_radians) &
+        (latitudes < 64.0 * degrees_to_radians) &
+        ((longitudes >= 3.0 * degrees_to_radians) | (eastings >= 500000.0)))
+
+    equator = (latitudes <= 0.0) & (northings == 1.0e7)
+    latitudes = numpy.where(equator, 0.0, latitudes)
+    northings = numpy.where(equator, 0.0, northings)
+
+    # First letter: latitude band.
+    latitude_degrees = latitudes * radians_to_degrees
+    bands = numpy.trunc(((latitudes + (80.0 * degrees_to_radians)) /
+        (8.0 * degrees_to_radians)) + 1.0e-12)
+    bands = numpy.clip(bands, 0, len(latitude_band_letters) - 1).astype(numpy.int64)
+    first_letters = numpy.where((latitude_degrees >= 72) & (latitude_degrees < 84.5),
+        letter_x, latitude_band_letters[bands])
+
+    # Third letter: 100,000 meter row.
+    (low_letters, pattern_offsets) = grid_values(zones)
+    grid_northings = northings
+    for i in range(5):
+        grid_northings = numpy.where(grid_northings >= 2000000.0,
+            grid_northings - 2000000.0, grid_northings)
+    grid_northings = grid_northings + pattern_offsets
+    grid_northings = numpy.where(grid_northings >= 2000000.0, grid_northings - 2000000.0,
+        grid_northings)
+    third_letters = numpy.trunc(grid_northings / 100000.0).astype(numpy.int64)
+    third_letters = numpy.where(third_letters > 7, third_letters + 1, third_letters)
+    third_letters = numpy.where(third_letters > letter_n, third_letters + 1, third_letters)
+
+    # Second letter: 100,000 meter column.
+    grid_eastings = numpy.where((first_letters == letter_v) & (zones == 31) &
+        (eastings == 500000.0), eastings - 1.0, eastings)
+    second_letters = low_letters + (numpy.trunc(grid_eastings / 100000.0).astype(numpy.int64)
+        - 1)
+    second_letters = numpy.where((low_letters == letter_j) & (second_letters > letter_n),
+        second_letters + 1, second_letters)
+
+    # Easting and northing within the 100,000 meter square.
+    grid_eastings = numpy.fmod(grid_eastings, 100000.0)
+    grid_eastings = numpy.where(grid_eastings >= 99999.5, 99999.0, grid_eastings)
+    grid_northings = numpy.fmod(northings, 100000.0)
+    grid_northings = numpy.where(grid_northings >= 99999.5, 99999.0, grid_northings)
+    grid_eastings = numpy.trunc(grid_eastings).astype(numpy.int64)
+    grid_northings = numpy.trunc(grid_northings).astype(numpy.int64)
+
+    # Assemble the grid references as rows of ASCII characters.
+    characters = numpy.zeros((len(latitudes), 15), dtype=numpy.uint8)
+    characters[:, 0] = (zones // 10) % 10
+    characters[:, 1] = zones % 10
+    characters[:, 0:2] += ord("0")
+    characters[:, 2] = first_letters + ord("A")
+    characters[:, 3] = numpy.clip(second_letters, 0, 25) + ord("A")
+    characters[:, 4] = numpy.clip(third_letters, 0, 25) + ord("A")
+    for i in range(5):
+        divisor = 10 ** (4 - i)
+        characters[:, 5 + i] = ((grid_eastings // divisor) % 10) + ord("0")
+        characters[:, 10 + i] = ((grid_northings // divisor) % 10) + ord("0")
+    characters = characters.view("S15").ravel().tolist()
+
+    encoded = []
+    for (i, gridref) in enumerate(characters):
+        if ok[i]:
+            encoded.append(gridref.decode("ascii"))
+            continue
+        try:
+            encoded.append(fallback(float(original_latitudes[i]),
+                float(original_longitudes[i])))
+        except:
+            encoded.append(None)
+    return(encoded)
+
+# Picks apart a list of MGRS grid references.  Returns arrays of zones, letters (A = 0),
+#   eastings, and northings, and whether or not each one could be picked apart.  Grid
+#   references without a zone (the poles) are marked as not ok.
+def mgrs_fields(gridrefs):
+    zones = numpy.zeros(len(gridrefs), dtype=numpy.int64)
+    letters = numpy.zeros((len(gridrefs), 3), dtype=numpy.int64)
+    eastings = numpy.zeros(len(gridrefs))
+    northings = numpy.zeros(len(gridrefs))
+    ok = numpy.zeros(len(gridrefs), dtype=bool)
+
+    # Most grid references look like the ones mgrs_encode() makes: a two digit zone, three
+    #   letters, and ten digits.  Those are picked apart all at once.
+    lengths = numpy.fromiter(map(len, gridrefs), dtype=numpy.int64, count=len(gridrefs))
+    characters = numpy.array(gridrefs, dtype="U15").view(numpy.uint32)
+    characters = characters.reshape(len(gridrefs), 15).astype(numpy.int64)
+    digits = (characters >= ord("0")) & (characters <= ord("9"))
+    uppercase = characters & ~0x20
+    alphabetic = (uppercase >= ord("A")) & (uppercase <= ord("Z"))
+    fast = (lengths == 15) & digits[:, 0:2].all(axis=1) & alphabetic[:, 2:5].all(axis=1)
+    fast = fast & digits[:, 5:15].all(axis=1)
+    characters = characters - ord("0")
+    zones[fast] = characters[fast, 0] * 10 + characters[fast, 1]
+    letters[fast] = uppercase[fast, 2:5] - ord("A")
+    for i in range(5):
+        eastings[fast] = eastings[fast] * 10 + characters[fast, 5 + i]
+        northings[fast] = northings[fast] * 10 + characters[fast, 10 + i]
+    ok[fast] = True
+
+    # Everything else is picked apart one at a time.
+    for i in numpy.flatnonzero(~fast).tolist():
+        gridref = gridrefs[i]
+        fields = mgrs_pattern.match(gridref)
+        (zone, grid_letters, digits) = fields.groups()
+        if not zone or len(zone) > 2 or len(grid_letters) != 3:
+            continue
+        if len(digits) > 10 or len(digits) % 2:
+            continue
+        zones[i] = int(zone)
+        letters[i] = [ ord(j) - ord("A") for j in grid_letters.upper() ]
+        precision = len(digits) // 2
+        if precision:
+            multiplier = math.pow(10.0, 5 - precision)
+            eastings[i] = int(digits[:precision]) * multiplier
+            northings[i] = int(digits[precision:]) * multiplier
+        ok[i] = True
+
+    return((zones, letters, eastings, northings, ok))
+
+# Converts a list of MGRS grid references into decimal degrees.  Grid references which
+#   the vectorized code can't handle are passed to fallback(gridref).  Returns arrays of
+#   latitudes, longitudes, and whether or not each grid reference could be converted.
+def mgrs_decode(gridrefs, fallback):
+    (zones, letters, eastings, northings, ok) = mgrs_fields(gridrefs)
+
+    # Make sure the zone and letters make sense together.
+    ok = ok & (zones >= 1) & (zones <= 60)
+    ok = ok & ~((letters == letter_i) | (letters == letter_o)).any(axis=1)
+    ok = ok & ~((letters[:, 0] == letter_x) & ((zones == 32) | (zones == 34) | (zones == 36)))
+    bands = latitude_bands[numpy.clip(letters[:, 0], 0, 25)]
+    ok = ok & (bands >= 0)
+    (low_letters, pattern_offsets) = grid_values(numpy.where(ok, zones, 1))
+    ok = ok & (letters[:, 1] >= low_letters) & (letters[:, 1] <= low_letters + 7)
+    ok = ok & (letters[:, 2] <= letter_v)
+    bands = numpy.where(ok, bands, 0)
+    zones = numpy.where(ok, zones, 1)
+
+    # Work out where the 100,000 meter square is.
+    row_northings = letters[:, 2] * 100000.0
+    grid_eastings = (letters[:, 1] - low_letters + 1) * 100000.0
+    grid_eastings = numpy.where((low_letters == letter_j) & (letters[:, 1] > letter_o),
+        grid_eastings - 100000.0, grid_eastings)
+    row_northings = numpy.where(letters[:, 2] > letter_o, row_northings - 100000.0,
+        row_northings)
+    row_northings = numpy.where(letters[:, 2] > letter_i, row_northings - 100000.0,
+        row_northings)
+    row_northings = numpy.where(row_northings >= 2000000.0, row_northings - 2000000.0,
+        row_northings)
+    grid_northings = row_northings - pattern_offsets
+    grid_northings = numpy.where(grid_northings < 0, grid_northings + 2000000.0,
+        grid_northings)
+    grid_northings = grid_northings + latitude_band_northing_offsets[bands]
+    grid_northings = numpy.where(grid_northings < latitude_band_minimum_northings[bands],
+        grid_northings + 2000000.0, grid_northings)
+    eastings = grid_eastings + eastings
+    northings = grid_northings + northings
+
+    # Unproject from UTM.
+    ok = ok & (eastings >= 100000) & (eastings <= 900000)
+    ok = ok & (northings >= 0) & (northings <= 10000000)
+    false_northings = numpy.where(letters[:, 0] < letter_n, 10000000.0, 0.0)
+    (latitudes, longitudes, unprojected) = transverse_mercator_inverse(eastings, northings,
+        central_meridians(zones), false_northings)
+    ok = ok & unprojected
+    ok = ok & (latitudes >= (-80.5 * pi) / 180.0) & (latitudes <= (84.5 * pi) / 180.0)
+    latitudes = latitudes * 180.0 / pi
+    longitudes = longitudes * 180.0 / pi
+
+    # Everything else goes to the fallback.
+    valid = ok.copy()
+    for i in numpy.flatnonzero(~ok).tolist():
+        try:
+            (latitudes[i], longitudes[i]) = fallback(gridrefs[i])
+            valid[i] = True
+        except:
+            valid[i] = False
+
+    return((latitudes, longitudes, valid))
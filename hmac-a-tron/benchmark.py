@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# Benchmarks for hmac-a-tron.  Run it from this directory:
+#   python3 benchmark.py [--output <file>] [--baseline <file>] [--threshold <percent>]
+#       [--max-size <bytes>]
+#
+# First, every HMAC algorithm is checked against the test vectors in RFC 2202 and RFC
+# 4231, and every JWT that the function generates is checked against PyJWT.  If anything
+# doesn't match, nothing gets timed.  Then every algorithm is timed with payloads from 64
+# bytes to 64 MB, one at a time and in batches, and the results (MB/s and requests/s) are
+# written out as JSON so that they can be compared with another run (--baseline).
+
+# By: The Doctor <drwho at virtadpt dot net>
+# License: GPLv3
+
+# v1.1 - Added the conformance checks and the throughput matrix.
+# v1.0 - Initial release.  Thread pool scaling.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+
+import jwt
+
+import handler
+
+# How many times each benchmark is run.  The fastest run is the one reported.
+repeats = 5
+
+# Every case in the throughput matrix is run for at least this many seconds, and at least
+#   repeats times.  The fastest run is the one reported.
+min_time = 0.2
+
+# Payload sizes and batch sizes in the throughput matrix.  Batches which would add up to
+#   more than max_request_size bytes aren't run, and neither are JWTs with payloads over
+#   max_jwt_size bytes (nobody sends those).
+payload_sizes = [ 64, 1024, 16 * 1024, 256 * 1024, 4 * 1024 * 1024, 64 * 1024 * 1024 ]
+batch_sizes = [ 1, 16, 256 ]
+max_request_size = 64 * 1024 * 1024
+max_jwt_size = 1024 * 1024
+
+# Default percentage that a case has to slow down by to be flagged.
+threshold = 20.0
+
+# Test vectors from RFC 2202 (MD5 and SHA-1) and RFC 4231 (the SHA-2 family).  Each one is
+#   a key, some data, and what the HMAC should be for each hash.  Test case 5 of both RFCs
+#   is truncated; only the start of the HMAC is compared.
+rfc2202_vectors = [
+    ( { "md5": b"\x0b" * 16, "sha1": b"\x0b" * 20 }, b"Hi There",
+        { "md5": "9294727a3638bb1c13f48ef8158bfc9d",
+          "sha1": "b617318655057264e28bc0b6fb378c8ef146be00" } ),
+    ( b"Jefe", b"what do ya want for nothing?",
+        { "md5": "750c783e6ab0b503eaa86e310a5db738",
+          "sha1": "effcdf6ae5eb2fa2d27416d5f184df9c259a7c79" } ),
+    ( { "md5": b"\xaa" * 16, "sha1": b"\xaa" * 20 }, b"\xdd" * 50,
+        { "md5": "56be34521d144c88dbb8c733f0e8b3f6",
+          "sha1": "125d7342b9ac11cd91a39af48aa17b4f63f175d3" } ),
+    ( bytes(range(1, 26)), b"\xcd" * 50,
+        { "md5": "697eaf0aca3a3aea3a75164746ffaa79",
+          "sha1": "4c9007f4026250c6bc8414f9bf50c86c2d7235da" } ),
+    ( { "md5": b"\x0c" * 16, "sha1": b"\x0c" * 20 }, b"Test With Truncation",
+        { "md5": "56461ef2342edc00f9bab995",
+          "sha1": "4c1a03424b55e07fe7f27be1d58bb9324a9a5a04" } ),
+    ( b"\xaa" * 80, b"Test Using Larger Than Block-Size Key - Hash Key First",
+        { "md5": "6b1ab7fe4bd7bf8f0b62e6ce61b9d0cd",
+          "sha1": "aa4ae5e15272d00e95705637ce8a3b55ed402112" } ),
+    ( b"\xaa" * 80, b"Test Using Larger Than Block-Size Key and Larger Than One "
+        b"Block-Size Data",
+        { "md5": "6f630fad67cda0ee1fb1f562db3aa53e",
+          "sha1": "e8e99d0f45237d786d6bbaa7965c7808bbff1a91" } ),
+]
+rfc4231_vectors = [
+    ( b"\x0b" * 20, b"Hi There",
+        { "sha224": "896fb1128abbdf196832107cd49df33f47b4b1169912ba4f53684b22",
+          "sha256": "b0344c61d8db38535ca8afceaf0bf12b881dc200c9833da726e9376c2e32cff7",
+          "sha384": "afd03944d84895626b0825f4ab46907f15f9dadbe4101ec682aa034c7cebc59c"
+              "faea9ea9076ede7f4af152e8b2fa9cb6",
+          "sha512": "87aa7cdea5ef619d4ff0b4241a1d6cb02379f4e2ce4ec2787ad0b30545e17cde"
+              "daa833b7d6b8a702038b274eaea3f4e4be9d914eeb61f1702e696c203a126854" } ),
+    ( b"Jefe", b"what do ya want for nothing?",
+        { "sha224": "a30e01098bc6dbbf45690f3a7e9e6d0f8bbea2a39e6148008fd05e44",
+          "sha256": "5bdcc146bf60754e6a042426089575c75a003f089d2739839dec58b964ec3843",
+          "sha384": "af45d2e376484031617f78d2b58a6b1b9c7ef464f5a01b47e42ec3736322445e"
+              "8e2240ca5e69e2c78b3239ecfab21649",
+          "sha512": "164b7a7bfcf819e2e395fbe73b56e0a387bd64222e831fd610270cd7ea250554"
+              "9758bf75c05a994a6d034f65f8f0e6fdcaeab1a34d4a6b4b636e070a38bce737" } ),
+    ( b"\xaa" * 20, b"\xdd" * 50,
+        { "sha224": "7fb3cb3588c6c1f6ffa9694d7d6ad2649365b0c1f65d69d1ec8333ea",
+          "sha256": "773ea91e36800e46854db8ebd09181a72959098b3ef8c122d9635514ced565fe",
+          "sha384": "88062608d3e6ad8a0aa2ace014c8a86f0aa635d947ac9febe83ef4e55966144b"
+              "2a5ab39dc13814b94e3ab6e101a34f27",
+          "sha512": "fa73b0089d56a284efb0f0756c890be9b1b5dbdd8ee81a3655f83e33b2279d39"
+              "bf3e848279a722c806b485a47e67c807b946a337bee8942674278859e13292fb" } ),
+    ( bytes(range(1, 26)), b"\xcd" * 50,
+        { "sha224": "6c11506874013cac6a2abc1bb382627cec6a90d86efc012de7afec5a",
+          "sha256": "82558a389a443c0ea4cc819899f2083a85f0faa3e578f8077a2e3ff46729665b",
+          "sha384": "3e8a69b7783c25851933ab6290af6ca77a9981480850009cc5577c6e1f573b4e"
+              "6801dd23c4a7d679ccf8a386c674cffb",
+          "sha512": "b0ba465637458c6990e5a8c5f61d4af7e576d97ff94b872de76f8050361ee3db"
+              "a91ca5c11aa25eb4d679275cc5788063a5f19741120c4f2de2adebeb10a298dd" } ),
+    ( b"\x0c" * 20, b"Test With Truncation",
+        { "sha224": "0e2aea68a90c8d37c988bcdb9fca6fa8",
+          "sha256": "a3b6167473100ee06e0c796c2955552b",
+          "sha384": "3abf34c3503b2a23a46efc619baef897",
+          "sha512": "415fad6271580a531d4179bc891d87a6" } ),
+    ( b"\xaa" * 131, b"Test Using Larger Than Block-Size Key - Hash Key First",
+        { "sha224": "95e9a0db962095adaebe9b2d6f0dbce2d499f112f2d2b7273fa6870e",
+          "sha256": "60e431591ee0b67f0d8a26aacbf5b77f8e0bc6213728c5140546040f0ee37f54",
+          "sha384": "4ece084485813e9088d2c63a041bc5b44f9ef1012a2b588f3cd11f05033ac4c6"
+              "0c2ef6ab4030fe8296248df163f44952",
+          "sha512": "80b24263c7c1a3ebb71493c1dd7be8b49b46d1f41b4aeec1121b013783f8f352"
+              "6b56d037e05f2598bd0fd2215d6a1e5295e64f73f63f0aec8b915a985d786598" } ),
+    ( b"\xaa" * 131, b"This is a test using a larger than block-size key and a larger "
+        b"than block-size data. The key needs to be hashed before being used by the HMAC "
+        b"algorithm.",
+        { "sha224": "3a854166ac5d9f023f54d517d0b39dbd946770db9c2b95c9f6f565d1",
+          "sha256": "9b09ffa71b942fcb27635fbcd5b0e944bfdc63644f0713938a7f51535c3a35e2",
+          "sha384": "6617178e941f020d351e2f254e8fd32c602420feb0b8fb9adccebb82461e99c5"
+              "a678cc31e799176d3860e6110c46523e",
+          "sha512": "e37b6a775dc87dbaa4dfa9f96e5e3ffddebd71f8867289865df5a32d20cdc944"
+              "b6022cac3c4982b10d5eeb55c3e4de15134676fb6de0446065c97440fa8c6a58" } ),
+]
+
+# Headers and payloads that the JWTs are checked against PyJWT with.
+jwt_headers = [ { "typ": "JWT" }, {}, { "typ": "" }, { "typ": "JWT", "kid": "2" },
+    { "cty": "text/plain", "b64": True } ]
+jwt_payloads = [ { "foo": "bar", "baz": "quux" }, {}, { "iss": 42 },
+    { "iss": "exocortex", "aud": "relay", "exp": 4102444800 },
+    { "name": "Zoë", "nested": { "list": [ 1, 2.5, None, True ] } } ]
+
+# Time a function, a few times over.  Returns the fastest time, in seconds.
+def benchmark(function, *arguments):
+    fastest = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(*arguments)
+        elapsed = time.perf_counter() - start
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+    return(fastest)
+
+# Returns the CPUs that this process is allowed to run on.
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return(sorted(os.sched_getaffinity(0)))
+    return(list(range(os.cpu_count() or 1)))
+
+# HMAC a batch of big items with 1, 2, 4, ... threads.  Where the operating system
+#   allows it, the process is pinned to as many CPUs as there are threads (or as many as
+#   there are, if that's fewer), so each line is what that many cores would do.
+def benchmark_threads(hash="sha256", item_size=1024 * 1024, items=32):
+    cpus = available_cpus()
+    keyed = handler.keyed_hmac(b"secret", hash)
+    batch = [ chr(ord("a") + (i % 26)) * item_size for i in range(items) ]
+    megabytes = item_size * items / 1000000.0
+    workers = 1
+    baseline = None
+
+    print("HMAC-" + hash + " of " + str(items) + " items of " + str(item_size) +
+        " bytes on " + str(len(cpus)) + " CPUs:")
+    while workers <= max(len(cpus) * 2, 4):
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus[:min(workers, len(cpus))])
+        handler.stop_threads()
+        handler.thread_workers = workers
+        elapsed = benchmark(handler.sign_batch, keyed, batch)
+        if baseline is None:
+            baseline = elapsed
+        print("    %2d threads on %2d CPUs: %8.1f MB/s (%.2fx)" % (workers,
+            min(workers, len(cpus)), megabytes / elapsed, baseline / elapsed))
+        workers = workers * 2
+
+    handler.stop_threads()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+# HMAC a batch of small items inline and in the pool of threads, to show why small items
+#   aren't handed off.
+def benchmark_small_items(hash="sha256", item_size=256, items=10000):
+    keyed = handler.keyed_hmac(b"secret", hash)
+    batch = [ "x" * item_size ] * items
+    threshold = handler.thread_threshold
+
+    handler.thread_workers = max(len(available_cpus()), 2)
+    inline = benchmark(handler.sign_batch, keyed, batch)
+    handler.thread_threshold = 0
+    pooled = benchmark(handler.sign_batch, keyed, batch)
+    handler.thread_threshold = threshold
+    handler.stop_threads()
+
+    print(str(items) + " items of " + str(item_size) + " bytes: %.0f per second inline, "
+        "%.0f per second in the pool of threads." % (items / inline, items / pooled))
+
+# Flatten the RFC test vectors into a list of (hash, key, data, HMAC).
+def rfc_vectors():
+    vectors = []
+    for (key, data, hmacs) in rfc2202_vectors + rfc4231_vectors:
+        for (hash, expected) in hmacs.items():
+            if isinstance(key, dict):
+                vectors.append((hash, key[hash], data, expected))
+            else:
+                vectors.append((hash, key, data, expected))
+    return(vectors)
+
+# Returns a string if the bytes are UTF-8 which survives a trip through a JSON document,
+#   or None.
+def as_text(data):
+    try:
+        return(data.decode("utf-8"))
+    except UnicodeDecodeError:
+        return(None)
+
+# Send every RFC test vector through the function the way a client would.  Keys and data
+#   which are text go in a JSON document, one at a time and in a batch.  Binary keys are
+#   loaded from a secrets directory as named keys and binary data is sent in raw mode.
+#   Returns the number of HMACs which didn't come out right.
+def check_hmac_vectors():
+    vectors = rfc_vectors()
+    failures = 0
+    secrets_directory = handler.secrets_directory
+    handler.secrets_directory = tempfile.mkdtemp()
+
+    for (number, (hash, key, data, expected)) in enumerate(vectors):
+        results = []
+        if as_text(key) is not None and as_text(data) is not None:
+            arguments = { "hash": hash, "secret": as_text(key), "data": as_text(data) }
+            results.append(handler.handle(json.dumps(arguments)))
+            arguments["data"] = [ as_text(data) ] * 2
+            results.extend(json.loads(handler.handle(json.dumps(arguments))))
+
+        name = "vector" + str(number)
+        with open(os.path.join(handler.secrets_directory, name), "wb") as output:
+            output.write(key)
+        os.environ["Http_Query"] = "hash=" + hash + "&key=" + name
+        results.append(handler.handle(data))
+        del os.environ["Http_Query"]
+        os.remove(os.path.join(handler.secrets_directory, name))
+
+        for result in results:
+            if not isinstance(result, str) or not result.startswith(expected):
+                print("    HMAC-" + hash + " of " + repr(data[:32]) + " came out as " +
+                    repr(result) + ", not " + expected)
+                failures = failures + 1
+
+    os.rmdir(handler.secrets_directory)
+    handler.secrets_directory = secrets_directory
+    handler.load_keys()
+    print("Checking " + str(len(vectors)) + " HMAC test vectors from RFC 2202 and RFC "
+        "4231: " + str(failures) + " failures.")
+    return(failures)
+
+# Generate a JWT for every algorithm, header, and payload, and compare it with the one that
+#   PyJWT makes.  Every token is also verified by the function and by PyJWT.  Returns the
+#   number of tokens which didn't come out right.
+def check_jwts():
+    failures = 0
+    checked = 0
+    verified_cache_size = handler.verified_cache_size
+    handler.verified_cache_size = 0
+
+    with warnings.catch_warnings():
+        # PyJWT thinks "secret" is too short to be a key, and it's right.
+        warnings.simplefilter("ignore")
+        for algorithm in handler.supported_jwt_algorithms:
+            for headers in jwt_headers:
+                headers = dict(headers, alg=algorithm)
+                for payload in jwt_payloads:
+                    checked = checked + 1
+                    token = handler.handle(json.dumps({ "hash": "jwt", "headers": headers,
+                        "payload": payload, "secret": "secret" }))
+                    try:
+                        expected = jwt.encode(payload, "secret", algorithm, headers)
+                    except Exception as e:
+                        expected = "Couldn't generate a JWT: " + str(e)
+                    if token != expected:
+                        print("    " + json.dumps(headers) + " " + json.dumps(payload) +
+                            " came out as " + token + ", not " + expected)
+                        failures = failures + 1
+                        continue
+                    if expected.startswith("Couldn't") or headers.get("b64") is not None:
+                        # PyJWT won't decode tokens with the b64 header.
+                        continue
+
+                    request = { "hash": "jwt", "operation": "verify", "token": token,
+                        "secret": "secret" }
+                    if "aud" in payload:
+                        request["audience"] = payload["aud"]
+                    verified = json.loads(handler.handle(json.dumps(request)))
+                    decoded = jwt.decode(token, "secret", algorithms=[ algorithm ],
+                        audience=payload.get("aud"))
+                    if not verified["valid"] or verified["payload"] != decoded:
+                        print("    " + token + " didn't verify: " + json.dumps(verified))
+                        failures = failures + 1
+
+    handler.verified_cache_size = verified_cache_size
+    print("Checking " + str(checked) + " JWTs against PyJWT: " + str(failures) +
+        " failures.")
+    return(failures)
+
+# Human-readable size of a payload.
+def size_name(size):
+    for (unit, bytes) in [ ("MB", 1024 * 1024), ("KB", 1024) ]:
+        if size >= bytes:
+            return(str(size // bytes) + " " + unit)
+    return(str(size) + " B")
+
+# Run a function over and over until it has taken at least min_time seconds, and at
+#   least repeats times.  Returns the fastest run, in seconds.
+def time_case(function, *arguments):
+    fastest = None
+    runs = 0
+    started = time.perf_counter()
+    while runs < repeats or time.perf_counter() - started < min_time:
+        start = time.perf_counter()
+        function(*arguments)
+        elapsed = time.perf_counter() - start
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+        runs = runs + 1
+    return(fastest)
+
+# Time one request.  Returns a hash table of how it went.
+def case_result(function, request, payload_size, batch_size):
+    elapsed = time_case(function, request)
+    return({ "payload": payload_size, "batch": batch_size,
+        "mb_per_second": payload_size * batch_size / elapsed / 1000000.0,
+        "requests_per_second": 1.0 / elapsed,
+        "items_per_second": batch_size / elapsed })
+
+# Time raw mode, with the hash and secret in headers the way the watchdog passes them.
+def time_raw(hash, body, payload_size):
+    os.environ["Http_X_Hmac_Hash"] = hash
+    os.environ["Http_X_Hmac_Secret"] = "secret"
+    result = case_result(handler.handle, body, payload_size, 1)
+    del os.environ["Http_X_Hmac_Hash"]
+    del os.environ["Http_X_Hmac_Secret"]
+    return(result)
+
+# Time every algorithm at every payload size and batch size, through handler.handle().
+#   HMACs are sent as JSON documents (with "data" as a list for batches) and in raw mode;
+#   JWTs are signed and verified (with the cache of verified tokens turned off).  Returns a
+#   hash table of results, keyed by "<algorithm> <mode> <payload size> x <batch size>".
+def matrix_results(max_size):
+    results = {}
+    sizes = [ i for i in payload_sizes if i <= max_size ]
+    verified_cache_size = handler.verified_cache_size
+    handler.verified_cache_size = 0
+
+    for hash in handler.supported_hmac_hashes:
+        for size in sizes:
+            data = "x" * size
+            for batch_size in batch_sizes:
+                if size * batch_size > max_request_size:
+                    continue
+                request = json.dumps({ "hash": hash, "secret": "secret",
+                    "data": data if batch_size == 1 else [ data ] * batch_size })
+                name = hash + " json " + size_name(size) + " x " + str(batch_size)
+                results[name] = case_result(handler.handle, request, size, batch_size)
+                print("    " + name, file=sys.stderr)
+            name = hash + " raw " + size_name(size) + " x 1"
+            results[name] = time_raw(hash, data.encode("utf-8"), size)
+            print("    " + name, file=sys.stderr)
+
+    for algorithm in handler.supported_jwt_algorithms:
+        for size in sizes:
+            if size > max_jwt_size:
+                continue
+            request = { "hash": "jwt", "headers": { "alg": algorithm, "typ": "JWT" },
+                "payload": { "data": "x" * size }, "secret": "secret" }
+            token = handler.handle(json.dumps(request))
+            name = algorithm + " sign " + size_name(size) + " x 1"
+            results[name] = case_result(handler.handle, json.dumps(request), size, 1)
+            name = algorithm + " verify " + size_name(size) + " x 1"
+            results[name] = case_result(handler.handle, json.dumps({ "hash": "jwt",
+                "operation": "verify", "token": token, "secret": "secret" }), size, 1)
+            print("    " + algorithm + " " + size_name(size), file=sys.stderr)
+
+    handler.verified_cache_size = verified_cache_size
+    handler.stop_threads()
+    return(results)
+
+# Print the results, compared with the baseline if there is one.  Returns the number of
+#   results which are slower than the baseline by more than the threshold.
+def report_matrix(results, baseline, threshold):
+    regressions = 0
+    print("%-32s %12s %14s %9s" % ("Case", "MB/s", "requests/s", "change"))
+    for (name, result) in results.items():
+        line = "%-32s %12.1f %14.1f" % (name, result["mb_per_second"],
+            result["requests_per_second"])
+        if name in baseline:
+            change = (baseline[name]["requests_per_second"] /
+                result["requests_per_second"] - 1) * 100
+            line = line + " %+8.1f%%" % change
+            if change > threshold:
+                line = line + "  SLOWER"
+                regressions = regressions + 1
+        print(line)
+    return(regressions)
+
+def benchmark_matrix(output_path, baseline_path, threshold, max_size):
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as input:
+            baseline = json.load(input)["results"]
+        print("Comparing with " + baseline_path + ", flagging anything more than " +
+            str(threshold) + "% slower.")
+    results = matrix_results(max_size)
+    regressions = report_matrix(results, baseline, threshold)
+    if regressions:
+        print(str(regressions) + " cases are slower than the baseline.")
+
+    if output_path:
+        report = { "python": platform.python_version(), "machine": platform.machine(),
+            "cpus": len(available_cpus()), "results": results }
+        with open(output_path, "w") as output:
+            json.dump(report, output, indent=2)
+        print("Saved the results to " + output_path + ".")
+    return(regressions)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for hmac-a-tron.")
+    parser.add_argument("--output", help="save the results to this file, as JSON")
+    parser.add_argument("--baseline", help="results from another run to compare with")
+    parser.add_argument("--threshold", type=float, default=threshold,
+        help="flag cases which are this many percent slower than the baseline")
+    parser.add_argument("--max-size", type=int, default=max(payload_sizes),
+        help="largest payload to time, in bytes")
+    arguments = parser.parse_args()
+
+    failures = check_hmac_vectors() + check_jwts()
+    if failures:
+        # Fast and wrong isn't worth timing.
+        sys.exit(1)
+    regressions = benchmark_matrix(arguments.output, arguments.baseline,
+        arguments.threshold, arguments.max_size)
+    benchmark_threads()
+    benchmark_small_items()
+    sys.exit(1 if regressions else 0)
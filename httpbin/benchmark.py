@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# Benchmarks for httpbin.  Run it from this directory:
+#   python3 benchmark.py [--latency <milliseconds>]
+#
+# Starts a stand-in for httpbin on localhost which takes --latency milliseconds to answer
+# anything, and points the function at it.  Checks that the probes come back right, that
+# one probe failing or being slow doesn't spoil the others or keep the process from
+# exiting, and then times the probes sent the way v1.0 did (one new connection apiece, one
+# after another), one after another over the session, and all at once.  Exits with 1 if
+# any of the checks fail.
+
+# v1.0 - Initial release.
+
+import argparse
+import http.server
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+import handler
+
+# How many times each benchmark is run.  The fastest run is the one reported.
+repeats = 5
+
+# Paths on the stand-in which fail, and which take too long, and how long they take.
+failing = set()
+slow = set()
+slow_latency = 0
+
+# A stand-in for httpbin.  Answers the probes with something like what httpbin would.
+class Standin(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0
+
+    # Otherwise the headers and the body go out in separate packets, and a kept-alive
+    # connection waits on delayed acknowledgements between them.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        headers = dict(self.headers)
+        answers = {}
+        answers["/get"] = { "args": {}, "headers": headers, "origin": self.client_address[0],
+            "url": "http://" + self.headers["Host"] + self.path }
+        answers["/headers"] = { "headers": headers }
+        answers["/ip"] = { "origin": self.client_address[0] }
+        answers["/user-agent"] = { "user-agent": self.headers["User-Agent"] }
+        answers["/uuid"] = { "uuid": str(uuid.uuid4()) }
+
+        status = 200
+        if self.path in failing or self.path not in answers:
+            status = 500
+        body = json.dumps(answers.get(self.path, {})).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            if self.path in slow:
+                # Dribble it out a byte at a time, each soon enough after the last that no
+                #   one read times out, so that only a deadline for the whole probe stops it.
+                for i in range(len(body)):
+                    self.wfile.write(body[i:i + 1])
+                    self.wfile.flush()
+                    time.sleep(slow_latency / len(body))
+            else:
+                self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The function gave up on a slow probe.
+            pass
+
+    def log_message(self, format, *arguments):
+        pass
+
+# Start the stand-in on a free port.  Returns the server.
+def start_standin(latency):
+    Standin.latency = latency
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Standin)
+    server.daemon_threads = True
+    # Clients hanging up on kept-alive connections isn't worth a traceback.
+    server.handle_error = lambda request, address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return(server)
+
+# Make sure that the probes come back right, and that the ones which fail or are too slow
+#   don't spoil the others.  Returns the number of checks that failed.
+def check_probes():
+    global slow_latency
+    failures = 0
+
+    responses = handler.handle("")
+    expected = [ "args", "headers", "origin", "user-agent", "uuid" ]
+    for (path, response, key) in zip(handler.probes, responses, expected):
+        if key not in response:
+            print("    " + path + " came back as " + json.dumps(response) + ".")
+            failures = failures + 1
+
+    failing.add("/ip")
+    slow.add("/uuid")
+    # Long enough that a process which waits for it stands out from the time it takes to
+    #   start one.
+    slow_latency = handler.probe_timeout * 2 + 2
+    start = time.perf_counter()
+    responses = handler.handle("")
+    elapsed = time.perf_counter() - start
+
+    # The classic watchdog starts a new process for every request, so the process has
+    # to exit at the deadline, too, not just answer.
+    environment = dict(os.environ, base_url=handler.base_url,
+        probe_timeout=str(handler.probe_timeout))
+    start = time.perf_counter()
+    subprocess.run([ sys.executable, "-c", "import handler; handler.handle('')" ],
+        env=environment, check=True)
+    exited = time.perf_counter() - start
+    failing.clear()
+    slow.clear()
+    for (path, response) in zip(handler.probes, responses):
+        if ("error" in response) != (path in [ "/ip", "/uuid" ]):
+            print("    With /ip failing and /uuid too slow, " + path + " came back as " +
+                json.dumps(response) + ".")
+            failures = failures + 1
+    if elapsed > handler.probe_timeout * 1.5:
+        print("    Waited %.2f seconds for a slow probe; the timeout is %.2f." % (elapsed,
+            handler.probe_timeout))
+        failures = failures + 1
+    if exited > handler.probe_timeout * 1.5 + 1:
+        print("    A process waited %.2f seconds to exit for a slow probe; the timeout is "
+            "%.2f." % (exited, handler.probe_timeout))
+        failures = failures + 1
+
+    print("Checking the probes: " + str(failures) + " failures.")
+    return(failures)
+
+# Run a function a few times over.  Returns the fastest time, in milliseconds.
+def benchmark(function):
+    fastest = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+    return(fastest * 1000)
+
+# The probes the way v1.0 sent them.
+def legacy_handle(req):
+    return([ requests.get(handler.base_url + i).json() for i in handler.probes ])
+
+def benchmark_probes():
+    legacy = benchmark(lambda: legacy_handle(""))
+
+    workers = handler.probe_workers
+    handler.probe_workers = 1
+    handler.stop_threads()
+    sequential = benchmark(lambda: handler.handle(""))
+    handler.probe_workers = workers
+    together = benchmark(lambda: handler.handle(""))
+
+    print("%d probes: %8.1f ms with new connections, %8.1f ms over the session, %8.1f ms "
+        "at the same time (%.1fx)" % (len(handler.probes), legacy, sequential, together,
+        legacy / together))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for httpbin.")
+    parser.add_argument("--latency", type=float, default=50,
+        help="milliseconds the stand-in takes to answer")
+    arguments = parser.parse_args()
+
+    server = start_standin(arguments.latency / 1000)
+    handler.base_url = "http://127.0.0.1:" + str(server.server_address[1])
+    handler.probe_timeout = max(0.5, arguments.latency / 1000 * 4)
+
+    failures = check_probes()
+    if not failures:
+        benchmark_probes()
+    handler.stop_threads()
+    server.shutdown()
+    sys.exit(1 if failures else 0)
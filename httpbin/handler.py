@@ -1,29 +1,136 @@
 #!/usr/bin/env python3
 
+# Asks httpbin for a handful of things about the request (probes) and returns
+# a list of what it said, in the same order as the probes.
+#
+# The probes are sent at the same time over one keep-alive session, so the
+# function takes about as long as the slowest probe instead of all of them
+# added up.  A probe which fails, or which hasn't finished probe_timeout
+# seconds after the probes were sent, comes back as
+# { "error": "<what went wrong>" } without spoiling the others.  probe_timeout
+# is a deadline for the whole request.  requests can't be stopped in the middle
+# of a probe (its timeout is for each connect and each read, not the whole
+# thing), so a probe still running at the deadline is left to finish in the
+# background, and the threads which send the probes don't keep the process
+# from exiting.
+
+# v1.1 - Sent the probes at the same time over one session, with a deadline and
+#        partial results.  Made the base URL configurable.
+# v1.0 - Initial release.
+
+import concurrent.futures
 import json
+import os
+import queue
 import requests
 import sys
+import threading
+import time
 
-def handle(req):
-    # List of responses from httpbin.org
-    responses = []
+from requests.adapters import HTTPAdapter
+
+# Where httpbin is.  Point this at a local copy to test or benchmark the
+# function without going out to the Net.
+base_url = os.environ.get("base_url", "https://httpbin.org").rstrip("/")
+
+# The probes.
+probes = [ "/get", "/headers", "/ip", "/user-agent", "/uuid" ]
+
+# Seconds to wait for the probes.
+probe_timeout = float(os.environ.get("probe_timeout", 5))
 
-    url = "https://httpbin.org"
-    request = requests.get(url+"/get")
-    responses.append(request.json())
+# Number of probes to send at the same time.  1 (or less) sends them one after
+# another.
+probe_workers = int(os.environ.get("probe_workers", len(probes)))
 
-    request = requests.get(url+"/headers")
-    responses.append(request.json())
+# The session which all of the probes go through, with enough keep-alive
+# connections for all of them at once.
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(probe_workers, 1))
+session.mount("http://", adapter)
+session.mount("https://", adapter)
 
-    request = requests.get(url+"/ip")
-    responses.append(request.json())
+# The queue of probes to send, and how many threads are sending them, which
+# are started the first time they're needed.  They're daemon threads, so a
+# probe that's still hanging when the response goes out doesn't keep the
+# process from exiting.
+jobs = None
+workers = 0
 
-    request = requests.get(url+"/user-agent")
-    responses.append(request.json())
+# Start the threads if they aren't already running.  Even when the probes are
+# sent one after another, they're sent from a thread, so that the function can
+# stop waiting for them at the deadline.  Returns the queue of probes for the
+# threads to send.
+def start_threads():
+    global jobs
+    global workers
+    if jobs and workers != max(probe_workers, 1):
+        stop_threads()
+    if not jobs:
+        jobs = queue.Queue()
+        workers = max(probe_workers, 1)
+        for i in range(workers):
+            threading.Thread(target=send_probes, args=(jobs,), daemon=True).start()
+    return jobs
 
-    request = requests.get(url+"/uuid")
-    responses.append(request.json())
+# Tell the threads to stop when they've finished what they're doing (they'll be
+# started again if they're needed).
+def stop_threads():
+    global jobs
+    if jobs:
+        for i in range(workers):
+            jobs.put(None)
+    jobs = None
 
+# Runs in each thread.  Sends probes from the queue until it's told to stop.
+def send_probes(jobs):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        (path, deadline, future) = job
+        if future.set_running_or_notify_cancel():
+            future.set_result(probe(path, deadline))
+
+# Returns the error for a probe that didn't finish in time.
+def timed_out(path):
+    return({ "error": "Timed out getting " + path + " after " + str(probe_timeout) +
+        " seconds." })
+
+# Send one probe, unless the deadline (a time.monotonic() value) has already
+# passed.  Returns what httpbin said, or a hash table with an error message in
+# it.
+def probe(path, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return(timed_out(path))
+    try:
+        request = session.get(base_url + path, timeout=remaining)
+        request.raise_for_status()
+        return(request.json())
+    except requests.Timeout:
+        return(timed_out(path))
+    except (requests.RequestException, ValueError) as e:
+        return({ "error": "Couldn't get " + path + ": " + str(e) })
+
+def handle(req):
+    deadline = time.monotonic() + probe_timeout
+    pending = start_threads()
+
+    futures = []
+    for i in probes:
+        futures.append(concurrent.futures.Future())
+        pending.put((i, deadline, futures[-1]))
+    concurrent.futures.wait(futures, timeout=max(deadline - time.monotonic(), 0))
+
+    # List of responses from httpbin, or errors for the probes that didn't
+    # finish in time.
+    responses = []
+    for (path, future) in zip(probes, futures):
+        if future.done():
+            responses.append(future.result())
+        else:
+            responses.append(timed_out(path))
     return responses
 
 if __name__ == "__main__":
@@ -31,4 +138,5 @@ if __name__ == "__main__":
     output = handle("Test text.")
     for i in output:
         print(json.dumps(i, indent=4, sort_keys=True))
+    stop_threads()
     sys.exit(0)
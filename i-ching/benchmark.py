@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set expandtab tabstop=4 shiftwidth=4 :
+
+# Benchmarks for i-ching.  Run it from this directory:
+#   python3 benchmark.py
+
+# by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
+
+# v1.0 - Initial release.  Casting one reading per request and many at once.
+
+import json
+import time
+
+import handler
+
+# How many times each benchmark is run.  The fastest run is the one reported.
+repeats = 5
+
+# Send every request in a list to the function, a few times over.  Returns the fastest
+#   time for the whole list, in microseconds.
+def benchmark(requests):
+    fastest = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        for request in requests:
+            handler.handle(request)
+        elapsed = time.perf_counter() - start
+        if fastest is None or elapsed < fastest:
+            fastest = elapsed
+    return(fastest * 1000000)
+
+# Time the old way of casting a hexagram.
+def benchmark_hexagrams():
+    print("One hexagram as text: %.2f us" % (benchmark([ "" ] * 10000) / 10000))
+
+# Time casting readings one request apiece, and all of them in one request.
+def benchmark_readings():
+    for method in handler.methods:
+        for count in [ 10, 1000 ]:
+            separate = benchmark([ json.dumps({ "method": method }) ] * count)
+            together = benchmark([ json.dumps({ "method": method, "count": count }) ])
+            print("%4d readings with %-6s: %10.2f us in separate requests, %10.2f us in "
+                "one request (%.1fx)" % (count, method, separate, together,
+                separate / together))
+
+if __name__ == "__main__":
+    benchmark_hexagrams()
+    benchmark_readings()
@@ -5,178 +5,293 @@
 # This is a function which throws an i ching hexagram and returns it as a
 # string.  Optionally, if you run this utility from the command line, it'll
 # print the output as a primitive unit test.
+#
+# An empty request gets one hexagram the old way, as text.  A JSON request casts
+# readings the traditional way, with changing lines:
+#   { "method": "yarrow" | "coins", "count": <optional: number of readings>,
+#     "seed": <optional: number or string, to get the same readings every time> }
+# You'll get back a reading (or a list of count of them):
+#   { "lines": [ <line values, bottom line first> ], "changing": [ <line numbers> ],
+#     "primary": { "number": ..., "name": ..., "meaning": ..., "rows": ... },
+#     "relating": { ... } or null if no lines are changing }
+# or { "error": "<what's wrong with the request>" }.
 
 # by: The Doctor [412/724/301/703/415/510] <drwho at virtadpt dot net>
 # License: GPLv3
 
+# v1.2 - Added casting by three coins or by yarrow stalks, with changing lines and the
+#        relating hexagram, many readings per request, and seeds.
+# v1.1 - Rebuilt the table of hexagrams as a list of 64, one for every way six
+#        lines can come out, and worked out every response when the function
+#        starts.  Casting a hexagram is one six-bit random number and a lookup.
+#        Hexagram 26 had hexagram 5's lines, so 5 never came up and one cast
+#        had no hexagram at all; hexagram 11 linked to hexagram 12.
+# v1.0 - Initial release.
+
 # References used:
 #   https://en.wikipedia.org/wiki/I_Ching (CC-BY-SA v3.0 unported)
 #   https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching (CC-BY-SA v3.0 unported)
 
+import json
+import os
 import random
 import sys
 
 broken   = "--  --"
 unbroken = "------"
 
-# A lookup table of i ching hexagrams, to identify the throw.
-i_ching = {}
-i_ching["111111"] = { "number": 1, "name": "qian/force",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_1" }
-i_ching["000000"] = { "number": 2, "name": "kun/field",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_2" }
-i_ching["010001"] = { "number": 3, "name": "zhun/sprouting",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_3" }
-i_ching["100010"] = { "number": 4, "name": "meng/enveloping",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_4" }
-i_ching["010111"] = { "number": 5, "name": "xu/attending",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_5" }
-i_ching["111010"] = { "number": 6, "name": "song/arguing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_6" }
-i_ching["000010"] = { "number": 7, "name": "shi/leading",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_7" }
-i_ching["010000"] = { "number": 8, "name": "bi/grouping",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_8" }
-i_ching["110111"] = { "number": 9, "name": "xiao chu/small accumulating",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_9" }
-i_ching["111011"] = { "number": 10, "name": "lu/treading",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_10" }
-i_ching["000111"] = { "number": 11, "name": "tai/pervading",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_12" }
-i_ching["111000"] = { "number": 12, "name": "pi/obstruction",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_12" }
-i_ching["111101"] = { "number": 13, "name": "tong ren/concording people",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_13" }
-i_ching["101111"] = { "number": 14, "name": "da you/great possessing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_14" }
-i_ching["000100"] = { "number": 15, "name": "qian/humbling",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_15" } 
-i_ching["001000"] = { "number": 16, "name": "yu/providing for",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_16" }
-i_ching["011001"] = { "number": 17, "name": "sui/following",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_17" }
-i_ching["100110"] = { "number": 18, "name": "gu/correcting",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_18" }
-i_ching["000011"] = { "number": 19, "name": "lin/nearing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_19" }
-i_ching["110000"] = { "number": 20, "name": "guan/viewing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_20" }
-i_ching["101001"] = { "number": 21, "name": "shi ke/gnawing bite",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_21" }
-i_ching["100101"] = { "number": 22, "name": "bi/adorning",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_22" }
-i_ching["100000"] = { "number": 23, "name": "bo/stripping",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_23" }
-i_ching["000001"] = { "number": 24, "name": "fu/returning",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_24" }
-i_ching["111001"] = { "number": 25, "name": "wu wang/without embroiling",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_25" }
-i_ching["010111"] = { "number": 26, "name": "da chu/great accumulating",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_26" }
-i_ching["100001"] = { "number": 27, "name": "yi/swallowing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_27" }
-i_ching["011110"] = { "number": 28, "name": "da guo/great exceeding",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_28" }
-i_ching["010010"] = { "number": 29, "name": "kan/gorge",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_29" }
-i_ching["101101"] = { "number": 30, "name": "li/radiance",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_30" }
-i_ching["011100"] = { "number": 31, "name": "xian/conjoining",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_31" }
-i_ching["001110"] = { "number": 32, "name": "heng/persevering",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_32" }
-i_ching["111100"] = { "number": 33, "name": "dun/retiring",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_33" }
-i_ching["001111"] = { "number": 34, "name": "da zhuang/great invigorating",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_34" }
-i_ching["101000"] = { "number": 35, "name": "jin/prospering",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_35" }
-i_ching["000101"] = { "number": 36, "name": "ming yi/darkening of the light",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_36" }
-i_ching["110101"] = { "number": 37, "name": "jia ren/dwelling people",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_37" }
-i_ching["101011"] = { "number": 38, "name": "kui/polarizing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_38" }
-i_ching["010100"] = { "number": 39, "name": "jian/limping",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_39" }
-i_ching["001010"] = { "number": 40, "name": "xie/taking apart",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_40" }
-i_ching["100011"] = { "number": 41, "name": "sun/diminishing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_41" }
-i_ching["110001"] = { "number": 42, "name": "yi/augmenting",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_42" }
-i_ching["011111"] = { "number": 43, "name": "guai/displacement",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_43" }
-i_ching["111110"] = { "number": 44, "name": "gou/coupling",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_44" }
-i_ching["011000"] = { "number": 45, "name": "cui/clustering",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_45" }
-i_ching["000110"] = { "number": 46, "name": "sheng/ascending",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_46" }
-i_ching["011010"] = { "number": 47, "name": "kun/confining",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_47" }
-i_ching["010110"] = { "number": 48, "name": "jing/welling",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_48" }
-i_ching["011101"] = { "number": 49, "name": "ge/skinning",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_49" }
-i_ching["101110"] = { "number": 50, "name": "ding/holding",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_50" }
-i_ching["001001"] = { "number": 51, "name": "zhen/shake",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_51" }
-i_ching["100100"] = { "number": 52, "name": "gen/bound",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_52" }
-i_ching["110100"] = { "number": 53, "name": "jian/infiltrating",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_53" }
-i_ching["001011"] = { "number": 54, "name": "gui mei/converting the maiden",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_54" }
-i_ching["001101"] = { "number": 55, "name": "feng/abounding",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_55" }
-i_ching["101100"] = { "number": 56, "name": "lu/sojourning",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_56" }
-i_ching["110110"] = { "number": 57, "name": "xun/ground",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_57" }
-i_ching["011011"] = { "number": 58, "name": "dui/open",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_58" }
-i_ching["110010"] = { "number": 59, "name": "huan/dispersing",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_59" }
-i_ching["010011"] = { "number": 60, "name": "jie/articulating",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_60" }
-i_ching["110011"] = { "number": 61, "name": "zhong fu/center returning",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_61" }
-i_ching["001100"] = { "number": 62, "name": "xiao guo/small exceeding",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_62" }
-i_ching["010101"] = { "number": 63, "name": "ji ji/already fording",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_63" }
-i_ching["101010"] = { "number": 64, "name": "wei ji/not yet fording",
-    "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_64" }
+# Every i ching hexagram, to identify the throw.  A hexagram's lines are six bits, top
+# line first, where 1 is an unbroken line and 0 is a broken one, so the lines of a throw
+# are the index of its hexagram in the list.
+hexagrams = [ None ] * 64
+
+def hexagram(rows, number, name):
+    hexagrams[int(rows, 2)] = { "rows": rows, "number": number, "name": name,
+        "meaning": "https://en.wikipedia.org/wiki/List_of_hexagrams_of_the_I_Ching#Hexagram_" +
+            str(number) }
+
+hexagram("111111", 1, "qian/force")
+hexagram("000000", 2, "kun/field")
+hexagram("010001", 3, "zhun/sprouting")
+hexagram("100010", 4, "meng/enveloping")
+hexagram("010111", 5, "xu/attending")
+hexagram("111010", 6, "song/arguing")
+hexagram("000010", 7, "shi/leading")
+hexagram("010000", 8, "bi/grouping")
+hexagram("110111", 9, "xiao chu/small accumulating")
+hexagram("111011", 10, "lu/treading")
+hexagram("000111", 11, "tai/pervading")
+hexagram("111000", 12, "pi/obstruction")
+hexagram("111101", 13, "tong ren/concording people")
+hexagram("101111", 14, "da you/great possessing")
+hexagram("000100", 15, "qian/humbling")
+hexagram("001000", 16, "yu/providing for")
+hexagram("011001", 17, "sui/following")
+hexagram("100110", 18, "gu/correcting")
+hexagram("000011", 19, "lin/nearing")
+hexagram("110000", 20, "guan/viewing")
+hexagram("101001", 21, "shi ke/gnawing bite")
+hexagram("100101", 22, "bi/adorning")
+hexagram("100000", 23, "bo/stripping")
+hexagram("000001", 24, "fu/returning")
+hexagram("111001", 25, "wu wang/without embroiling")
+hexagram("100111", 26, "da chu/great accumulating")
+hexagram("100001", 27, "yi/swallowing")
+hexagram("011110", 28, "da guo/great exceeding")
+hexagram("010010", 29, "kan/gorge")
+hexagram("101101", 30, "li/radiance")
+hexagram("011100", 31, "xian/conjoining")
+hexagram("001110", 32, "heng/persevering")
+hexagram("111100", 33, "dun/retiring")
+hexagram("001111", 34, "da zhuang/great invigorating")
+hexagram("101000", 35, "jin/prospering")
+hexagram("000101", 36, "ming yi/darkening of the light")
+hexagram("110101", 37, "jia ren/dwelling people")
+hexagram("101011", 38, "kui/polarizing")
+hexagram("010100", 39, "jian/limping")
+hexagram("001010", 40, "xie/taking apart")
+hexagram("100011", 41, "sun/diminishing")
+hexagram("110001", 42, "yi/augmenting")
+hexagram("011111", 43, "guai/displacement")
+hexagram("111110", 44, "gou/coupling")
+hexagram("011000", 45, "cui/clustering")
+hexagram("000110", 46, "sheng/ascending")
+hexagram("011010", 47, "kun/confining")
+hexagram("010110", 48, "jing/welling")
+hexagram("011101", 49, "ge/skinning")
+hexagram("101110", 50, "ding/holding")
+hexagram("001001", 51, "zhen/shake")
+hexagram("100100", 52, "gen/bound")
+hexagram("110100", 53, "jian/infiltrating")
+hexagram("001011", 54, "gui mei/converting the maiden")
+hexagram("001101", 55, "feng/abounding")
+hexagram("101100", 56, "lu/sojourning")
+hexagram("110110", 57, "xun/ground")
+hexagram("011011", 58, "dui/open")
+hexagram("110010", 59, "huan/dispersing")
+hexagram("010011", 60, "jie/articulating")
+hexagram("110011", 61, "zhong fu/center returning")
+hexagram("001100", 62, "xiao guo/small exceeding")
+hexagram("010101", 63, "ji ji/already fording")
+hexagram("101010", 64, "wei ji/not yet fording")
+
+# Draw a hexagram as ASCII art, top line first.
+def draw(rows):
+    return("".join([ unbroken + "\n" if i == "1" else broken + "\n" for i in rows ]))
+
+# Work out what to say for every hexagram ahead of time.
+def render(hexagram):
+    return("Your i ching hexagram is number " + str(hexagram["number"]) + " (" +
+        hexagram["name"] + ").\n\n" + draw(hexagram["rows"]) + "\n" +
+        hexagram["meaning"] + "\n")
+
+responses = [ render(i) for i in hexagrams ]
+
+# The same for readings sent back as JSON, keyed by hexagram number.
+hexagram_json = {}
+for i in hexagrams:
+    hexagram_json[i["number"]] = json.dumps(i)
+
+# Most readings that can be cast in one request.
+max_count = int(os.environ.get("max_count", 10000))
+
+# Ways of casting a line.  Every line is cast from four random bits, and each method is the
+#   value of the line for each of the 16 ways that they can come out: 6 is old yin (broken,
+#   and changing), 7 is young yang (unbroken), 8 is young yin (broken), and 9 is old yang
+#   (unbroken, and changing).
+# Three coins are worth 3 for heads and 2 for tails, so they use three of the bits and come
+#   up 6 and 9 1/8 of the time apiece, and 7 and 8 3/8.  The yarrow stalks come up 6 1/16
+#   of the time, 7 5/16, 8 7/16, and 9 3/16.
+methods = {}
+methods["coins"] = [ 6 + (i & 1) + (i >> 1 & 1) + (i >> 2 & 1) for i in range(16) ]
+methods["yarrow"] = [ 6 ] * 1 + [ 7 ] * 5 + [ 8 ] * 7 + [ 9 ] * 3
+
+# Cast every trigram there can be from twelve random bits (three lines, bottom line in the
+#   low bits) with a method.  Returns a list of 4096 tuples: the values of the lines, the
+#   trigram's lines before and after they change as bits (bottom line in the low bit), and
+#   the numbers of the lines which change if it's the lower trigram, and if it's the upper.
+def trigrams(method):
+    table = []
+    for i in range(4096):
+        lines = [ method[i >> (4 * j) & 15] for j in range(3) ]
+        primary = 0
+        relating = 0
+        changing = []
+        for (j, line) in enumerate(lines):
+            primary = primary | (line & 1) << j
+            if line == 6 or line == 9:
+                relating = relating | (1 - (line & 1)) << j
+                changing.append(j + 1)
+            else:
+                relating = relating | (line & 1) << j
+        table.append((lines, primary, relating, changing, [ j + 3 for j in changing ]))
+    return(table)
+
+trigram_tables = {}
+for method in methods:
+    trigram_tables[method] = trigrams(methods[method])
+
+# Cast count readings at once, with one draw of three random bytes per reading.  A seed
+#   gets the same readings every time.  Returns a list of readings.
+def cast(method="yarrow", count=1, seed=None):
+    generator = random if seed is None else random.Random(seed)
+    table = trigram_tables[method]
+    draw = generator.randbytes(3 * count)
+    readings = []
+    for i in range(0, len(draw), 3):
+        bits = int.from_bytes(draw[i:i + 3], "little")
+        lower = table[bits & 4095]
+        upper = table[bits >> 12]
+
+        reading = {}
+        reading["lines"] = lower[0] + upper[0]
+        reading["changing"] = lower[3] + upper[4]
+        reading["primary"] = hexagrams[upper[1] << 3 | lower[1]]
+        reading["relating"] = None
+        if reading["changing"]:
+            reading["relating"] = hexagrams[upper[2] << 3 | lower[2]]
+        readings.append(reading)
+    return(readings)
+
+# Turn a reading into JSON.  Lists of whole numbers look the same in Python and JSON, and
+#   the hexagrams are already JSON, so this is a lot faster than json.dumps().  Returns a
+#   string.
+def reading_json(reading):
+    relating = "null"
+    if reading["relating"]:
+        relating = hexagram_json[reading["relating"]["number"]]
+    return('{"lines": ' + str(reading["lines"]) + ', "changing": ' +
+        str(reading["changing"]) + ', "primary": ' +
+        hexagram_json[reading["primary"]["number"]] + ', "relating": ' + relating + "}")
+
+# Make sure that a request to cast readings makes sense.  Returns an error message if it
+#   doesn't, None if it does.
+def validate(arguments):
+    method = arguments.get("method", "yarrow")
+    if not isinstance(method, str) or method not in methods:
+        return("I don't know how to cast with that.  Try one of: " +
+            ", ".join(sorted(methods)) + ".")
+    count = arguments.get("count", 1)
+    if type(count) is not int or count < 1 or count > max_count:
+        return("count has to be a whole number from 1 to " + str(max_count) + ".")
+    if type(arguments.get("seed")) not in [ type(None), int, str ]:
+        return("seed has to be a number or a string.")
+    return(None)
 
 def handle(req):
-    hexagram = ""
-    coin_flip = 0
-    rows = ""
-    response = ""
-
-    # Generate a hexagram by flipping a coin six times.  Each time, add a
-    # line to the hexagram.
-    for i in range(0, 6):
-        coin_flip = random.randint(0, 1)
-        # Heads.
-        if coin_flip == 0:
-            hexagram = hexagram + broken + "\n"
-            rows = rows + "0"
-
-        # Tails.
-        if coin_flip == 1:
-            hexagram = hexagram + unbroken + "\n"
-            rows = rows + "1"
-
-    response = "Your i ching hexagram is number " + str(i_ching[rows]["number"]) + " "
-    response = response + "(" + i_ching[rows]["name"] + ").\n\n" + hexagram + "\n"
-    response = response + i_ching[rows]["meaning"] + "\n"
-
-    return response
+    # Anything that isn't a JSON request gets one hexagram, the old way.  Six coin flips
+    # are six random bits.
+    try:
+        arguments = json.loads(req)
+    except (TypeError, ValueError):
+        arguments = None
+    if type(arguments) is not dict:
+        return(responses[random.getrandbits(6)])
+
+    error = validate(arguments)
+    if error:
+        return(json.dumps({ "error": error }))
+    readings = cast(arguments.get("method", "yarrow"), arguments.get("count", 1),
+        arguments.get("seed"))
+    if "count" not in arguments:
+        return(reading_json(readings[0]))
+    return("[" + ", ".join(map(reading_json, readings)) + "]")
 
 if __name__ == "__main__":
     print("Unit testing mode enabled.")
-    print(handle())
+    print(handle(None))
+
+    # Every way six lines can come out has to be a different hexagram.
+    numbers = [ i["number"] for i in hexagrams if i ]
+    if len(numbers) != 64 or sorted(numbers) != list(range(1, 65)):
+        print("The table of hexagrams is broken: " + str(64 - len(numbers)) +
+            " throws have no hexagram, and " + str(64 - len(set(numbers))) +
+            " hexagrams can't be thrown.")
+        sys.exit(1)
+    for (i, hexagram) in enumerate(hexagrams):
+        if int(hexagram["rows"], 2) != i:
+            print("Hexagram " + str(hexagram["number"]) + " is in the wrong place.")
+            sys.exit(1)
+    print("All 64 throws are different hexagrams.")
+
+    # Lines have to come up as often as the method says, out of 16.
+    odds = {}
+    odds["coins"] = [ 2, 6, 6, 2 ]
+    odds["yarrow"] = [ 1, 5, 7, 3 ]
+    for method in methods:
+        if [ methods[method].count(i) for i in range(6, 10) ] != odds[method]:
+            print("Casting with " + method + " comes out with the wrong odds.")
+            sys.exit(1)
+
+    print(handle(json.dumps({ "method": "yarrow", "seed": 64 })))
+    for method in methods:
+        readings = json.loads(handle(json.dumps({ "method": method, "count": 1000,
+            "seed": "test" })))
+        if readings != json.loads(handle(json.dumps({ "method": method, "count": 1000,
+            "seed": "test" }))):
+            print("The same seed cast different readings with " + method + ".")
+            sys.exit(1)
+        for reading in readings:
+            # The primary hexagram is made of the lines, and the relating hexagram is the
+            # primary hexagram with the changing lines changed.
+            rows = "".join([ str(i & 1) for i in reversed(reading["lines"]) ])
+            changing = [ i + 1 for (i, line) in enumerate(reading["lines"])
+                if line in [ 6, 9 ] ]
+            relating = None
+            if changing:
+                relating = hexagrams[int(rows, 2) ^ sum([ 1 << (i - 1) for i in changing ])]
+            if reading["primary"]["rows"] != rows or reading["changing"] != changing or \
+                    reading["relating"] != relating:
+                print("Cast a reading wrong with " + method + ": " + json.dumps(reading))
+                sys.exit(1)
+        print("Cast " + str(len(readings)) + " readings with " + method + ".")
+
+    for arguments in [ { "method": "tea leaves" }, { "count": 0 },
+            { "count": max_count + 1 }, { "count": "3" }, { "seed": [ 1 ] },
+            { "method": [] }, { "method": {} } ]:
+        result = json.loads(handle(json.dumps(arguments)))
+        if "error" not in result:
+            print("Didn't reject " + json.dumps(arguments) + ".")
+            sys.exit(1)
+    print("Rejected bad requests.")
     sys.exit(0)